@@ -0,0 +1,6 @@
+from django.apps import AppConfig
+
+
+class TethnewebConfig(AppConfig):
+    name = 'tethneweb'
+
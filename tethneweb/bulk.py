@@ -0,0 +1,103 @@
+"""
+Writers used to push batches of rows into the database.
+
+Rows are plain ``dict``\s keyed on field attribute names (e.g. ``paper_id``),
+as produced by :class:`tethneweb.ingest.PaperTransformer`\.
+"""
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.encoding import force_text
+from psycopg2.extras import Json
+
+import cStringIO
+
+
+class BulkCreateWriter(object):
+    """
+    Writes rows with ``bulk_create``\, instantiating a model for each row.
+    """
+    name = 'bulk_create'
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+
+    def write(self, model, rows):
+        if not rows:
+            return 0
+        model.objects.using(self.using).bulk_create([model(**row) for row in rows])
+        return len(rows)
+
+
+class CopyWriter(object):
+    """
+    Streams rows into PostgreSQL with ``COPY ... FROM STDIN``\.
+
+    No model instances are created; values are prepared directly from the row
+    ``dict``\s using the field definitions of the target model.
+    """
+    name = 'copy'
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self._columns = {}
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def _get_columns(self, model):
+        if model not in self._columns:
+            self._columns[model] = [field for field in model._meta.concrete_fields]
+        return self._columns[model]
+
+    def _prepare(self, field, row, now):
+        if field.attname in row:
+            value = row[field.attname]
+        elif getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            value = now
+        else:
+            value = field.get_default()
+        return field.get_db_prep_save(value, connection=self.connection)
+
+    def _format(self, value):
+        if value is None:
+            return '\\N'
+        if value is True:
+            return 't'
+        if value is False:
+            return 'f'
+        if isinstance(value, Json):
+            value = value.dumps(value.adapted)
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        value = force_text(value)
+        value = value.replace('\\', '\\\\').replace('\n', '\\n')\
+                     .replace('\r', '\\r').replace('\t', '\\t')
+        return value.encode('utf-8')
+
+    def write(self, model, rows):
+        if not rows:
+            return 0
+        fields = self._get_columns(model)
+        now = timezone.now()
+        buf = cStringIO.StringIO()
+        for row in rows:
+            buf.write('\t'.join([self._format(self._prepare(field, row, now))
+                                 for field in fields]))
+            buf.write('\n')
+        buf.seek(0)
+
+        quote = self.connection.ops.quote_name
+        sql = 'COPY %s (%s) FROM STDIN' % (
+            quote(model._meta.db_table),
+            ', '.join([quote(field.column) for field in fields]))
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(sql, buf)
+        return len(rows)
+
+
+WRITERS = {
+    BulkCreateWriter.name: BulkCreateWriter,
+    CopyWriter.name: CopyWriter,
+}
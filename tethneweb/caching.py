@@ -0,0 +1,122 @@
+"""
+A cache of serialized list responses.
+
+:class:`CachedListMixin` keeps the data of list responses in the Django cache
+named by :data:`CACHE_ALIAS` (see ``CACHES`` in the settings; local memory by
+default, or files shared between processes if ``RESPONSE_CACHE_DIR`` is set).
+Entries are keyed on the view, the user, the host and path, and the query
+parameters (sorted, so that their order doesn't matter).
+
+Entries are never deleted explicitly. Instead, the key also includes the
+version of the data it was made from (see :mod:`tethneweb.versions`\): the
+version of the corpus for lists scoped with ``?corpus=``\, and otherwise the
+versions of all of the user's corpora (every listing is limited to the user's
+own objects, so nothing else can change it). Writing to a corpus bumps its
+version, so stale entries are simply no longer found, and expire.
+"""
+
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.db.models import Count, Max, Sum
+from rest_framework.response import Response
+
+import hashlib
+
+from tethneweb.models import Corpus
+
+
+CACHE_ALIAS = 'responses'
+
+IGNORED_PARAMS = set(['format'])
+"""Query parameters that don't change the data of a response."""
+
+HITS = 'stats:hits'
+MISSES = 'stats:misses'
+
+
+def get_cache():
+    try:
+        return caches[CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        return None
+
+
+def _count(cache, key):
+    # Statistics don't expire.
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:    # Evicted in the meantime.
+            cache.add(key, 1, timeout=None)
+
+
+def stats():
+    """
+    Returns hits, misses and the hit rate of the response cache. With the
+    local memory backend these are for the current process only.
+    """
+    cache = get_cache()
+    if cache is None:
+        return {'enabled': False}
+    hits = cache.get(HITS, 0)
+    misses = cache.get(MISSES, 0)
+    return {
+        'enabled': True,
+        'backend': '%s.%s' % (cache.__class__.__module__, cache.__class__.__name__),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': float(hits) / (hits + misses) if hits + misses else None,
+    }
+
+
+def user_version(user_id):
+    """
+    A token that changes whenever any of the user's corpora change, or a
+    corpus is created or deleted.
+    """
+    state = Corpus.objects.filter(created_by=user_id)\
+                          .aggregate(count=Count('id'), version=Sum('version'),
+                                     last_modified=Max('last_modified'))
+    return (state['count'], state['version'], state['last_modified'])
+
+
+class CachedListMixin(object):
+    """
+    Serves list responses from the response cache, and adds ``X-Cache: HIT``
+    or ``X-Cache: MISS`` to them.
+    """
+
+    def get_cache_key(self, request, version):
+        params = sorted([(name, sorted(values)) for name, values
+                         in request.query_params.lists()
+                         if name not in IGNORED_PARAMS])
+        key = repr((self.__class__.__name__, request.user.pk,
+                    request.build_absolute_uri(request.path), params, version))
+        return 'list:%s' % hashlib.md5(key).hexdigest()
+
+    def get_data_version(self, request):
+        # Set by ConditionalGetMixin, if the list is scoped to one corpus.
+        state = getattr(self, 'corpus_state', None)
+        if state is not None:
+            return ('corpus',) + tuple(state)
+        return ('user',) + user_version(request.user.pk)
+
+    def list(self, request, *args, **kwargs):
+        cache = get_cache()
+        if cache is None:
+            return super(CachedListMixin, self).list(request, *args, **kwargs)
+
+        key = self.get_cache_key(request, self.get_data_version(request))
+        data = cache.get(key)
+        if data is not None:
+            _count(cache, HITS)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        _count(cache, MISSES)
+        response = super(CachedListMixin, self).list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
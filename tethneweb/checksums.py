@@ -0,0 +1,37 @@
+"""
+Lookup of papers by checksum, for uniqueness checks.
+"""
+
+from tethneweb.models import PaperInstance
+
+
+def existing_papers(corpus_id, checksums):
+    """
+    Find the papers in a corpus that have any of ``checksums``\.
+
+    This is one query on the ``(corpus, checksum)`` index, however many
+    checksums there are (they are passed as a single array parameter).
+
+    Parameters
+    ----------
+    corpus_id : int
+    checksums : iterable
+
+    Returns
+    -------
+    dict
+        Maps each checksum that is already in the corpus onto the (lowest) ID
+        of a paper that has it.
+    """
+    checksums = list(set(checksums))
+    if not checksums:
+        return {}
+    table = PaperInstance._meta.db_table
+    query = PaperInstance.objects.filter(corpus_id=corpus_id)\
+                         .extra(where=['"%s"."checksum" = ANY(%%s)' % table],
+                                params=[checksums])
+
+    existing = {}
+    for paper_id, checksum in query.order_by('-id').values_list('id', 'checksum'):
+        existing[checksum] = paper_id
+    return existing
@@ -0,0 +1,189 @@
+"""
+Row counts that don't need a ``COUNT(*)``\.
+
+Each :class:`.Corpus` has a :class:`.CorpusCounter` per kind of row (see
+:data:`COUNTERS`\). Counters are incremented by :func:`record` in the same
+transaction that writes the rows (the loader, the bulk upload endpoint and the
+``create()`` views), moved by :func:`record_update` when the REST views change
+the corpus of an object or the ``concrete`` flag of a paper, and decremented
+by :func:`record_delete` when they delete an object (with everything that
+cascades from it). There are no
+per-row ``post_delete`` receivers, which would stop Django from deleting
+cascaded rows in bulk. Rows deleted in other ways (e.g. in the admin) are not
+counted; if the counters ever drift, ``manage.py recount`` rebuilds them.
+
+For counts that no counter covers, :func:`estimate` asks the PostgreSQL
+planner instead of scanning.
+"""
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Count, F, Sum
+
+import json
+from collections import Counter
+
+from tethneweb.models import *
+from tethneweb.ids import allocator
+
+
+def _paper_counter(row):
+    return 'papers' if _get(row, 'concrete', True) else 'citations'
+
+
+COUNTERS = {
+    PaperInstance: _paper_counter,
+    AuthorInstance: lambda row: 'authors',
+    InstitutionInstance: lambda row: 'institutions',
+    AffiliationInstance: lambda row: 'affiliations',
+    InstanceIdentifier: lambda row: 'identifiers',
+    InstanceMetadatum: lambda row: 'metadata',
+    InstanceMetadataDocument: lambda row: 'metadata_documents',
+}
+"""Maps counted models onto a function that names the counter for a row."""
+
+COUNTER_NAMES = ['papers', 'citations', 'authors', 'institutions',
+                 'affiliations', 'identifiers', 'metadata', 'metadata_documents']
+
+
+def _get(row, attname, default=None):
+    if isinstance(row, dict):
+        return row.get(attname, default)
+    return getattr(row, attname, default)
+
+
+def tally(model, rows):
+    """
+    Count ``rows`` (``dict``\s or model instances) by corpus and counter.
+
+    Returns
+    -------
+    :class:`collections.Counter`
+        Keyed on ``(corpus id, counter name)``\.
+    """
+    counter = COUNTERS.get(model)
+    if counter is None:
+        return Counter()
+    return Counter([(_get(row, 'corpus_id'), counter(row)) for row in rows])
+
+
+def record(model, rows):
+    """
+    Add ``rows`` of ``model``\, about to be (or just) written, to the counters.
+    """
+    increment(tally(model, rows))
+
+
+def increment(deltas):
+    """
+    Apply ``deltas`` (from :func:`tally`\) to the counters, creating any that
+    don't exist yet.
+    """
+    for (corpus_id, name), delta in deltas.iteritems():
+        if not delta:
+            continue
+        counters = CorpusCounter.objects.filter(corpus_id=corpus_id, name=name)
+        if counters.update(value=F('value') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                CorpusCounter.objects.create(id=allocator.next_id(CorpusCounter),
+                                             corpus_id=corpus_id, name=name,
+                                             value=delta)
+        except IntegrityError:    # Created concurrently.
+            counters.update(value=F('value') + delta)
+
+
+def record_update(model, before, rows):
+    """
+    Move ``rows`` of ``model``\, just saved, from the counters that they were
+    in (``before``\, from :func:`tally`\) to the counters that they are in now.
+    """
+    deltas = tally(model, rows)
+    deltas.subtract(before)
+    increment(deltas)
+
+
+def corpus_counts(corpus):
+    """
+    Returns a ``dict`` of counter names and values for ``corpus``\.
+    """
+    counts = {name: 0 for name in COUNTER_NAMES}
+    counts.update({counter.name: counter.value for counter in corpus.counters.all()})
+    return counts
+
+
+def totals():
+    """
+    Returns a ``dict`` of counter names and their values summed over all
+    corpora, in one query.
+    """
+    return {row['name']: row['total'] for row
+            in CorpusCounter.objects.values('name').annotate(total=Sum('value'))}
+
+
+def recount(corpus):
+    """
+    Rebuild the counters of ``corpus`` from the rows themselves.
+    """
+    deltas = Counter()
+    with transaction.atomic():
+        CorpusCounter.objects.filter(corpus=corpus).delete()
+        for model, counter in COUNTERS.iteritems():
+            queryset = model.objects.filter(corpus=corpus)
+            if model is PaperInstance:
+                for row in queryset.values('concrete').annotate(count=Count('id')):
+                    deltas[(corpus.id, counter(row))] += row['count']
+            else:
+                deltas[(corpus.id, counter(None))] += queryset.count()
+        increment(deltas)
+
+
+def estimate(queryset):
+    """
+    The planner's estimate of the number of rows in ``queryset``\. For an
+    unfiltered queryset this is the table statistic; otherwise the estimate
+    for the query's plan.
+    """
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class'
+                           ' WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            return max(cursor.fetchone()[0], 0)
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+def record_delete(instance, deleted):
+    """
+    Subtract ``instance`` and the rows deleted with it from the counters of
+    its corpus, with one update per counter. ``deleted`` is the count of
+    deleted rows per model label, as returned by ``instance.delete()``\.
+
+    Deleting a corpus deletes its counters too, so there is nothing to do.
+    """
+    if isinstance(instance, Corpus):
+        return
+    labels = {model._meta.label: model for model in COUNTERS}
+    deltas = Counter()
+    for label, count in deleted.iteritems():
+        model = labels.get(label)
+        if model is None or not count:
+            continue
+        if model is type(instance):
+            deltas[(instance.corpus_id, COUNTERS[model](instance))] -= 1
+            count -= 1
+        if model is PaperInstance:
+            # Papers cascade only to the citations that they cite.
+            deltas[(instance.corpus_id, 'citations')] -= count
+        else:
+            deltas[(instance.corpus_id, COUNTERS[model](None))] -= count
+    # Only update: there is no counter to create for a negative delta.
+    for (corpus_id, name), delta in deltas.iteritems():
+        if delta:
+            CorpusCounter.objects.filter(corpus_id=corpus_id, name=name)\
+                                 .update(value=F('value') + delta)
@@ -0,0 +1,174 @@
+"""
+Dropping and rebuilding secondary indexes and foreign key constraints around
+large loads.
+
+Maintaining every index row-by-row during an initial load is much slower than
+building each index once at the end. :func:`drop_deferrable` records the
+definition of each secondary index and foreign key constraint on a set of
+tables as a :class:`.DeferredIndex`\, in the same transaction that drops them,
+along with the :class:`.IngestRun` that dropped them; :func:`restore_deferred`
+recreates them and removes the records. A run that is killed before it can
+restore its indexes therefore leaves the definitions behind. The loader
+rebuilds them before it starts (see :func:`restore_abandoned`\) once their
+run has stopped: it is no longer marked as running, or it has not committed
+anything for :data:`STALE_AFTER` (as when it was killed outright, and could
+not mark itself as failed). ``--restore-indexes`` rebuilds them regardless.
+
+Primary keys and unique indexes are left alone: they enforce constraints that
+the loader relies on. So are indexes that the caller names in ``keep``\, such
+as the one on ``(corpus, checksum)`` that the loader queries for each batch
+to find duplicate records; without it, each of those queries would scan every
+row loaded so far.
+"""
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import timezone
+
+import datetime
+
+from tethneweb.models import DeferredIndex, IngestRun
+from tethneweb.ids import allocator
+
+
+STALE_AFTER = datetime.timedelta(hours=1)
+"""A running run that hasn't committed for this long is taken to be dead."""
+
+
+INDEX_QUERY = """
+SELECT idx.relname, pg_get_indexdef(idx.oid),
+       ARRAY(SELECT attname::text FROM pg_attribute
+             WHERE attrelid = pg_index.indrelid
+               AND attnum = ANY(pg_index.indkey))
+FROM pg_index
+JOIN pg_class idx ON idx.oid = pg_index.indexrelid
+WHERE pg_index.indrelid = %s::regclass
+  AND NOT pg_index.indisprimary
+  AND NOT pg_index.indisunique
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint
+                  WHERE pg_constraint.conindid = pg_index.indexrelid)
+"""
+
+CONSTRAINT_QUERY = """
+SELECT conname, pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE conrelid = %s::regclass AND contype = 'f'
+"""
+
+
+def drop_deferrable(models, keep=(), run=None, using=DEFAULT_DB_ALIAS):
+    """
+    Drops the secondary indexes and foreign key constraints on the tables of
+    ``models``\, recording their definitions.
+
+    Parameters
+    ----------
+    models : list
+    keep : list
+        ``(model, fields)`` tuples; an index on exactly these fields of the
+        model is not dropped.
+    run : :class:`.IngestRun`
+        The run that the indexes are dropped for.
+    using : str
+
+    Returns
+    -------
+    list
+        The :class:`.DeferredIndex` records that were created.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    kept = set([(model._meta.db_table,
+                 frozenset([model._meta.get_field(name).column for name in fields]))
+                for model, fields in keep])
+    deferred = []
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            for model in models:
+                table = model._meta.db_table
+                cursor.execute(CONSTRAINT_QUERY, [table])
+                for name, definition in cursor.fetchall():
+                    deferred.append(DeferredIndex(table=table, name=name, run=run,
+                                                  kind=DeferredIndex.CONSTRAINT,
+                                                  definition=definition))
+                cursor.execute(INDEX_QUERY, [table])
+                for name, definition, columns in cursor.fetchall():
+                    if (table, frozenset(columns)) in kept:
+                        continue
+                    deferred.append(DeferredIndex(table=table, name=name, run=run,
+                                                  kind=DeferredIndex.INDEX,
+                                                  definition=definition))
+
+            if not deferred:
+                return deferred
+            ids = allocator.reserve(DeferredIndex, len(deferred))
+            for new_id, record in zip(ids, deferred):
+                record.id = new_id
+            DeferredIndex.objects.using(using).bulk_create(deferred)
+
+            # Constraints first, since a constraint may depend on an index.
+            for record in deferred:
+                if record.kind == DeferredIndex.CONSTRAINT:
+                    cursor.execute('ALTER TABLE %s DROP CONSTRAINT %s' % \
+                                   (quote(record.table), quote(record.name)))
+            for record in deferred:
+                if record.kind == DeferredIndex.INDEX:
+                    cursor.execute('DROP INDEX %s' % quote(record.name))
+    return deferred
+
+
+def restore_deferred(run=None, records=None, using=DEFAULT_DB_ALIAS):
+    """
+    Rebuilds the indexes and constraints recorded by :func:`drop_deferrable`
+    for ``run``\, or those in ``records`` (a queryset), or else all of them.
+
+    Each one is rebuilt (and its record removed) in its own transaction, so a
+    failure (e.g. a foreign key that no longer holds) leaves the remaining
+    records in place to be retried.
+
+    Returns
+    -------
+    int
+        The number of indexes and constraints that were rebuilt.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    if records is None:
+        records = DeferredIndex.objects.all()
+    if run is not None:
+        records = records.filter(run=run)
+    # Indexes first, so that they are available when constraints are checked.
+    pending = sorted(records.using(using),
+                     key=lambda record: (record.kind != DeferredIndex.INDEX,
+                                         record.id))
+    for record in pending:
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                if record.kind == DeferredIndex.INDEX:
+                    cursor.execute(record.definition)
+                else:
+                    cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % \
+                                   (quote(record.table), quote(record.name),
+                                    record.definition))
+            record.delete()
+    return len(pending)
+
+
+def abandoned(using=DEFAULT_DB_ALIAS):
+    """
+    The :class:`.DeferredIndex` records whose runs have stopped: they are
+    gone, no longer running, or haven't committed for :data:`STALE_AFTER`\.
+    """
+    stale = timezone.now() - STALE_AFTER
+    return DeferredIndex.objects.using(using).filter(
+        Q(run__isnull=True) | ~Q(run__status=IngestRun.RUNNING)
+        | Q(run__date_modified__lt=stale))
+
+
+def restore_abandoned(using=DEFAULT_DB_ALIAS):
+    """
+    Rebuilds the indexes and constraints left behind by runs that have
+    stopped (see :func:`abandoned`\).
+    """
+    return restore_deferred(records=abandoned(using=using), using=using)
+
@@ -0,0 +1,150 @@
+"""
+Streaming export of the rows of a corpus, as NDJSON or CSV.
+
+Rows are read through a server-side cursor in primary key order and written
+out as they arrive, so an export holds roughly one chunk of rows in memory
+however large the corpus is. Papers can carry their authors,
+identifiers and affiliations inline; these are fetched per chunk of papers,
+with one query per kind.
+"""
+
+from django.db import connection, transaction
+
+import csv
+import json
+import uuid
+import cStringIO
+from collections import defaultdict, OrderedDict
+
+from tethneweb.models import *
+
+
+EXPORTS = OrderedDict([
+    ('paper', (PaperInstance, ['id', 'publication_date', 'title', 'volume',
+                               'issue', 'journal', 'abstract', 'concrete',
+                               'cited_by_id', 'checksum'])),
+    ('citation', (InstanceCitation, ['id', 'citing_id', 'cited_id'])),
+    ('author', (AuthorInstance, ['id', 'paper_id', 'first_name', 'last_name'])),
+    ('institution', (InstitutionInstance, ['id', 'paper_id', 'name',
+                                           'department', 'address', 'state',
+                                           'city', 'zip', 'country'])),
+    ('affiliation', (AffiliationInstance, ['id', 'paper_id', 'author_id',
+                                           'institution_id', 'confidence'])),
+    ('identifier', (InstanceIdentifier, ['id', 'paper_id', 'name', 'value'])),
+    ('metadatum', (InstanceMetadatum, ['id', 'paper_id', 'name', 'value'])),
+])
+"""Maps exportable row kinds onto models and the columns that are exported."""
+
+INCLUDES = OrderedDict([
+    ('authors', 'author'),
+    ('identifiers', 'identifier'),
+    ('affiliations', 'affiliation'),
+])
+"""Kinds of rows that can be embedded in exported papers."""
+
+CHUNK_SIZE = 2000
+
+
+def corpus_queryset(corpus, kind):
+    model, fields = EXPORTS[kind]
+    if model is InstanceCitation:
+        return model.objects.filter(citing__corpus=corpus)
+    return model.objects.filter(corpus=corpus)
+
+
+def iter_values(queryset, fields, chunk_size=CHUNK_SIZE):
+    """
+    Yields ``dict``\s of ``fields`` for the rows of ``queryset``\, in primary
+    key order, read through a named (server-side) cursor, ``chunk_size`` rows
+    at a time.
+    """
+    sql, params = queryset.order_by('pk').values_list(*fields).query.sql_with_params()
+    with transaction.atomic():
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(name='export_%s' % uuid.uuid4().hex)
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(fields, row))
+        finally:
+            cursor.close()
+
+
+def iter_chunks(rows, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_rows(corpus, kind, include=(), filters=None):
+    """
+    Yields the rows of ``kind`` (see :data:`EXPORTS`\) in ``corpus`` as
+    ``dict``\s. Papers get a list for each of ``include`` (see
+    :data:`INCLUDES`\).
+    """
+    model, fields = EXPORTS[kind]
+    queryset = corpus_queryset(corpus, kind).filter(**(filters or {}))
+    rows = iter_values(queryset, fields)
+    if kind != 'paper' or not include:
+        for row in rows:
+            yield row
+        return
+
+    for chunk in iter_chunks(rows):
+        paper_ids = [row['id'] for row in chunk]
+        embedded = {}
+        for name in include:
+            child_model, child_fields = EXPORTS[INCLUDES[name]]
+            children = defaultdict(list)
+            for child in child_model.objects.filter(paper_id__in=paper_ids)\
+                                            .order_by('pk')\
+                                            .values(*child_fields):
+                children[child['paper_id']].append(child)
+            embedded[name] = children
+        for row in chunk:
+            for name in include:
+                row[name] = embedded[name].get(row['id'], [])
+            yield row
+
+
+def to_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def to_csv(rows, fields):
+    """
+    Yields CSV lines for ``rows``\. Embedded lists are written as JSON.
+    """
+    buf = cStringIO.StringIO()
+    writer = csv.writer(buf)
+
+    def line(values):
+        writer.writerow(values)
+        value = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return value
+
+    def encode(value):
+        if value is None:
+            return ''
+        if isinstance(value, list):
+            return json.dumps(value)
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+    yield line(fields)
+    for row in rows:
+        yield line([encode(row.get(field)) for field in fields])
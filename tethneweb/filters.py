@@ -1,36 +1,95 @@
 import django_filters
 from django.db.models import Count
+from django.db.models.query_utils import Q
 from django.utils.translation import ugettext as _
 
 from rest_framework import filters
 
 from tethneweb.models import *
+from tethneweb import search
 
 
 class PaperInstanceFilter(filters.FilterSet):
-    title = django_filters.CharFilter(name='title', lookup_type='icontains')
-    abstract = django_filters.CharFilter(name='abstract', lookup_type='icontains')
-    journal = django_filters.CharFilter(name='journal', lookup_type='icontains')
+    title = django_filters.MethodFilter()
+    abstract = django_filters.MethodFilter()
+    search = django_filters.MethodFilter()
+    journal = django_filters.MethodFilter()
     concrete = django_filters.BooleanFilter(name='concrete', widget=django_filters.widgets.BooleanWidget())
+    cited_by = django_filters.MethodFilter()
     citations = django_filters.MethodFilter()
 
     class Meta:
         model = PaperInstance
         fields = ['title', 'journal', 'publication_date', 'corpus', 'volume',
                   'issue', 'abstract', 'concrete', 'cited_by', 'id',
-                  'citations']
+                  'citations', 'search']
+
+    def filter_title(self, queryset, value):
+        """
+        Papers whose titles contain ``value``\, most similar first (see
+        :mod:`tethneweb.search`\).
+        """
+        return search.substring(queryset, 'title', value)
+
+    def filter_abstract(self, queryset, value):
+        return search.substring(queryset, 'abstract', value)
+
+    def filter_search(self, queryset, value):
+        """
+        Papers with all of the words in ``value`` in their titles or in their
+        abstracts (as full text, with stemming), best matches first.
+        """
+        return search.full_text(queryset, ['title', 'abstract'], value)
+
+    def filter_journal(self, queryset, value):
+        return search.substring(queryset, 'journal', value)
+
+    def filter_cited_by(self, queryset, value):
+        """
+        References cited by paper ``value``\, whether they were created for
+        that paper alone or interned and linked by an :class:`.InstanceCitation`\.
+
+        The IDs of both kinds are looked up first, each on its own index (an
+        ``OR`` of the two conditions can't use either), and the references
+        are then filtered by primary key.
+        """
+        if not value:
+            return queryset
+        ids = list(PaperInstance.objects.filter(cited_by=value)
+                                        .values_list('id', flat=True))
+        ids += InstanceCitation.objects.filter(citing=value)\
+                                       .values_list('cited', flat=True)
+        return queryset.filter(id__in=ids)
 
     def filter_citations(self, queryset, value):
-        return queryset.filter(cited_references=value)
+        """
+        Papers that cite reference ``value``\: the paper that it was created
+        for, or, if it was interned, the papers linked to it by an
+        :class:`.InstanceCitation`\. As in :meth:`.filter_cited_by`\, their
+        IDs are looked up first.
+        """
+        if not value:
+            return queryset
+        ids = list(InstanceCitation.objects.filter(cited=value)
+                                           .values_list('citing', flat=True))
+        ids += PaperInstance.objects.filter(pk=value).exclude(cited_by=None)\
+                                    .values_list('cited_by', flat=True)
+        return queryset.filter(id__in=ids)
 
 class AuthorInstanceFilter(filters.FilterSet):
-    first_name = django_filters.CharFilter(name='first_name', lookup_type='icontains')
-    last_name = django_filters.CharFilter(name='last_name', lookup_type='icontains')
+    first_name = django_filters.MethodFilter()
+    last_name = django_filters.MethodFilter()
 
     class Meta:
         model = AuthorInstance
         fields = ['id', 'paper', 'first_name', 'last_name', 'corpus',]
 
+    def filter_first_name(self, queryset, value):
+        return search.substring(queryset, 'first_name', value)
+
+    def filter_last_name(self, queryset, value):
+        return search.substring(queryset, 'last_name', value)
+
 
 class InstitutionInstanceFilter(filters.FilterSet):
     class Meta:
@@ -56,6 +115,12 @@ class InstanceMetadatumFilter(filters.FilterSet):
         fields = ['id', 'paper', 'name', 'value', 'corpus',]
 
 
+class InstanceMetadataDocumentFilter(filters.FilterSet):
+    class Meta:
+        model = InstanceMetadataDocument
+        fields = ['id', 'paper', 'corpus',]
+
+
 class InstanceIdentifierFilter(filters.FilterSet):
     class Meta:
         model = InstanceIdentifier
@@ -0,0 +1,95 @@
+"""
+Primary key allocation for the models that are written in bulk.
+
+Each model has a PostgreSQL sequence (created in migration ``0003``) that
+increments by :data:`BLOCK_SIZE`\. A single ``nextval`` therefore reserves a
+contiguous block of :data:`BLOCK_SIZE` primary keys. ``nextval`` is atomic and
+is never rolled back, so concurrent writers (the loader, REST uploads) can't
+collide, and no query has to scan for ``MAX(id)``\.
+"""
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+import threading
+from collections import defaultdict
+
+
+BLOCK_SIZE = 100
+"""Must match the ``INCREMENT BY`` of the sequences created in ``0003``\."""
+
+
+def sequence_name(model):
+    return '%s_id_seq' % model._meta.db_table
+
+
+class IDAllocator(object):
+    """
+    Hands out primary keys from blocks reserved on the per-model sequences.
+
+    Unused keys from a block are kept for the next request, so small requests
+    (e.g. creating a single :class:`.Corpus`\) don't waste a block each time.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self._pools = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def reserve(self, model, count):
+        """
+        Returns a list of ``count`` unused primary keys for ``model``\.
+        """
+        return self.reserve_many({model: count})[model]
+
+    def next_id(self, model):
+        return self.reserve(model, 1)[0]
+
+    def reserve_many(self, counts):
+        """
+        Reserves primary keys for several models in at most one round trip.
+
+        Parameters
+        ----------
+        counts : dict
+            Maps models onto the number of primary keys required.
+
+        Returns
+        -------
+        dict
+            Maps models onto lists of primary keys.
+        """
+        with self._lock:
+            required = {}
+            for model, count in counts.iteritems():
+                shortfall = count - len(self._pools[model])
+                if shortfall > 0:
+                    required[model] = (shortfall + BLOCK_SIZE - 1) / BLOCK_SIZE
+            if required:
+                self._fetch_blocks(required)
+
+            reserved = {}
+            for model, count in counts.iteritems():
+                pool = self._pools[model]
+                reserved[model], self._pools[model] = pool[:count], pool[count:]
+            return reserved
+
+    def _fetch_blocks(self, required):
+        models = {}
+        queries = []
+        params = []
+        for model, blocks in required.iteritems():
+            name = sequence_name(model)
+            models[name] = model
+            queries.append('SELECT %s, nextval(%s) FROM generate_series(1, %s)')
+            params += [name, name, blocks]
+
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(' UNION ALL '.join(queries), params)
+            rows = cursor.fetchall()
+
+        for name, start in sorted(rows):
+            self._pools[models[name]] += range(start, start + BLOCK_SIZE)
+
+
+allocator = IDAllocator()
+"""Shared allocator for the current process."""
@@ -0,0 +1,792 @@
+"""
+A source-agnostic, streaming ingest pipeline.
+
+Data files are parsed into tethne papers by a source adapter (see
+:mod:`tethneweb.sources`\), and transformed into rows by a
+:class:`.PaperTransformer`\, in worker processes if requested. The
+:class:`.CorpusHandler` absorbs the rows chunk by chunk, allocating primary
+keys in blocks, and writes them in batches with a writer from
+:mod:`tethneweb.bulk`\.
+"""
+
+from django.db import connection, connections, transaction
+from django.db.utils import DatabaseError
+from django.utils import timezone
+
+import json
+import hashlib
+import time
+import multiprocessing
+import cPickle as pickle
+from collections import Counter, defaultdict
+
+from tethneweb.models import *
+from tethneweb.bulk import WRITERS, BulkCreateWriter
+from tethneweb.checksums import existing_papers
+from tethneweb.instrumentation import IngestStats, Timer
+from tethneweb.ids import IDAllocator, allocator
+from tethneweb import metadata as metadata_encoding
+from tethneweb import counts, versions
+from tethneweb.sources import SOURCES, describe_error, for_corpus
+
+
+identifier_fields = ['doi', 'ayjid', 'issn', 'isbn', 'uri']
+paper_fields = [
+    ('date', 'publication_date'),
+    ('title', 'title'),
+    ('volume', 'volume'),
+    ('issue', 'issue'),
+    ('abstract', 'abstract'),
+    ('journal', 'journal'),
+]
+
+exclude_fields = [
+    'citations',
+    'citedReferences'
+]
+
+foreign_keys = {
+    'paper_id': 'PaperInstance',
+    'cited_by_id': 'PaperInstance',
+    'citing_id': 'PaperInstance',
+    'cited_id': 'PaperInstance',
+    'author_id': 'AuthorInstance',
+    'institution_id': 'InstitutionInstance',
+}
+"""Row fields that refer to other rows generated during ingest."""
+
+METADATA_ROWS = 'rows'
+METADATA_DOCUMENT = 'document'
+METADATA_LAYOUTS = (METADATA_ROWS, METADATA_DOCUMENT)
+"""
+Paper metadata is stored either as one pickled :class:`.InstanceMetadatum` per
+field, or as a single JSON :class:`.InstanceMetadataDocument` per paper.
+"""
+
+
+class PaperTransformer(object):
+    """
+    Turns tethne papers into rows for the instance models.
+
+    Primary keys (and the foreign keys that refer to them) are local to the
+    transformer, starting at 1 for each model after every :meth:`.flush`\. The
+    :class:`.CorpusHandler` maps them onto primary keys reserved from the
+    :class:`.IDAllocator` when the rows are absorbed. This lets transformation
+    run in worker processes that never touch the database.
+
+    If ``intern_citations`` is True, each distinct cited reference (by DOI or
+    ayjid) is created once, and citations are recorded as
+    :class:`.InstanceCitation` edges. The keys of interned references are
+    returned with the rows (as ``'InternedReference'``\), so that references
+    interned by other transformers can be merged when the rows are absorbed.
+    """
+
+    def __init__(self, corpus_id, metadata_layout=METADATA_ROWS,
+                 intern_citations=False, checksum_fields=None):
+        self.corpus_id = corpus_id
+        self.checksum_fields = checksum_fields or []
+        self.metadata_layout = metadata_layout
+        self.intern_citations = intern_citations
+        self.primary_keys = Counter()
+        self.hoppers = defaultdict(list)
+        self.interned = {}
+        self._new_keys = []
+        self.timer = Timer()
+
+    def add_paper(self, tethne_paper):
+        """
+        Generate rows for ``tethne_paper`` and its cited references. If this
+        fails, any rows generated for the paper are discarded before the
+        exception is re-raised.
+        """
+        lengths = {name: len(rows) for name, rows in self.hoppers.iteritems()}
+        primary_keys = self.primary_keys.copy()
+        self._new_keys = []
+        try:
+            paper_id = self._handle_paper(tethne_paper,
+                                          checksum=record_checksum(tethne_paper,
+                                                                   self.checksum_fields))
+
+            for tethne_reference in getattr(tethne_paper, 'citedReferences', []):
+                self._handle_cited_reference(tethne_reference, paper_id)
+        except Exception:
+            for name, rows in self.hoppers.iteritems():
+                del rows[lengths.get(name, 0):]
+            self.primary_keys = primary_keys
+            for key in self._new_keys:
+                del self.interned[key]
+            raise
+        return paper_id
+
+    def flush(self):
+        """
+        Returns the rows generated so far, and resets local primary keys.
+        """
+        hoppers = dict(self.hoppers)
+        hoppers['InternedReference'] = [{'paper_id': paper_id, 'key': key}
+                                        for key, paper_id
+                                        in self.interned.iteritems()]
+        self.primary_keys = Counter()
+        self.hoppers = defaultdict(list)
+        self.interned = {}
+        return hoppers
+
+    def _add_instance(self, model_name, data):
+        """
+        Rows are kept as plain ``dict``\s until they are written, so that
+        writers that don't need model instances (e.g. ``COPY``) can skip them.
+        """
+        self.primary_keys[model_name] += 1
+        ident = self.primary_keys[model_name]
+        data['id'] = ident
+        self.hoppers[model_name].append(data)
+        return ident
+
+    def _exclude_paper_field(self, field):
+        exclude = list(zip(*paper_fields)[0]) + identifier_fields + exclude_fields
+        return field.startswith('_') or field in exclude
+
+    def _generate_metadata(self, tethne_paper):
+        # Generate data for InstanceMetadatum model.
+        metadata = []
+
+        for field, value in tethne_paper.__dict__.iteritems():
+            if self._exclude_paper_field(field):
+                continue
+            value = pickle.dumps(value)
+            # if type(value) is not unicode:
+            #     value = pickle.dumps(value)
+
+            metadata.append({
+                'name': field,
+                'value': value,
+                'corpus_id': self.corpus_id,
+                'created_by_id': 1,
+            })
+        return metadata
+
+    def _generate_metadata_document(self, tethne_paper):
+        # Generate data for InstanceMetadataDocument model.
+        document = {field: value for field, value
+                    in tethne_paper.__dict__.iteritems()
+                    if not self._exclude_paper_field(field)}
+        return {
+            'document': metadata_encoding.encode(document),
+            'corpus_id': self.corpus_id,
+            'created_by_id': 1,
+        }
+
+
+    def _generate_identifiers(self, tethne_paper):
+        # Generate data for InstanceIdentifier model.
+        identifiers = []
+        for field in identifier_fields:
+            value = getattr(tethne_paper, field, None)
+            if value:
+                identifiers.append({
+                    'name': field,
+                    'value': value,
+                    'corpus_id': self.corpus_id,
+                    'created_by_id': 1,
+                })
+        return identifiers
+
+
+    def _handle_paper(self, tethne_paper, **additional):
+        paper_data = {}
+        for pfield, dbfield in paper_fields:
+            value = getattr(tethne_paper, pfield, None)
+            if value:
+                paper_data[dbfield] = value
+
+        paper_data.update({
+            'corpus_id': self.corpus_id,
+            'created_by_id': 1,
+        })
+        paper_data.update(**additional)
+        paper_id = self._add_instance('PaperInstance', paper_data)
+
+        with self.timer.stage('metadata'):
+            if self.metadata_layout == METADATA_DOCUMENT:
+                document_data = self._generate_metadata_document(tethne_paper)
+                document_data.update({'paper_id': paper_id})
+                self._add_instance('InstanceMetadataDocument', document_data)
+            else:
+                for metadata_data in self._generate_metadata(tethne_paper):
+                    metadata_data.update({'paper_id': paper_id})
+                    self._add_instance('InstanceMetadatum', metadata_data)
+
+        identifiers = []
+        for identifier_data in self._generate_identifiers(tethne_paper):
+
+            identifier_data.update({'paper_id': paper_id})
+            self._add_instance('InstanceIdentifier', identifier_data)
+
+        self._handle_authors(tethne_paper, paper_id)
+        return paper_id
+
+
+    def _handle_cited_reference(self, tethne_reference, paper_id):
+        key = self.intern_citations and reference_key(
+            getattr(tethne_reference, 'doi', None),
+            getattr(tethne_reference, 'ayjid', None))
+        if not key:
+            return self._handle_paper(tethne_reference, cited_by_id=paper_id, concrete=False)
+
+        reference_id = self.interned.get(key)
+        if reference_id is None:
+            reference_id = self._handle_paper(tethne_reference, concrete=False)
+            self.interned[key] = reference_id
+            self._new_keys.append(key)
+        self._add_instance('InstanceCitation', {
+            'citing_id': paper_id,
+            'cited_id': reference_id,
+        })
+        return reference_id
+
+
+    def _handle_institution(self, address, paper_id):
+        return self._add_instance('InstitutionInstance', {
+            'name': address[0],
+            'country': address[1],
+            'address': address[2],
+            'paper_id': paper_id,
+            'corpus_id': self.corpus_id,
+            'created_by_id': 1,
+        })
+
+    def _handle_authors(self, tethne_paper, paper_id):
+        # So that we don't create multiple InstitutionInstances for what are clearly
+        #  the same institutions, we first extract all unique address tuples and
+        #  create InstitutionInstances before proceeding.
+        addresses = getattr(tethne_paper, 'addresses', {})
+        normalize = lambda a: (a[0], a[1], ', '.join(a[2]))
+        institution_instances = {i: self._handle_institution(i, paper_id) for i
+                                 in set([normalize(j) for jset in addresses.values() for j in jset])}
+
+        institutions = {
+            name: [institution_instances[normalize(address)] for address in author_addresses]
+            for name, author_addresses in addresses.items()
+        }
+
+        authors = []
+        affiliations = []
+        for tethne_author in tethne_paper.authors:
+            author_id = self._add_instance('AuthorInstance', {
+                'paper_id': paper_id,
+                'last_name': tethne_author[0][0],
+                'first_name': tethne_author[0][1],
+                'corpus_id': self.corpus_id,
+                'created_by_id': 1,
+            })
+
+            # Addresses are keyed on the (surname, forename) of the author;
+            # tethne_author is that name with a count.
+            tethne_affiliations = institutions.get(tethne_author[0],
+                                                   institutions.get('__all__',
+                                                                    None))
+            if not tethne_affiliations:
+                continue
+
+            for institution_id in tethne_affiliations:
+                self._add_instance('AffiliationInstance', {
+                    'paper_id': paper_id,
+                    'author_id': author_id,
+                    'institution_id': institution_id,
+                    'confidence': 1./len(tethne_affiliations),
+                    'corpus_id': self.corpus_id,
+                    'created_by_id': 1,
+                })
+
+
+def reference_key(doi=None, ayjid=None):
+    """
+    Identifies a cited reference for interning, by DOI if it has one, and
+    otherwise by ayjid. Returns ``None`` if the reference has neither.
+    """
+    if doi:
+        return 'doi:%s' % doi.strip().lower()
+    if ayjid:
+        return 'ayjid:%s' % ayjid.strip().upper()
+
+
+def record_checksum(tethne_paper, fields):
+    """
+    A stable checksum of the identifying ``fields`` of a record (see
+    :attr:`.Source.checksum_fields`\), so that the same record in overlapping
+    exports can be detected.
+    """
+    values = []
+    for field in fields:
+        value = getattr(tethne_paper, field, None)
+        if isinstance(value, basestring):
+            value = value.strip()
+        values.append([field, metadata_encoding.encode(value)])
+    return hashlib.sha1(json.dumps(values, sort_keys=True)).hexdigest()
+
+
+def quarantine_entry(position, tethne_paper, error):
+    """
+    Describes a record that could not be loaded, for a
+    :class:`.QuarantinedRecord`\.
+    """
+    try:
+        data = metadata_encoding.encode({
+            field: value for field, value in tethne_paper.__dict__.iteritems()
+            if not field.startswith('_') and field not in exclude_fields
+        })
+    except Exception:
+        data = None
+    return {'position': position, 'error': error, 'data': data}
+
+
+class ReadError(Exception):
+    """
+    A data file could not be read past a record (rather than one record could
+    not be parsed, which is quarantined).
+    """
+    pass
+
+
+def transform_file(args, stream=False):
+    """
+    Parse and transform a single file, starting at record ``offset``\. Runs
+    in a worker process, so it must not touch the database.
+
+    Records that can't be parsed or transformed are quarantined rather than
+    failing the file.
+
+    Parameters
+    ----------
+    args : tuple
+        ``(file id, path, offset, source name, transformer kwargs, chunk
+        size)``\.
+    stream : bool
+        If True, records are read and transformed lazily as the chunks are
+        consumed, so that only one chunk of rows is held in memory at a time.
+        Results that are sent back from a worker process can't be streamed.
+
+    Returns
+    -------
+    tuple
+        ``(file id, path, chunks, error, timer)``\. Each chunk is ``(offset,
+        rows, quarantined)`` for up to ``chunk size`` records, where
+        ``offset`` is the position just after its last record; the last
+        offset is the number of records in the file. If the file can't be
+        read, ``error`` describes the failure, and ``chunks`` has the records
+        before it; when streaming, a failure after the file was opened is
+        raised as a :class:`ReadError` from ``chunks`` instead. The
+        :class:`.Timer` has the ``parse`` and ``transform`` stages (the
+        latter including ``metadata``\); when streaming, it is complete once
+        the chunks have been consumed.
+    """
+    file_id, path, offset, source_name, transformer_kwargs, chunk_size = args
+    transformer = PaperTransformer(**transformer_kwargs)
+    timer = transformer.timer
+    try:
+        with timer.stage('parse'):
+            tethne_papers = SOURCES[source_name]().read(path)
+    except Exception as E:
+        return file_id, path, [], describe_error(E), timer
+
+    chunks = iter_chunks(transformer, tethne_papers, offset, chunk_size)
+    if stream:
+        return file_id, path, chunks, None, timer
+    consumed = []
+    try:
+        for chunk in chunks:
+            consumed.append(chunk)
+    except ReadError as E:
+        return file_id, path, consumed, str(E), timer
+    return file_id, path, consumed, None, timer
+
+
+def iter_chunks(transformer, tethne_papers, offset, chunk_size):
+    """
+    Transform ``tethne_papers`` (an iterable) from ``offset``\, yielding
+    ``(offset, rows, quarantined)`` every ``chunk_size`` records, and after
+    the last one. Records before ``offset`` are parsed but not transformed.
+
+    If reading fails, the records before the failure are yielded, and then a
+    :class:`ReadError` is raised.
+    """
+    timer = transformer.timer
+    tethne_papers = iter(tethne_papers)
+    quarantined = []
+    position = 0
+    failure = None
+    while True:
+        try:
+            with timer.stage('parse'):
+                tethne_paper = next(tethne_papers)
+        except StopIteration:
+            break
+        except Exception as E:
+            failure = 'after record %i: %s' % (position, describe_error(E))
+            break
+        position += 1
+        if position <= offset:
+            continue
+
+        error = getattr(tethne_paper, '_ingest_error', None)
+        if error is None:
+            try:
+                with timer.stage('transform'):
+                    transformer.add_paper(tethne_paper)
+            except Exception as E:
+                error = describe_error(E)
+        if error is not None:
+            quarantined.append(quarantine_entry(position - 1, tethne_paper, error))
+
+        if (position - offset) % chunk_size == 0:
+            yield position, transformer.flush(), quarantined
+            quarantined = []
+    if position > offset and (position - offset) % chunk_size:
+        yield position, transformer.flush(), quarantined
+    if failure is not None:
+        raise ReadError(failure)
+
+
+class CorpusHandler(object):
+    """
+    Loads files from ``source`` (a :class:`.Source`\) into a
+    :class:`.Corpus`\, keeping a manifest
+    (:class:`.IngestRun` and :class:`.IngestFile`\) so that an interrupted run
+    can be resumed with :meth:`.resume`\.
+
+    Each batch is committed in one transaction along with the offsets of the
+    records it contains, so a resumed run picks up after the last committed
+    batch without duplicating anything.
+    """
+    _lookup_indexes = [(PaperInstance, ('corpus', 'checksum'))]
+    """Indexes queried during a load (by :meth:`drop_duplicates`\)."""
+
+    _add_order = [
+        ('PaperInstance', PaperInstance),
+        ('InstanceCitation', InstanceCitation),
+        ('InstanceIdentifier', InstanceIdentifier),
+        ('InstanceMetadatum', InstanceMetadatum),
+        ('InstanceMetadataDocument', InstanceMetadataDocument),
+        ('AuthorInstance', AuthorInstance),
+        ('InstitutionInstance', InstitutionInstance),
+        ('AffiliationInstance', AffiliationInstance),
+    ]
+
+    def __init__(self, source, label=None, batch_size=100, writer=None,
+                 metadata_layout=METADATA_ROWS, intern_citations=False,
+                 large_load=False, corpus=None, run=None, stats=None):
+        self.source = source
+        self.batch_size = batch_size
+        self.large_load = large_load
+        self.writer = writer if writer is not None else BulkCreateWriter()
+        self.stats = stats if stats is not None else IngestStats()
+        self.ids = IDAllocator()
+        self.hoppers = defaultdict(list)
+        self.interned = {}
+        self.checkpoints = {}
+        self.quarantine = []
+        self.checksums = set()
+
+        if run is None:
+            if corpus is None:
+                corpus = Corpus.objects.create(**{
+                    'id': self.ids.next_id(Corpus),
+                    'source': source.corpus_source,
+                    'label': label,
+                    'created_by_id': 1,
+                })
+            elif intern_citations:
+                self._load_interned(corpus)
+            run = IngestRun.objects.create(**{
+                'id': self.ids.next_id(IngestRun),
+                'corpus': corpus,
+                'created_by_id': 1,
+                'options': {
+                    'batch_size': batch_size,
+                    'writer': self.writer.name,
+                    'metadata_layout': metadata_layout,
+                    'intern_citations': intern_citations,
+                    'large_load': large_load,
+                },
+            })
+        elif intern_citations:
+            self._load_interned(run.corpus)
+        self.run = run
+        self.corpus = run.corpus
+
+        self.transformer_kwargs = {
+            'corpus_id': self.corpus.id,
+            'metadata_layout': metadata_layout,
+            'intern_citations': intern_citations,
+            'checksum_fields': source.checksum_fields,
+        }
+
+    @classmethod
+    def resume(cls, run_id, stats=None):
+        """
+        Continue an :class:`.IngestRun` with the options it was started with.
+        """
+        run = IngestRun.objects.select_related('corpus').get(pk=run_id)
+        run.status = IngestRun.RUNNING
+        run.save()
+        options = run.options
+        return cls(for_corpus(run.corpus),
+                   batch_size=options['batch_size'],
+                   writer=WRITERS[options['writer']](),
+                   metadata_layout=options['metadata_layout'],
+                   intern_citations=options['intern_citations'],
+                   large_load=options.get('large_load', False),
+                   run=run, stats=stats)
+
+    def _load_interned(self, corpus):
+        """
+        Rebuild the keys of references interned by earlier (committed) batches.
+        """
+        identifiers = InstanceIdentifier.objects.filter(
+            corpus=corpus, paper__concrete=False, paper__cited_by__isnull=True,
+            name__in=['doi', 'ayjid']).values_list('paper_id', 'name', 'value')
+        found = defaultdict(dict)
+        for paper_id, name, value in identifiers.iterator():
+            found[paper_id][name] = value
+        for paper_id, values in found.iteritems():
+            self.interned[reference_key(**values)] = paper_id
+
+    def add_files(self, paths):
+        """
+        Add ``paths`` to the manifest of this run.
+        """
+        ids = iter(allocator.reserve(IngestFile, len(paths)))
+        IngestFile.objects.bulk_create([
+            IngestFile(id=next(ids), run=self.run, path=path) for path in paths
+        ])
+
+    def run_files(self, workers=1):
+        """
+        Parse and transform each file in the manifest that isn't done yet,
+        using a pool of ``workers`` processes if more than one is requested.
+        Workers only transform; rows are absorbed and written by this process.
+
+        Yields ``(path, record count, quarantined count, duplicate count,
+        error)`` as each file is absorbed.
+        """
+        files = self.run.files.exclude(status=IngestFile.DONE).order_by('id')
+        offsets = {f.id: f.offset for f in files}
+        tasks = [(f.id, f.path, f.offset, self.source.name,
+                  self.transformer_kwargs, self.batch_size) for f in files]
+        if workers > 1:
+            # Forked workers must not share our database connection.
+            connections.close_all()
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(transform_file, tasks)
+        else:
+            pool = None
+            results = (transform_file(task, stream=True) for task in tasks)
+
+        completed = False
+        try:
+            for file_id, path, chunks, error, timer in results:
+                quarantined = duplicates = 0
+                previous = offsets[file_id]
+                try:
+                    for offset, rows, bad_records in chunks:
+                        with self.stats.stage('deduplicate'):
+                            rows, dropped = self.drop_duplicates(rows)
+                        duplicates += dropped
+                        self.stats.duplicates += dropped
+                        with self.stats.stage('absorb'):
+                            self.absorb(rows)
+                        self.quarantine += [dict(record, file_id=file_id)
+                                            for record in bad_records]
+                        quarantined += len(bad_records)
+                        self.stats.records += offset - previous
+                        self.stats.quarantined += len(bad_records)
+                        previous = offset
+                        self.checkpoints[file_id] = (offset, IngestFile.PENDING)
+                        if len(self.hoppers['PaperInstance']) >= self.batch_size:
+                            self._commit()
+                except ReadError as E:
+                    error = str(E)
+                self.stats.merge(timer.as_dict())
+
+                if error is not None:
+                    if previous != offsets[file_id]:
+                        # Keep the records before the failure; a resumed run
+                        # starts from there.
+                        self._commit()
+                    IngestFile.objects.filter(pk=file_id)\
+                                      .update(status=IngestFile.FAILED, error=error)
+                    yield path, previous, quarantined, duplicates, error
+                    continue
+                # The last offset is the number of records in the file.
+                self.checkpoints[file_id] = (previous, IngestFile.DONE)
+                yield path, previous, quarantined, duplicates, None
+            self._commit()
+            self.run.status = IngestRun.COMPLETED
+            self.run.save()
+            completed = True
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if not completed:
+                # Raised, interrupted, or abandoned by the caller.
+                self._mark_failed()
+
+    def _mark_failed(self):
+        """
+        Mark the run as failed, so that it can be told apart from one that is
+        still loading (e.g. by :func:`tethneweb.deferral.restore_abandoned`\).
+        """
+        try:
+            IngestRun.objects.filter(pk=self.run.pk, status=IngestRun.RUNNING)\
+                             .update(status=IngestRun.FAILED,
+                                     date_modified=timezone.now())
+        except DatabaseError:
+            # E.g. the connection was lost; the heartbeat goes stale instead.
+            pass
+        self.run.status = IngestRun.FAILED
+
+    def drop_duplicates(self, rows):
+        """
+        Remove records (and the rows that belong to them) whose checksum is
+        already in the corpus, or earlier in this batch, using one query for
+        the whole chunk.
+
+        Returns
+        -------
+        tuple
+            The remaining rows, and the number of records that were dropped.
+        """
+        records = [row for row in rows.get('PaperInstance', [])
+                   if row.get('checksum') is not None]
+        if not records:
+            return rows, 0
+
+        existing = existing_papers(self.corpus.id,
+                                   [row['checksum'] for row in records])
+        duplicates = set()
+        for row in records:
+            if row['checksum'] in existing or row['checksum'] in self.checksums:
+                duplicates.add(row['id'])
+            else:
+                self.checksums.add(row['checksum'])
+        if not duplicates:
+            return rows, 0
+
+        # Cited references (unless interned) belong to the citing record.
+        paper_ids = duplicates | set([row['id'] for row in rows['PaperInstance']
+                                      if row.get('cited_by_id') in duplicates])
+        rows = self._drop_papers(rows, paper_ids)
+        rows['InstanceCitation'] = [row for row in rows.get('InstanceCitation', [])
+                                    if row['citing_id'] not in duplicates]
+
+        # Interned references that only the duplicates cited.
+        cited = set([row['cited_id'] for row in rows['InstanceCitation']])
+        orphans = set([entry['paper_id']
+                       for entry in rows.get('InternedReference', [])
+                       if entry['paper_id'] not in cited])
+        if orphans:
+            rows = self._drop_papers(rows, orphans)
+        return rows, len(duplicates)
+
+    def absorb(self, rows):
+        """
+        Map the local primary keys in ``rows`` (from
+        :meth:`PaperTransformer.flush`\) onto real primary keys, and add the
+        rows to the hoppers.
+
+        Interned references that were already absorbed from another file are
+        dropped, along with their child rows, and citations to them are
+        pointed at the existing reference.
+        """
+        keys = defaultdict(dict)
+        interned = {}
+        for entry in rows.get('InternedReference', []):
+            existing = self.interned.get(entry['key'])
+            if existing is None:
+                interned[entry['paper_id']] = entry['key']
+            else:
+                keys['PaperInstance'][entry['paper_id']] = existing
+        if keys['PaperInstance']:
+            rows = self._drop_papers(rows, keys['PaperInstance'])
+
+        models = dict(self._add_order)
+        reserved = self.ids.reserve_many({
+            models[model_name]: len(rows.get(model_name, []))
+            for model_name, model in self._add_order
+        })
+        for model_name, model in self._add_order:
+            model_rows = rows.get(model_name, [])
+            keys[model_name].update(zip([row['id'] for row in model_rows],
+                                        reserved[model]))
+
+        for model_name, model in self._add_order:
+            model_rows = rows.get(model_name, [])
+            for row in model_rows:
+                row['id'] = keys[model_name][row['id']]
+                for field, target in foreign_keys.iteritems():
+                    if row.get(field) is not None:
+                        row[field] = keys[target][row[field]]
+            self.hoppers[model_name] += model_rows
+
+        for paper_id, key in interned.iteritems():
+            self.interned[key] = keys['PaperInstance'][paper_id]
+
+    def _drop_papers(self, rows, paper_ids):
+        """
+        Remove the :class:`.PaperInstance` rows in ``paper_ids`` and the rows
+        that belong to them. Citations to these papers are kept.
+        """
+        kept = {}
+        for model_name, model_rows in rows.iteritems():
+            if model_name == 'PaperInstance':
+                kept[model_name] = [row for row in model_rows
+                                    if row['id'] not in paper_ids]
+            else:
+                kept[model_name] = [row for row in model_rows
+                                    if row.get('paper_id') not in paper_ids]
+        return kept
+
+    def _commit(self):
+        self.stats.record_hoppers(self.hoppers)
+        started = time.time()
+        with transaction.atomic():
+            if self.large_load:
+                # The checkpoint is written in the same transaction, so losing
+                # the last few commits in a server crash only means that their
+                # records are loaded again on resume.
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL synchronous_commit TO OFF')
+            for model_name, model in self._add_order:
+                with self.stats.stage('write'):
+                    write_started = time.time()
+                    rows = self.writer.write(model, self.hoppers[model_name])
+                    counts.record(model, self.hoppers[model_name])
+                    self.stats.record_write(model_name, rows,
+                                            time.time() - write_started)
+            versions.bump([self.corpus.id])
+
+            ids = iter(self.ids.reserve(QuarantinedRecord, len(self.quarantine)))
+            QuarantinedRecord.objects.bulk_create([
+                QuarantinedRecord(id=next(ids), run=self.run, **record)
+                for record in self.quarantine
+            ])
+
+            for file_id, (offset, status) in self.checkpoints.iteritems():
+                IngestFile.objects.filter(pk=file_id)\
+                                  .update(offset=offset, status=status, error=None)
+            # Heartbeat: a run that stops committing is eventually taken for
+            # dead (see tethneweb.deferral).
+            IngestRun.objects.filter(pk=self.run.pk)\
+                             .update(date_modified=timezone.now())
+
+        self.stats.record_commit(sum([len(rows) for rows in self.hoppers.values()]),
+                                 time.time() - started)
+        self.stats.maybe_report()
+
+        for model_name, model in self._add_order:
+            self.hoppers[model_name] = []
+        self.quarantine = []
+        self.checkpoints = {}
+        # Committed checksums are found by the query in drop_duplicates().
+        self.checksums = set()
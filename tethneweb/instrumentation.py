@@ -0,0 +1,160 @@
+"""
+Timings and throughput counters for the ingest pipeline.
+
+Stages that run in worker processes (parsing, transformation) are timed there
+and merged into the parent's :class:`.IngestStats` with :meth:`.merge`\, so
+their totals are summed across workers rather than wall-clock time.
+"""
+
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+import json
+import resource
+import sys
+import time
+
+
+class Timer(object):
+    """
+    Accumulates time spent in named stages.
+    """
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.calls = Counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, seconds, calls=1):
+        self.seconds[name] += seconds
+        self.calls[name] += calls
+
+    def as_dict(self):
+        return {name: {'seconds': self.seconds[name], 'calls': self.calls[name]}
+                for name in self.seconds}
+
+
+def estimate_size(rows, sample=100):
+    """
+    Rough size in bytes of a list of row ``dict``\s, extrapolated from the
+    first ``sample`` rows.
+    """
+    if not rows:
+        return 0
+    sampled = rows[:sample]
+    size = 0
+    for row in sampled:
+        size += sys.getsizeof(row)
+        size += sum([sys.getsizeof(value) for value in row.itervalues()])
+    return size * len(rows) / len(sampled)
+
+
+class IngestStats(Timer):
+    """
+    Collects stage timings, record and row counts, hopper memory and commit
+    latency for a run of the loader.
+
+    Parameters
+    ----------
+    report : callable
+        Called with a one-line progress summary at most once every
+        ``interval`` seconds (see :meth:`.maybe_report`\).
+    interval : int
+    """
+
+    def __init__(self, report=None, interval=30):
+        super(IngestStats, self).__init__()
+        self.report = report
+        self.interval = interval
+        self.started = time.time()
+        self.last_report = self.started
+        self.records = 0
+        self.quarantined = 0
+        self.duplicates = 0
+        self.rows = Counter()
+        self.write_seconds = Counter()
+        self.commits = []
+        self.peak_hopper_bytes = 0
+
+    def merge(self, timings):
+        """
+        Add stage timings reported by a worker (from :meth:`Timer.as_dict`\).
+        """
+        for name, values in timings.iteritems():
+            self.add(name, values['seconds'], values['calls'])
+
+    def record_hoppers(self, hoppers):
+        size = sum([estimate_size(rows) for rows in hoppers.itervalues()])
+        self.peak_hopper_bytes = max(self.peak_hopper_bytes, size)
+
+    def record_write(self, model_name, rows, seconds):
+        self.rows[model_name] += rows
+        self.write_seconds[model_name] += seconds
+
+    def record_commit(self, rows, seconds):
+        self.commits.append((rows, seconds))
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def maybe_report(self, force=False):
+        now = time.time()
+        if self.report is None:
+            return
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        elapsed = max(self.elapsed, 1e-9)
+        rows = sum(self.rows.values())
+        self.report('%.0fs: %i records (%.1f/s), %i rows (%.1f/s), %i commits' % \
+                    (elapsed, self.records, self.records / elapsed, rows,
+                     rows / elapsed, len(self.commits)))
+
+    def summary(self):
+        elapsed = max(self.elapsed, 1e-9)
+        latencies = sorted([seconds for rows, seconds in self.commits])
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            'elapsed_seconds': elapsed,
+            'records': self.records,
+            'quarantined': self.quarantined,
+            'duplicates': self.duplicates,
+            'records_per_second': self.records / elapsed,
+            'stages': self.as_dict(),
+            'models': {
+                model_name: {
+                    'rows': self.rows[model_name],
+                    'rows_per_second': self.rows[model_name] / elapsed,
+                    'write_seconds': self.write_seconds[model_name],
+                }
+                for model_name in self.rows
+            },
+            'commits': {
+                'count': len(latencies),
+                'rows': sum([rows for rows, seconds in self.commits]),
+                'total_seconds': sum(latencies),
+                'mean_seconds': sum(latencies) / len(latencies) if latencies else None,
+                'p50_seconds': percentile(0.5),
+                'p95_seconds': percentile(0.95),
+                'max_seconds': latencies[-1] if latencies else None,
+            },
+            'peak_hopper_bytes': self.peak_hopper_bytes,
+            # ru_maxrss is in kilobytes on Linux.
+            'peak_rss_kilobytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4, sort_keys=True)
@@ -0,0 +1,330 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.conf import settings
+from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
+
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import datetime
+from StringIO import StringIO
+
+import django
+
+from tethneweb.models import *
+from tethneweb.bulk import WRITERS
+from tethneweb.synthetic import SyntheticWoS
+
+
+NO_CACHE = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+CHECKSUM_BATCH = 1000
+
+ENDPOINTS = [
+    ('corpus list', 'get', '/rest/corpus/'),
+    ('corpus detail', 'get', '/rest/corpus/%(corpus)i/'),
+    ('paper list', 'get',
+     '/rest/paper_instance/?corpus=%(corpus)i&concrete=true'),
+    ('paper list, deep page', 'get',
+     '/rest/paper_instance/?corpus=%(corpus)i&concrete=true&offset=%(offset)i'),
+    ('paper list, estimated count', 'get',
+     '/rest/paper_instance/?corpus=%(corpus)i&concrete=true&count=estimate'),
+    ('paper list, keyset', 'get',
+     '/rest/paper_instance/?corpus=%(corpus)i&concrete=true&after=0'),
+    ('paper list, expanded', 'get',
+     '/rest/paper_instance/?corpus=%(corpus)i&concrete=true'
+     '&expand=authors,affiliations,metadata'),
+    ('paper detail', 'get', '/rest/paper_instance/%(paper)i/'),
+    ('references of a paper', 'get',
+     '/rest/paper_instance/?cited_by=%(paper)i&concrete=false'),
+    ('paper search', 'get',
+     '/rest/paper_instance/?corpus=%(corpus)i&search=%(word)s'),
+    ('author list', 'get', '/rest/author_instance/?corpus=%(corpus)i'),
+    ('author search', 'get',
+     '/rest/author_instance/?corpus=%(corpus)i&last_name=%(last_name)s'),
+    ('author detail', 'get', '/rest/author_instance/%(author)i/'),
+    ('institution list', 'get', '/rest/institution_instance/?corpus=%(corpus)i'),
+    ('affiliation list', 'get', '/rest/affiliation_instance/?corpus=%(corpus)i'),
+    ('metadata of a paper', 'get', '/rest/instance_metadatum/?paper=%(paper)i'),
+    ('identifiers of a paper', 'get',
+     '/rest/instance_identifier/?paper=%(paper)i'),
+    ('check_unique', 'get',
+     '/check_unique/?corpus=%(corpus)i&checksum=%(checksum)s'),
+    ('check_unique, %i checksums' % CHECKSUM_BATCH, 'post', '/check_unique/'),
+]
+"""
+The requests that are timed, as ``(name, method, path)``\, where the path is
+filled in with sample values (see :meth:`Command.get_sample`\). POSTs send
+the sample's ``body`` as JSON.
+"""
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class Command(BaseCommand):
+    help = ('Load a synthetic Web of Science corpus, and measure ingest'
+            ' throughput and the latency and query counts of the REST'
+            ' endpoints. Loaded data is kept: use a dedicated database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--papers', dest='papers', type=int, default=10000,
+                            help='Number of synthetic records (default 10000).')
+        parser.add_argument('--seed', dest='seed', type=int, default=0)
+        parser.add_argument('--data', dest='data', default=None,
+                            help='Directory for the synthetic data files. If'
+                                 ' it already has data files, they are loaded'
+                                 ' as they are (default: a temporary'
+                                 ' directory, removed afterwards).')
+        parser.add_argument('--files', dest='files', type=int, default=None,
+                            help='Number of data files (default: one per 5000'
+                                 ' records).')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=1000)
+        parser.add_argument('--workers', dest='workers', type=int, default=1)
+        parser.add_argument('--writer', dest='writer', default='bulk_create',
+                            choices=sorted(WRITERS.keys()))
+        parser.add_argument('--intern-citations', dest='intern_citations',
+                            action='store_true', default=False)
+        parser.add_argument('--corpus', dest='corpus', type=int, default=None,
+                            help='Measure the endpoints against this corpus,'
+                                 ' without loading anything.')
+        parser.add_argument('--repeat', dest='repeat', type=int, default=20,
+                            help='Times each request is timed (default 20),'
+                                 ' after one untimed warm-up.')
+        parser.add_argument('--response-cache', dest='response_cache',
+                            action='store_true', default=False,
+                            help='Leave the response cache on (by default it'
+                                 ' is disabled, so that every request does'
+                                 ' its queries).')
+        parser.add_argument('--output', dest='output', default=None,
+                            help='Write the results as JSON to this path.')
+        parser.add_argument('--baseline', dest='baseline', default=None,
+                            help='Compare the results with those of an'
+                                 ' earlier run, written with --output.')
+        parser.add_argument('--tolerance', dest='tolerance', type=float,
+                            default=0.25,
+                            help='Fraction by which a timing may be worse'
+                                 ' than the baseline before it counts as a'
+                                 ' regression (default 0.25). Any increase'
+                                 ' in query counts is a regression.')
+        parser.add_argument('--fail-on-regression', dest='fail',
+                            action='store_true', default=False,
+                            help='Exit with an error if there are'
+                                 ' regressions.')
+
+    def handle(self, *args, **options):
+        if options.get('papers') < 1:
+            raise CommandError('--papers must be at least 1.')
+        results = {
+            'meta': {
+                'date': datetime.datetime.utcnow().isoformat(),
+                'host': platform.node(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'papers': options.get('papers'),
+                'seed': options.get('seed'),
+                'batch_size': options.get('batch_size'),
+                'workers': options.get('workers'),
+                'writer': options.get('writer'),
+                'intern_citations': options.get('intern_citations'),
+                'repeat': options.get('repeat'),
+                'response_cache': options.get('response_cache'),
+            },
+        }
+
+        if options.get('corpus'):
+            try:
+                corpus = Corpus.objects.get(pk=options.get('corpus'))
+            except Corpus.DoesNotExist:
+                raise CommandError('No such corpus: %i' % options.get('corpus'))
+            results['meta']['papers'] = PaperInstance.objects\
+                                            .filter(corpus=corpus, concrete=True)\
+                                            .count()
+        else:
+            corpus, results['ingest'] = self.load(options)
+
+        caches = dict(settings.CACHES)
+        if not options.get('response_cache'):
+            caches['responses'] = NO_CACHE
+        with override_settings(CACHES=caches):
+            results['endpoints'] = self.measure(corpus, options.get('repeat'))
+
+        output = json.dumps(results, indent=4, sort_keys=True)
+        if options.get('output'):
+            with open(options.get('output'), 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        failed = [name for name, result in results['endpoints'].items()
+                  if result['failed']]
+
+        if options.get('baseline'):
+            with open(options.get('baseline')) as f:
+                baseline = json.load(f)
+            regressions = self.compare(results, baseline, options.get('tolerance'))
+            if regressions and options.get('fail'):
+                raise CommandError('%i regressions against %s' % \
+                                   (len(regressions), options.get('baseline')))
+        if failed:
+            raise CommandError('%i requests did not succeed: %s' % \
+                               (len(failed), ', '.join(sorted(failed))))
+
+    def load(self, options):
+        """
+        Generates (if necessary) and loads a synthetic corpus, and returns it
+        with the ingest statistics (see
+        :class:`tethneweb.instrumentation.IngestStats`\).
+        """
+        data = options.get('data')
+        temporary = data is None
+        if temporary:
+            data = tempfile.mkdtemp(prefix='tethneweb-benchmark-')
+        stats_path = os.path.join(tempfile.mkdtemp(prefix='tethneweb-stats-'),
+                                  'stats.json')
+        try:
+            if temporary or not os.listdir(data):
+                papers = options.get('papers')
+                files = options.get('files') or max(1, papers / 5000)
+                self.stdout.write('Generating %i records' % papers)
+                SyntheticWoS(papers, seed=options.get('seed')).write(data, files=files)
+
+            label = 'benchmark %s' % datetime.datetime.utcnow().isoformat()
+            self.stdout.write('Loading %s' % data)
+            call_command('load_wos', data, label,
+                         str(options.get('batch_size')),
+                         workers=options.get('workers'),
+                         writer=options.get('writer'),
+                         intern_citations=options.get('intern_citations'),
+                         stats=stats_path, stdout=StringIO())
+            with open(stats_path) as f:
+                ingest = json.load(f)
+        finally:
+            shutil.rmtree(os.path.dirname(stats_path), ignore_errors=True)
+            if temporary:
+                shutil.rmtree(data, ignore_errors=True)
+
+        self.stdout.write('Loaded %i records in %.1f seconds (%.1f per second)' % \
+                          (ingest['records'], ingest['elapsed_seconds'],
+                           ingest['records_per_second']))
+        corpus = Corpus.objects.filter(label=label).order_by('-pk').first()
+        return corpus, ingest
+
+    def get_sample(self, corpus):
+        """
+        Values from ``corpus`` to make the requests with.
+        """
+        papers = PaperInstance.objects.filter(corpus=corpus, concrete=True)
+        paper = papers.order_by('pk').first()
+        if paper is None:
+            raise CommandError('Corpus %i has no papers.' % corpus.id)
+        author = AuthorInstance.objects.filter(paper=paper).order_by('pk').first()
+        total = papers.count()
+        checksums = list(papers.order_by('pk').values_list('checksum', flat=True)
+                               [:CHECKSUM_BATCH / 2])
+        checksums += ['%032x' % i for i in range(CHECKSUM_BATCH - len(checksums))]
+        return {
+            'corpus': corpus.id,
+            'paper': paper.id,
+            'offset': max(0, total - 20),
+            'author': author.id if author else 0,
+            'last_name': author.last_name if author else 'smith',
+            'word': paper.title.split()[0] if paper.title else 'the',
+            'checksum': paper.checksum,
+            'body': {'corpus': corpus.id, 'checksums': checksums},
+        }
+
+    def measure(self, corpus, repeat):
+        """
+        Times each of the :data:`ENDPOINTS`\, as the owner of ``corpus``\.
+        The owner authenticates with a REST API token, which (unlike
+        ``force_authenticate``\) also reaches plain Django views such as
+        ``check_unique``\. Responses that are not ``2xx`` are marked
+        ``failed``\.
+        """
+        sample = self.get_sample(corpus)
+        token, _ = Token.objects.get_or_create(user=corpus.created_by)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token %s' % token.key)
+        results = {}
+        for name, method, path in ENDPOINTS:
+            path = path % sample
+            request = getattr(client, method)
+            kwargs = {'secure': True}
+            if method == 'post':
+                kwargs.update({'data': json.dumps(sample['body']),
+                               'content_type': 'application/json'})
+
+            request(path, **kwargs)    # Warm-up.
+            timings = []
+            for i in xrange(repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.time()
+                    response = request(path, **kwargs)
+                    timings.append(1000. * (time.time() - start))
+            results[name] = {
+                'path': path,
+                'status': response.status_code,
+                'queries': len(queries),
+                'bytes': len(response.content),
+                'median_ms': percentile(timings, 0.5),
+                'p95_ms': percentile(timings, 0.95),
+                'min_ms': min(timings),
+                'failed': not 200 <= response.status_code < 300,
+            }
+            self.stdout.write('%-40s %3i %8.1f ms %8.1f ms (p95) %4i queries' % \
+                              (name, response.status_code,
+                               results[name]['median_ms'],
+                               results[name]['p95_ms'], len(queries)))
+            if results[name]['failed']:
+                self.stderr.write('Failed: %s answered %i' % \
+                                  (name, response.status_code))
+        return results
+
+    def compare(self, results, baseline, tolerance):
+        """
+        Writes out the differences from ``baseline``\, and returns the
+        regressions.
+        """
+        regressions = []
+        if 'ingest' in results and 'ingest' in baseline:
+            now = results['ingest']['records_per_second']
+            then = baseline['ingest']['records_per_second']
+            if now < then * (1 - tolerance):
+                regressions.append('ingest: %.1f records per second, was %.1f' % \
+                                   (now, then))
+
+        for name, result in sorted(results['endpoints'].items()):
+            before = baseline.get('endpoints', {}).get(name)
+            if before is None:
+                continue
+            self.stdout.write('%-40s %+7.1f%% %+4i queries' % \
+                              (name,
+                               100. * (result['median_ms'] - before['median_ms']) \
+                               / max(before['median_ms'], 1e-9),
+                               result['queries'] - before['queries']))
+            if result['status'] != before['status']:
+                regressions.append('%s: status %i, was %i' % \
+                                   (name, result['status'], before['status']))
+            if result['queries'] > before['queries']:
+                regressions.append('%s: %i queries, was %i' % \
+                                   (name, result['queries'], before['queries']))
+            if result['median_ms'] > before['median_ms'] * (1 + tolerance):
+                regressions.append('%s: %.1f ms, was %.1f ms' % \
+                                   (name, result['median_ms'], before['median_ms']))
+
+        for regression in regressions:
+            self.stderr.write('Regression: %s' % regression)
+        if not regressions:
+            self.stdout.write('No regressions against the baseline.')
+        return regressions
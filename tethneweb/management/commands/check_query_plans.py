@@ -0,0 +1,176 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+import json
+
+from tethneweb.models import *
+from tethneweb.filters import *
+
+
+PAGE_SIZE = 20
+
+CANONICAL_QUERIES = [
+    ('papers in a corpus', PaperInstanceFilter,
+     lambda sample: {'corpus': sample['corpus'], 'concrete': 'true'}),
+    ('citations in a corpus', PaperInstanceFilter,
+     lambda sample: {'corpus': sample['corpus'], 'concrete': 'false'}),
+    ('references cited by a paper', PaperInstanceFilter,
+     lambda sample: {'cited_by': sample['paper'], 'concrete': 'false'}),
+    ('papers citing a reference', PaperInstanceFilter,
+     lambda sample: {'citations': sample['reference']}),
+    ('interned references cited by a paper', PaperInstanceFilter,
+     lambda sample: {'cited_by': sample['citation'][0], 'concrete': 'false'}),
+    ('papers citing an interned reference', PaperInstanceFilter,
+     lambda sample: {'citations': sample['citation'][1]}),
+    ('authors in a corpus', AuthorInstanceFilter,
+     lambda sample: {'corpus': sample['corpus']}),
+    ('authors of a paper', AuthorInstanceFilter,
+     lambda sample: {'paper': sample['paper']}),
+    ('institutions in a corpus', InstitutionInstanceFilter,
+     lambda sample: {'corpus': sample['corpus']}),
+    ('affiliations of a paper', AffiliationInstanceFilter,
+     lambda sample: {'paper': sample['paper']}),
+    ('affiliations of an author', AffiliationInstanceFilter,
+     lambda sample: {'author': sample['author']}),
+    ('metadata of a paper', InstanceMetadatumFilter,
+     lambda sample: {'paper': sample['paper'], 'name': sample['metadatum']}),
+    ('identifiers of a paper', InstanceIdentifierFilter,
+     lambda sample: {'paper': sample['paper'], 'name': sample['identifier'][0]}),
+    ('identifiers by value', InstanceIdentifierFilter,
+     lambda sample: {'name': sample['identifier'][0], 'value': sample['identifier'][1]}),
+]
+"""
+The list queries that the API makes most, as ``(description, filter class,
+function of sample values that returns query parameters)``\. Queries with a
+parameter that the corpus has no sample value for (e.g. interned citations)
+are skipped.
+"""
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        for node in walk(child):
+            yield node
+
+
+def describe(node):
+    target = node.get('Index Name') or node.get('Relation Name')
+    return '%s on %s' % (node['Node Type'], target) if target else node['Node Type']
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN the canonical list queries of the REST API, and fail if'
+            ' any of them would scan a large table sequentially.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', dest='corpus', type=int, default=None,
+                            help='Take sample values from this corpus (default:'
+                                 ' the one with the most papers).')
+        parser.add_argument('--min-rows', dest='min_rows', type=int,
+                            default=10000,
+                            help='Sequential scans of tables with fewer'
+                                 ' (estimated) rows than this are allowed'
+                                 ' (default 10000).')
+        parser.add_argument('--verbose-plans', dest='verbose_plans',
+                            action='store_true', default=False,
+                            help='Print the full plan of every query.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Query plans can only be checked on PostgreSQL.')
+
+        sample = self.get_sample(options.get('corpus'))
+        failures = []
+        checked = 0
+        for description, filter_class, get_params in CANONICAL_QUERIES:
+            params = get_params(sample)
+            if None in params.values():
+                self.stdout.write('skip %s: no sample in this corpus' % description)
+                continue
+            checked += 1
+            model = filter_class.Meta.model
+            queryset = model.objects.filter(created_by=sample['user'])
+            queryset = filter_class(params, queryset=queryset).qs
+            variants = [
+                ('page', queryset[:PAGE_SIZE]),
+                ('keyset', queryset.filter(pk__gt=0).order_by('pk')[:PAGE_SIZE]),
+            ]
+            for variant, page in variants:
+                plan = self.explain(page)
+                scans = self.large_seq_scans(plan, options.get('min_rows'))
+                nodes = ', '.join([describe(node) for node in walk(plan)])
+                status = 'FAIL' if scans else 'ok'
+                self.stdout.write('%-4s %s (%s): %s' % (status, description, variant, nodes))
+                if options.get('verbose_plans'):
+                    self.stdout.write(json.dumps(plan, indent=2))
+                if scans:
+                    failures.append('%s (%s): sequential scan on %s' % \
+                                    (description, variant, ', '.join(scans)))
+
+        if failures:
+            raise CommandError('%i queries scan large tables sequentially:\n%s' % \
+                               (len(failures), '\n'.join(failures)))
+        self.stdout.write('All %i queries use indexes on large tables.' % \
+                          (checked * 2))
+
+    def get_sample(self, corpus_id):
+        """
+        Values that the canonical queries are filtered by, taken from a real
+        corpus so that the planner sees realistic selectivity.
+        """
+        if corpus_id is None:
+            corpus_id = CorpusCounter.objects.filter(name='papers')\
+                                             .order_by('-value')\
+                                             .values_list('corpus_id', flat=True).first()
+        corpus = Corpus.objects.filter(pk=corpus_id).first() if corpus_id \
+                 else Corpus.objects.order_by('pk').first()
+        if corpus is None:
+            raise CommandError('No corpus to take sample values from.')
+
+        paper = PaperInstance.objects.filter(corpus=corpus, concrete=True)\
+                                     .order_by('pk').first()
+        if paper is None:
+            raise CommandError('Corpus %i has no papers.' % corpus.id)
+        reference = PaperInstance.objects.filter(corpus=corpus, concrete=False)\
+                                         .exclude(cited_by=None)\
+                                         .order_by('pk').values_list('pk', flat=True).first()
+        citation = InstanceCitation.objects.filter(citing__corpus=corpus)\
+                                           .order_by('pk')\
+                                           .values_list('citing', 'cited').first()
+        author = AuthorInstance.objects.filter(paper=paper)\
+                                       .values_list('pk', flat=True).first()
+        metadatum = InstanceMetadatum.objects.filter(paper=paper)\
+                                             .values_list('name', flat=True).first()
+        identifier = InstanceIdentifier.objects.filter(paper=paper)\
+                                               .values_list('name', 'value').first()
+        return {
+            'user': corpus.created_by_id,
+            'corpus': corpus.id,
+            'paper': paper.id,
+            'reference': reference,
+            'citation': citation or (None, None),
+            'author': author or 0,
+            'metadatum': metadatum or 'title',
+            'identifier': identifier or ('doi', ''),
+        }
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def large_seq_scans(self, plan, min_rows):
+        tables = set([node['Relation Name'] for node in walk(plan)
+                      if node['Node Type'] == 'Seq Scan'])
+        if not tables:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT relname, reltuples FROM pg_class'
+                           ' WHERE relname IN %s', [tuple(tables)])
+            rows = dict(cursor.fetchall())
+        return sorted([table for table in tables if rows.get(table, 0) >= min_rows])
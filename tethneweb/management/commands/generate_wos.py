@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tethneweb.synthetic import SyntheticWoS
+
+
+class Command(BaseCommand):
+    help = ('Write a synthetic Web of Science corpus, for benchmarks (see'
+            ' tethneweb.synthetic).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str,
+                            help='Directory to write the data files to.')
+        parser.add_argument('--papers', dest='papers', type=int, default=10000,
+                            help='Number of records (default 10000).')
+        parser.add_argument('--files', dest='files', type=int, default=None,
+                            help='Number of files (default: one per 5000'
+                                 ' records).')
+        parser.add_argument('--seed', dest='seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        papers = options.get('papers')
+        if papers < 1:
+            raise CommandError('--papers must be at least 1.')
+        files = options.get('files') or max(1, papers / 5000)
+        generator = SyntheticWoS(papers, seed=options.get('seed'))
+        paths = generator.write(options.get('path'), files=files)
+        self.stdout.write('Wrote %i records to %i files in %s' % \
+                          (papers, len(paths), options.get('path')))
@@ -0,0 +1,188 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import signal
+import sys
+
+from tethneweb.models import Corpus, DeferredIndex, IngestRun, PaperInstance
+from tethneweb.bulk import WRITERS
+from tethneweb.deferral import drop_deferrable, restore_abandoned, restore_deferred
+from tethneweb.ingest import CorpusHandler, METADATA_ROWS, METADATA_LAYOUTS
+from tethneweb.instrumentation import IngestStats
+from tethneweb.sources import SOURCES
+
+
+class Command(BaseCommand):
+    help = 'Load bibliographic data from any supported source.'
+
+    source = None
+    """If set, the name of the only source this command loads."""
+
+    def add_arguments(self, parser):
+        if self.source is None:
+            parser.add_argument('--source', dest='source', default=None,
+                                choices=sorted(SOURCES.keys()),
+                                help='Where the data files come from.'
+                                     ' Required unless resuming a run.')
+        parser.add_argument('path', nargs='?', type=str,
+                            help='A data file, a directory of data files,'
+                                 ' or a glob pattern (quoted).')
+        parser.add_argument('label', nargs='?', type=str)
+        parser.add_argument('batch_size', nargs='?', type=int)
+        parser.add_argument('--corpus', dest='corpus', type=int, default=None,
+                            help='ID of an existing corpus to add records'
+                                 ' to, instead of creating one (label is'
+                                 ' then ignored).')
+        parser.add_argument('--resume', dest='resume', type=int, default=None,
+                            help='ID of an interrupted run to resume, with the'
+                                 ' files and options it was started with.')
+        parser.add_argument('--writer', dest='writer', default='bulk_create',
+                            choices=sorted(WRITERS.keys()),
+                            help='How batches are written: with bulk_create'
+                                 ' (default), or streamed with PostgreSQL'
+                                 ' COPY ... FROM STDIN.')
+        parser.add_argument('--metadata', dest='metadata',
+                            default=METADATA_ROWS, choices=METADATA_LAYOUTS,
+                            help='Store paper metadata as one pickled row per'
+                                 ' field (default), or as one JSON document'
+                                 ' per paper.')
+        parser.add_argument('--intern-citations', dest='intern_citations',
+                            action='store_true', default=False,
+                            help='Store each distinct cited reference once per'
+                                 ' corpus (by DOI or ayjid), and record'
+                                 ' citations as edges.')
+        parser.add_argument('--workers', dest='workers', default=1, type=int,
+                            help='Number of worker processes used to parse'
+                                 ' and transform files (default 1).')
+        parser.add_argument('--stats', dest='stats', default=None,
+                            help='Write a JSON summary of timings and'
+                                 ' throughput to this path.')
+        parser.add_argument('--report-interval', dest='report_interval',
+                            default=30, type=int,
+                            help='Seconds between progress reports'
+                                 ' (default 30).')
+        parser.add_argument('--large-load', dest='large_load',
+                            action='store_true', default=False,
+                            help='Commit batches without waiting for the'
+                                 ' write-ahead log to be flushed; an'
+                                 ' interrupted run can be resumed.')
+        parser.add_argument('--defer-indexes', dest='defer_indexes',
+                            action='store_true', default=False,
+                            help='Drop secondary indexes and foreign key'
+                                 ' constraints on the instance tables during'
+                                 ' the load, and rebuild them afterwards.'
+                                 ' Only for an initial load (implies'
+                                 ' --large-load).')
+        parser.add_argument('--restore-indexes', dest='restore_indexes',
+                            action='store_true', default=False,
+                            help='Rebuild all indexes and constraints'
+                                 ' deferred by earlier runs, and exit. Those'
+                                 ' of runs that have failed, or stopped'
+                                 ' committing, are rebuilt before any load.')
+
+    def handle(self, *args, **options):
+        if options.get('restore_indexes'):
+            restored = restore_deferred()
+            self.stdout.write('Rebuilt %i indexes and constraints' % restored)
+            return
+        # A run that is still loading needs its indexes to stay dropped.
+        restored = restore_abandoned()
+        if restored:
+            self.stdout.write('Rebuilt %i indexes and constraints deferred by'
+                              ' runs that have stopped' % restored)
+        pending = DeferredIndex.objects.count()
+        if pending:
+            self.stdout.write('%i indexes and constraints are deferred by a run'
+                              ' that is still loading; if it has stopped,'
+                              ' rebuild them with --restore-indexes' % pending)
+
+        # Stopped with SIGTERM, the run is marked as failed on the way out.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+        if options.get('defer_indexes'):
+            # Checked before the handler creates the corpus and the run.
+            own_corpus = None
+            if options.get('resume'):
+                own_corpus = IngestRun.objects.filter(pk=options.get('resume'))\
+                                              .values_list('corpus_id', flat=True).first()
+            if options.get('corpus') or \
+                    PaperInstance.objects.exclude(corpus_id=own_corpus).exists():
+                raise CommandError('--defer-indexes is only allowed for an'
+                                   ' initial load.')
+
+        stats = IngestStats(report=self.stdout.write,
+                            interval=options.get('report_interval'))
+        if options.get('resume'):
+            try:
+                handler = CorpusHandler.resume(options.get('resume'), stats=stats)
+            except IngestRun.DoesNotExist:
+                raise CommandError('No such run: %i' % options.get('resume'))
+        else:
+            source_name = self.source or options.get('source')
+            if not source_name:
+                raise CommandError('--source is required unless resuming a run.')
+            source = SOURCES[source_name]()
+            path = options.get('path')
+            label = options.get('label')
+            batch_size = options.get('batch_size')
+            corpus = None
+            if options.get('corpus'):
+                try:
+                    corpus = Corpus.objects.get(pk=options.get('corpus'))
+                except Corpus.DoesNotExist:
+                    raise CommandError('No such corpus: %i' % options.get('corpus'))
+                if corpus.source != source.corpus_source:
+                    raise CommandError('Corpus %i is from %s, not %s' % \
+                                       (corpus.id, corpus.source,
+                                        source.corpus_source))
+                label = corpus.label
+            if not (path and label and batch_size):
+                raise CommandError('path, label and batch_size are required'
+                                   ' unless resuming a run.')
+
+            paths = source.find_files(path)
+            if not paths:
+                raise CommandError('No %s data files found at %s' % \
+                                   (source.name, path))
+
+            handler = CorpusHandler(source, label, batch_size,
+                                    writer=WRITERS[options.get('writer')](),
+                                    metadata_layout=options.get('metadata'),
+                                    intern_citations=options.get('intern_citations'),
+                                    large_load=options.get('large_load') or options.get('defer_indexes'),
+                                    corpus=corpus, stats=stats)
+            handler.add_files(paths)
+        self.stdout.write('Run %i, corpus %i' % (handler.run.id, handler.corpus.id))
+
+        if options.get('defer_indexes'):
+            models = [model for model_name, model in CorpusHandler._add_order]
+            with stats.stage('drop_indexes'):
+                dropped = drop_deferrable(models, keep=CorpusHandler._lookup_indexes,
+                                          run=handler.run)
+            self.stdout.write('Dropped %i indexes and constraints' % len(dropped))
+            try:
+                loaded, failed = self._load(handler, options.get('workers'))
+            finally:
+                self.stdout.write('Rebuilding indexes and constraints')
+                with stats.stage('restore_indexes'):
+                    restore_deferred(run=handler.run)
+        else:
+            loaded, failed = self._load(handler, options.get('workers'))
+
+        stats.maybe_report(force=True)
+        self.stdout.write('Corpus %i: loaded %i files, %i failed' % \
+                          (handler.corpus.id, loaded, failed))
+        if options.get('stats'):
+            stats.write(options.get('stats'))
+
+    def _load(self, handler, workers):
+        loaded = failed = 0
+        for file_path, count, quarantined, duplicates, error in handler.run_files(workers=workers):
+            if error:
+                failed += 1
+                self.stderr.write('%s\t%s' % (file_path, error))
+            else:
+                loaded += 1
+                self.stdout.write('%s\tloaded %i records, quarantined %i,'
+                                  ' skipped %i duplicates' % \
+                                  (file_path, count, quarantined, duplicates))
+        return loaded, failed
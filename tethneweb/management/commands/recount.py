@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from tethneweb.models import Corpus
+from tethneweb import counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the row counters of one or more corpora.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='*', type=int,
+                            help='IDs of the corpora to recount (default: all).')
+
+    def handle(self, *args, **options):
+        corpora = Corpus.objects.all()
+        if options.get('corpus'):
+            corpora = corpora.filter(pk__in=options.get('corpus'))
+        for corpus in corpora:
+            counts.recount(corpus)
+            self.stdout.write('Corpus %i: %s' % (corpus.id, ', '.join([
+                '%s %i' % (name, value) for name, value
+                in sorted(counts.corpus_counts(corpus).items())])))
@@ -0,0 +1,90 @@
+"""
+Lossless JSON encoding for tethne paper metadata.
+
+JSON has no tuples, sets, or non-string dict keys, all of which turn up in
+tethne metadata (e.g. ``addresses`` is keyed on author name tuples). Such
+values are wrapped in single-key objects whose key names the original type:
+
+.. code-block:: python
+
+   >>> encode({('SMITH', 'J'): (1, 2)})
+   {'__dict__': [[{'__tuple__': ['SMITH', 'J']}, {'__tuple__': [1, 2]}]]}
+
+:func:`decode` reverses the encoding exactly.
+"""
+
+import base64
+import math
+import cPickle as pickle
+
+
+TUPLE = '__tuple__'
+SET = '__set__'
+DICT = '__dict__'
+BYTES = '__bytes__'
+FLOAT = '__float__'
+PICKLE = '__pickle__'
+MARKERS = set([TUPLE, SET, DICT, BYTES, FLOAT, PICKLE])
+
+
+def encode(value):
+    """
+    Convert ``value`` into a structure that can be stored as JSON.
+    """
+    if value is None or isinstance(value, (bool, int, long, unicode)):
+        return value
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return {FLOAT: repr(value)}
+        return value
+    if isinstance(value, str):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return {BYTES: base64.b64encode(value)}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    if isinstance(value, tuple):
+        return {TUPLE: [encode(item) for item in value]}
+    if isinstance(value, (set, frozenset)):
+        return {SET: [encode(item) for item in value]}
+    if isinstance(value, dict):
+        # Keys that aren't UTF-8 would be encoded as BYTES objects, which
+        # can't be keys.
+        plain = all([isinstance(key, basestring) and key not in MARKERS
+                     and isinstance(encode(key), basestring)
+                     for key in value.keys()])
+        if plain:
+            return {encode(key): encode(item) for key, item in value.iteritems()}
+        return {DICT: [[encode(key), encode(item)]
+                       for key, item in value.iteritems()]}
+    # Anything else (e.g. custom classes) is kept intact, if opaque.
+    return {PICKLE: base64.b64encode(pickle.dumps(value))}
+
+
+def decode(value, unpickle=False):
+    """
+    Reverse :func:`encode`\.
+
+    Pickled values are only unpickled if ``unpickle`` is True; never do this
+    with documents from an untrusted source.
+    """
+    if isinstance(value, list):
+        return [decode(item, unpickle) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        key, item = value.items()[0]
+        if key == TUPLE:
+            return tuple([decode(i, unpickle) for i in item])
+        if key == SET:
+            return set([decode(i, unpickle) for i in item])
+        if key == DICT:
+            return {decode(k, unpickle): decode(v, unpickle) for k, v in item}
+        if key == BYTES:
+            return base64.b64decode(item)
+        if key == FLOAT:
+            return float(item)
+        if key == PICKLE and unpickle:
+            return pickle.loads(base64.b64decode(item))
+    return {key: decode(item, unpickle) for key, item in value.iteritems()}
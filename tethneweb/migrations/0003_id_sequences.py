@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+BLOCK_SIZE = 100
+
+TABLES = [
+    'tethneweb_corpus',
+    'tethneweb_paperinstance',
+    'tethneweb_instanceidentifier',
+    'tethneweb_instancemetadatum',
+    'tethneweb_authorinstance',
+    'tethneweb_institutioninstance',
+    'tethneweb_affiliationinstance',
+]
+
+
+def create_sequence(table):
+    return [
+        "CREATE SEQUENCE %s_id_seq INCREMENT BY %i MINVALUE 1;" % (table, BLOCK_SIZE),
+        "SELECT setval('%s_id_seq', COALESCE((SELECT MAX(id) FROM %s), 0) + 1, false);" % (table, table),
+    ]
+
+
+def drop_sequence(table):
+    return ["DROP SEQUENCE %s_id_seq;" % table]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0002_paperinstance_checksum'),
+    ]
+
+    operations = [
+        migrations.RunSQL(create_sequence(table), drop_sequence(table))
+        for table in TABLES
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 12:39
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tethneweb', '0003_id_sequences'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstanceMetadataDocument',
+            fields=[
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('document', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('corpus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tethneweb.Corpus')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('paper', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='metadata_document', to='tethneweb.PaperInstance')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunSQL(
+            "CREATE SEQUENCE tethneweb_instancemetadatadocument_id_seq INCREMENT BY 100 MINVALUE 1;",
+            "DROP SEQUENCE tethneweb_instancemetadatadocument_id_seq;",
+        ),
+    ]
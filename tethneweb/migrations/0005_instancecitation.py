@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0004_instancemetadatadocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstanceCitation',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('cited', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='citing_edges', to='tethneweb.PaperInstance')),
+                ('citing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reference_edges', to='tethneweb.PaperInstance')),
+            ],
+        ),
+        migrations.RunSQL(
+            "CREATE SEQUENCE tethneweb_instancecitation_id_seq INCREMENT BY 100 MINVALUE 1;",
+            "DROP SEQUENCE tethneweb_instancecitation_id_seq;",
+        ),
+    ]
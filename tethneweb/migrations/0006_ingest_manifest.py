@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 12:41
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tethneweb', '0005_instancecitation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestFile',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('path', models.TextField()),
+                ('status', models.CharField(choices=[(b'PENDING', b'Pending'), (b'DONE', b'Done'), (b'FAILED', b'Failed')], default=b'PENDING', max_length=35)),
+                ('offset', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IngestRun',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_modified', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(choices=[(b'RUNNING', b'Running'), (b'COMPLETED', b'Completed')], default=b'RUNNING', max_length=35)),
+                ('options', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('corpus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_runs', to='tethneweb.Corpus')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuarantinedRecord',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('position', models.PositiveIntegerField()),
+                ('error', models.TextField()),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quarantined_records', to='tethneweb.IngestFile')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quarantined_records', to='tethneweb.IngestRun')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingestfile',
+            name='run',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='tethneweb.IngestRun'),
+        ),
+    ] + [
+        migrations.RunSQL(
+            "CREATE SEQUENCE tethneweb_%s_id_seq INCREMENT BY 100 MINVALUE 1;" % name,
+            "DROP SEQUENCE tethneweb_%s_id_seq;" % name,
+        )
+        for name in ['ingestrun', 'ingestfile', 'quarantinedrecord']
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 12:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0006_ingest_manifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeferredIndex',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('table', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[(b'INDEX', b'Index'), (b'CONSTRAINT', b'Constraint')], max_length=35)),
+                ('definition', models.TextField()),
+            ],
+        ),
+        migrations.RunSQL(
+            "CREATE SEQUENCE tethneweb_deferredindex_id_seq INCREMENT BY 100 MINVALUE 1;",
+            "DROP SEQUENCE tethneweb_deferredindex_id_seq;",
+        ),
+    ]
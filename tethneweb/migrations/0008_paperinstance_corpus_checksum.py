@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 12:48
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0007_deferredindex'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='paperinstance',
+            index_together=set([('corpus', 'checksum')]),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 12:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+COUNTED = [
+    ('authors', 'tethneweb_authorinstance'),
+    ('institutions', 'tethneweb_institutioninstance'),
+    ('affiliations', 'tethneweb_affiliationinstance'),
+    ('identifiers', 'tethneweb_instanceidentifier'),
+    ('metadata', 'tethneweb_instancemetadatum'),
+    ('metadata_documents', 'tethneweb_instancemetadatadocument'),
+]
+
+INSERT = """
+INSERT INTO tethneweb_corpuscounter (id, corpus_id, name, value)
+SELECT nextval('tethneweb_corpuscounter_id_seq'), corpus_id, %s, COUNT(*)
+FROM %s GROUP BY %s;
+"""
+
+BACKFILL = [
+    INSERT % ("CASE WHEN concrete THEN 'papers' ELSE 'citations' END",
+              'tethneweb_paperinstance', 'corpus_id, concrete'),
+] + [INSERT % ("'%s'" % name, table, 'corpus_id') for name, table in COUNTED]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0008_paperinstance_corpus_checksum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorpusCounter',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('value', models.BigIntegerField(default=0)),
+                ('corpus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='tethneweb.Corpus')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='corpuscounter',
+            unique_together=set([('corpus', 'name')]),
+        ),
+        migrations.RunSQL(
+            "CREATE SEQUENCE tethneweb_corpuscounter_id_seq INCREMENT BY 100 MINVALUE 1;",
+            "DROP SEQUENCE tethneweb_corpuscounter_id_seq;",
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+from django.db.utils import DatabaseError
+
+
+# The expressions must match those in tethneweb.search, or they won't be used.
+FULL_TEXT = [
+    ('tethneweb_paperinstance', 'title'),
+    ('tethneweb_paperinstance', 'abstract'),
+]
+
+TRIGRAM = [
+    ('tethneweb_paperinstance', 'journal'),
+    ('tethneweb_authorinstance', 'first_name'),
+    ('tethneweb_authorinstance', 'last_name'),
+]
+
+
+def install_pg_trgm(apps, schema_editor):
+    """
+    Installs ``pg_trgm`` if it isn't installed already. On PostgreSQL < 13
+    only a superuser can, so the migration stops with instructions if the
+    database user may not.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone():
+            return
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute("CREATE EXTENSION pg_trgm")
+        except DatabaseError as E:
+            raise RuntimeError(
+                "The pg_trgm extension is not installed, and this database"
+                " user cannot install it (%s). Connect to the database %r as"
+                " a superuser, run 'CREATE EXTENSION pg_trgm;', and migrate"
+                " again." % (str(E).strip(),
+                             schema_editor.connection.settings_dict['NAME']))
+
+
+def create_indexes():
+    sql = ["CREATE INDEX %s_%s_fts ON %s USING gin ((to_tsvector('english', coalesce(\"%s\", ''))));" % \
+            (table, column, table, column) for table, column in FULL_TEXT]
+    sql += ["CREATE INDEX %s_%s_trgm ON %s USING gin (\"%s\" gin_trgm_ops);" % \
+            (table, column, table, column) for table, column in TRIGRAM]
+    return sql
+
+
+def drop_indexes():
+    return ["DROP INDEX %s_%s_fts;" % (table, column) for table, column in FULL_TEXT] + \
+           ["DROP INDEX %s_%s_trgm;" % (table, column) for table, column in TRIGRAM]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0009_corpuscounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_pg_trgm, migrations.RunPython.noop),
+        migrations.RunSQL(create_indexes(), drop_indexes()),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 13:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+BACKFILL = """
+UPDATE tethneweb_corpus SET last_modified = COALESCE(
+    (SELECT MAX(date_created) FROM tethneweb_paperinstance
+     WHERE tethneweb_paperinstance.corpus_id = tethneweb_corpus.id),
+    date_created);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0010_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='corpus',
+            name='last_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='corpus',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 13:07
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0011_corpus_version'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='affiliationinstance',
+            index_together=set([('corpus', 'created_by')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='authorinstance',
+            index_together=set([('corpus', 'created_by')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='instanceidentifier',
+            index_together=set([('name', 'value'), ('paper', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='instancemetadatum',
+            index_together=set([('paper', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='institutioninstance',
+            index_together=set([('corpus', 'created_by')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='paperinstance',
+            index_together=set([('cited_by', 'concrete'), ('corpus', 'concrete', 'created_by'), ('corpus', 'checksum')]),
+        ),
+    ]
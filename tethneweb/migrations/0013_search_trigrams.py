@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Substring filters on titles and abstracts (see tethneweb.search).
+TRIGRAM = [
+    ('tethneweb_paperinstance', 'title'),
+    ('tethneweb_paperinstance', 'abstract'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0012_list_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            ["CREATE INDEX %s_%s_trgm ON %s USING gin (\"%s\" gin_trgm_ops);" % \
+             (table, column, table, column) for table, column in TRIGRAM],
+            ["DROP INDEX %s_%s_trgm;" % (table, column) for table, column in TRIGRAM],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 14:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0013_search_trigrams'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingestrun',
+            name='status',
+            field=models.CharField(choices=[(b'RUNNING', b'Running'), (b'COMPLETED', b'Completed'), (b'FAILED', b'Failed')], default=b'RUNNING', max_length=35),
+        ),
+        migrations.AddField(
+            model_name='deferredindex',
+            name='run',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deferred_indexes', to='tethneweb.IngestRun'),
+        ),
+    ]
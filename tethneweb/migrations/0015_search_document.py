@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Full-text search matches titles and abstracts together (see
+# tethneweb.search.full_text), so one index of their combined vector replaces
+# the index of each (from 0010_search). The expression must match the query.
+TABLE = 'tethneweb_paperinstance'
+COLUMNS = ['title', 'abstract']
+
+
+def tsvector(column):
+    return "to_tsvector('english', coalesce(\"%s\", ''))" % column
+
+
+def create_per_column():
+    return ["CREATE INDEX %s_%s_fts ON %s USING gin ((%s));" % \
+            (TABLE, column, TABLE, tsvector(column)) for column in COLUMNS]
+
+
+def drop_per_column():
+    return ["DROP INDEX %s_%s_fts;" % (TABLE, column) for column in COLUMNS]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethneweb', '0014_ingest_run_failed'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            ["CREATE INDEX %s_document_fts ON %s USING gin ((%s));" % \
+             (TABLE, TABLE, ' || '.join([tsvector(column) for column in COLUMNS]))]
+            + drop_per_column(),
+            create_per_column() + ["DROP INDEX %s_document_fts;" % TABLE],
+        ),
+    ]
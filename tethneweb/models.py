@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.contrib.postgres.fields import JSONField
 
 
 class CorpusComponentMixin(models.Model):
@@ -64,6 +66,11 @@ class Corpus(models.Model):
     created_by = models.ForeignKey(User)
     label = models.CharField(max_length=255)
 
+    version = models.BigIntegerField(default=0)
+    """Incremented whenever rows in the corpus change (see :mod:`tethneweb.versions`\)."""
+
+    last_modified = models.DateTimeField(default=timezone.now)
+
     # def __len__(self):
     #     return self.papers.count()
 
@@ -81,6 +88,24 @@ class InstanceMetadatum(CorpusComponentMixin):
     paper = models.ForeignKey('PaperInstance', related_name='metadata')
     """The record that the :class:`.Metadatum` describes."""
 
+    class Meta:
+        # Pickled values can be too long for a B-tree, so (name, value) isn't
+        # indexed.
+        index_together = [('paper', 'name')]
+
+
+class InstanceMetadataDocument(CorpusComponentMixin):
+    """
+    All of the freeform metadata for a :class:`.PaperInstance` in a single
+    document, as an alternative to one :class:`.InstanceMetadatum` per field.
+
+    Values are encoded with :func:`tethneweb.metadata.encode`\.
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    paper = models.OneToOneField('PaperInstance',
+                                 related_name='metadata_document')
+    document = JSONField(default=dict)
+
 
 class InstanceIdentifier(CorpusComponentMixin):
     """
@@ -96,6 +121,9 @@ class InstanceIdentifier(CorpusComponentMixin):
 
     value = models.CharField(max_length=255)
 
+    class Meta:
+        index_together = [('paper', 'name'), ('name', 'value')]
+
 
 class Paper(CorpusComponentMixin):
     """
@@ -168,6 +196,25 @@ class PaperInstance(CorpusComponentMixin):
     concrete = models.BooleanField(default=True)
     cited_by = models.ForeignKey('PaperInstance', related_name='cited_references', null=True, blank=True)
 
+    class Meta:
+        # Matched to the list filters: corpus (papers and citations), cited_by
+        # (citations of a paper), both with concrete, and the created_by of
+        # CreatorOnlyMixin.
+        index_together = [('corpus', 'checksum'),
+                          ('corpus', 'concrete', 'created_by'),
+                          ('cited_by', 'concrete')]
+
+
+class InstanceCitation(models.Model):
+    """
+    A citation from a concrete :class:`.PaperInstance` to an interned cited
+    reference (a non-concrete :class:`.PaperInstance` that is shared by every
+    paper in the :class:`.Corpus` that cites it).
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    citing = models.ForeignKey('PaperInstance', related_name='reference_edges')
+    cited = models.ForeignKey('PaperInstance', related_name='citing_edges')
+
 
 class AuthorInstance(CorpusComponentMixin):
     """
@@ -185,6 +232,9 @@ class AuthorInstance(CorpusComponentMixin):
 
     last_name = models.CharField(max_length=255)
 
+    class Meta:
+        index_together = [('corpus', 'created_by')]
+
 
 class InstitutionInstance(CorpusComponentMixin):
     """
@@ -207,6 +257,9 @@ class InstitutionInstance(CorpusComponentMixin):
 
     country = models.CharField(max_length=255, null=True, blank=True)
 
+    class Meta:
+        index_together = [('corpus', 'created_by')]
+
 
 class AffiliationInstance(CorpusComponentMixin):
     """
@@ -224,6 +277,9 @@ class AffiliationInstance(CorpusComponentMixin):
     this should be 1./N (number of possible institutions).
     """
 
+    class Meta:
+        index_together = [('corpus', 'created_by')]
+
 
 class AuthorIdentity(DisambiguationMixin):
     """
@@ -266,3 +322,116 @@ class PaperIdentity(DisambiguationMixin):
     """
     paper = models.ForeignKey('Paper', related_name='instantiations')
     instance = models.ForeignKey('PaperInstance', related_name='identities')
+
+
+class IngestRun(models.Model):
+    """
+    A run of the loader over a set of files, which can be resumed if it is
+    interrupted.
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    corpus = models.ForeignKey('Corpus', related_name='ingest_runs')
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_modified = models.DateTimeField(auto_now=True)
+    """Updated with every commit, as a heartbeat while the run is loading."""
+
+    created_by = models.ForeignKey(User)
+
+    RUNNING = 'RUNNING'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = (
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    )
+    status = models.CharField(max_length=35, choices=STATUS_CHOICES,
+                              default=RUNNING)
+
+    options = JSONField(default=dict)
+    """The options that the run was started with, for use on resume."""
+
+
+class IngestFile(models.Model):
+    """
+    An entry in the manifest of an :class:`.IngestRun`\.
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    run = models.ForeignKey('IngestRun', related_name='files')
+    path = models.TextField()
+
+    PENDING = 'PENDING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    status = models.CharField(max_length=35, choices=STATUS_CHOICES,
+                              default=PENDING)
+
+    offset = models.PositiveIntegerField(default=0)
+    """
+    The number of records (from the start of the file) that have been committed
+    or quarantined. Updated in the same transaction as the records themselves.
+    """
+
+    error = models.TextField(null=True, blank=True)
+
+
+class QuarantinedRecord(models.Model):
+    """
+    A record that could not be parsed or transformed, and was set aside rather
+    than aborting its file.
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    run = models.ForeignKey('IngestRun', related_name='quarantined_records')
+    file = models.ForeignKey('IngestFile', related_name='quarantined_records')
+    position = models.PositiveIntegerField()
+    """Index of the record in its file."""
+
+    error = models.TextField()
+    data = JSONField(null=True, blank=True)
+    """Whatever was parsed, encoded with :func:`tethneweb.metadata.encode`\."""
+
+
+class DeferredIndex(models.Model):
+    """
+    A secondary index or foreign key constraint that was dropped for the
+    duration of a large load, and must be rebuilt afterwards (see
+    :mod:`tethneweb.deferral`\).
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    run = models.ForeignKey('IngestRun', related_name='deferred_indexes',
+                            null=True, blank=True, on_delete=models.SET_NULL)
+    """The run that dropped the index, and will rebuild it when it stops."""
+
+    table = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+
+    INDEX = 'INDEX'
+    CONSTRAINT = 'CONSTRAINT'
+    KIND_CHOICES = (
+        (INDEX, 'Index'),
+        (CONSTRAINT, 'Constraint'),
+    )
+    kind = models.CharField(max_length=35, choices=KIND_CHOICES)
+
+    definition = models.TextField()
+    """``CREATE INDEX`` statement, or constraint definition."""
+
+
+class CorpusCounter(models.Model):
+    """
+    A running count of the rows of one kind (see :mod:`tethneweb.counts`\) in
+    a :class:`.Corpus`\, kept up to date as rows are added and removed.
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    corpus = models.ForeignKey('Corpus', related_name='counters')
+    name = models.CharField(max_length=255)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('corpus', 'name'),)
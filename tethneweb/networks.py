@@ -0,0 +1,542 @@
+"""
+Networks built from the rows of a corpus, on the server.
+
+Citation networks are built from the rows that they need, read with a few
+bulk queries, and their edges are computed with numpy over arrays of row
+indices, rather than with a Python loop over pairs. Graphs that count shared
+neighbours (co-citation and bibliographic coupling) are products of a sparse
+incidence matrix with its transpose; :func:`pair_counts` computes these
+products directly on the coordinate lists of the matrix.
+
+Author networks are aggregated in the database, so that only one row per
+edge is read: co-authorship with a grouped self-join (see
+:func:`coauthorship`\), and author-institution weights with a grouped sum
+that :func:`numpy.bincount` merges into nodes.
+
+Built networks are cached per corpus version (see :mod:`tethneweb.versions`
+and :func:`get_network`\), and written out as GraphML (:func:`to_graphml`\)
+or as edge rows (:func:`edge_rows`\), chunk by chunk.
+"""
+
+from django.db import connection
+from django.db.models import Sum
+
+from collections import defaultdict, OrderedDict
+from xml.sax.saxutils import escape, quoteattr
+import hashlib
+
+import numpy as np
+
+from tethneweb.models import *
+from tethneweb.caching import get_cache
+from tethneweb.export import iter_values
+from tethneweb.ingest import reference_key
+
+
+MAX_PAIRS = 5000000
+"""
+The most pairs of neighbours that :func:`pair_counts` (or the self-join in
+:func:`coauthorship`\) will enumerate before they are counted, to bound
+memory use and time.
+"""
+
+CHUNK_SIZE = 2000
+
+
+class NetworkTooLarge(ValueError):
+    pass
+
+
+class Network(object):
+    """
+    A graph over integer node indices, with edges held as arrays.
+
+    Parameters
+    ----------
+    kind : str
+    directed : bool
+    nodes : list
+        Node identifiers, by index.
+    attributes : list
+        A ``dict`` of attributes (``label``\, ``year``\, ``type``\) for each
+        node.
+    sources : :class:`numpy.ndarray`
+    targets : :class:`numpy.ndarray`
+    weights : :class:`numpy.ndarray`
+    """
+
+    def __init__(self, kind, directed, nodes, attributes, sources, targets,
+                 weights):
+        self.kind = kind
+        self.directed = directed
+        self.nodes = nodes
+        self.attributes = attributes
+        self.sources = sources
+        self.targets = targets
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.sources)
+
+    def threshold(self, min_weight):
+        """
+        A copy of the network without edges lighter than ``min_weight``\.
+        """
+        keep = self.weights >= min_weight
+        return Network(self.kind, self.directed, self.nodes, self.attributes,
+                       self.sources[keep], self.targets[keep],
+                       self.weights[keep])
+
+    def connected_nodes(self):
+        """
+        Indices of the nodes that have at least one edge.
+        """
+        return np.unique(np.concatenate([self.sources, self.targets]))
+
+
+def dedupe(sources, targets):
+    """
+    Distinct ``(source, target)`` pairs, ordered by source and target.
+    """
+    if not len(sources):
+        return sources, targets
+    n = max(sources.max(), targets.max()) + 1
+    pairs = np.unique(sources.astype(np.int64) * n + targets)
+    return pairs // n, pairs % n
+
+
+def pair_counts(groups, members, max_pairs=MAX_PAIRS):
+    """
+    For each pair of members that share at least one group, the number of
+    groups that they share: the upper triangle of ``A.T * A``\, where ``A``
+    is the incidence matrix with a one at each ``(group, member)``\.
+
+    ``(group, member)`` pairs must be distinct. Returns ``(first, second,
+    count)`` arrays, with ``first < second``\.
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    if not len(groups):
+        return empty, empty, empty
+    order = np.lexsort((members, groups))
+    groups, members = groups[order], members[order]
+
+    # Each member is paired with the members that follow it in its group.
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(groups)) + 1])
+    sizes = np.diff(np.concatenate([starts, [len(groups)]]))
+    ends = np.repeat(starts + sizes, sizes)
+    position = np.arange(len(groups))
+    following = ends - position - 1
+    total = following.sum()
+    if total > max_pairs:
+        raise NetworkTooLarge('the network has more than %i pairs of'
+                              ' neighbours; select fewer years' % max_pairs)
+    if not total:
+        return empty, empty, empty
+    left = np.repeat(position, following)
+    offsets = np.arange(total) - np.repeat(np.cumsum(following) - following,
+                                           following)
+    right = left + 1 + offsets
+
+    n = members.max() + 1
+    pairs, counts = np.unique(members[left].astype(np.int64) * n + members[right],
+                              return_counts=True)
+    return pairs // n, pairs % n, counts
+
+
+def reference_keys(corpus):
+    """
+    Maps the IDs of the papers in ``corpus`` onto their
+    :func:`tethneweb.ingest.reference_key`\s.
+    """
+    found = defaultdict(dict)
+    identifiers = InstanceIdentifier.objects.filter(corpus=corpus,
+                                                    name__in=['doi', 'ayjid'])
+    for row in iter_values(identifiers, ['paper_id', 'name', 'value']):
+        found[row['paper_id']][row['name']] = row['value']
+    return {paper_id: reference_key(**values)
+            for paper_id, values in found.iteritems()}
+
+
+def year_filter(years, prefix=''):
+    """
+    Queryset filters for papers published in ``years`` (see
+    :func:`in_years`\). ``prefix`` is the path from the queried model to
+    :class:`.PaperInstance` (e.g. ``'paper__'``\).
+    """
+    first, last = years or (None, None)
+    filters = {}
+    if first is not None:
+        filters[prefix + 'publication_date__gte'] = first
+    if last is not None:
+        filters[prefix + 'publication_date__lte'] = last
+    return filters
+
+
+def in_years(year, years):
+    """
+    Whether ``year`` is in ``years``\, a ``(first, last)`` pair of which
+    either may be ``None``\.
+    """
+    first, last = years
+    return year is not None and (first is None or year >= first) \
+                            and (last is None or year <= last)
+
+
+def citations(corpus, years=None):
+    """
+    Reads the citations of the papers in ``corpus`` (published in
+    ``years``\, if given; see :func:`in_years`\), from ``cited_by`` and from
+    interned :class:`.InstanceCitation` edges.
+
+    The papers of the corpus are the first nodes. Every other node is a cited
+    work, identified by DOI or ayjid (see
+    :func:`tethneweb.ingest.reference_key`\), so that each reference to it is
+    counted once; a reference to a paper of the corpus is a citation of that
+    paper's node.
+
+    Returns
+    -------
+    tuple
+        ``(nodes, attributes, citing, cited)``\, where ``citing`` and
+        ``cited`` are arrays of node indices.
+    """
+    papers = PaperInstance.objects.filter(corpus=corpus)
+    citing_ids, reference_ids = [], []
+    paper_ids, attributes, reference_years = [], [], {}
+    for row in iter_values(papers, ['id', 'concrete', 'cited_by_id',
+                                    'publication_date', 'title']):
+        if row['concrete']:
+            paper_ids.append(row['id'])
+            attributes.append({'type': 'paper', 'label': row['title'],
+                               'year': row['publication_date']})
+        else:
+            reference_years[row['id']] = row['publication_date']
+            if row['cited_by_id'] is not None:
+                citing_ids.append(row['cited_by_id'])
+                reference_ids.append(row['id'])
+    edges = InstanceCitation.objects.filter(citing__corpus=corpus)
+    for row in iter_values(edges, ['citing_id', 'cited_id']):
+        citing_ids.append(row['citing_id'])
+        reference_ids.append(row['cited_id'])
+
+    keys = reference_keys(corpus)
+    nodes = ['paper:%i' % paper_id for paper_id in paper_ids]
+    index = {keys.get(paper_id) or node: i
+             for i, (paper_id, node) in enumerate(zip(paper_ids, nodes))}
+    paper_ids = np.array(paper_ids, dtype=np.int64)
+    order = np.argsort(paper_ids)
+
+    # Papers outside of the years are still nodes (they can be cited), but
+    # their own citations are left out.
+    citing_ids = np.array(citing_ids, dtype=np.int64)
+    reference_ids = np.array(reference_ids, dtype=np.int64)
+    if years:
+        selected = [i for i, values in enumerate(attributes)
+                    if in_years(values['year'], years)]
+        keep = np.in1d(citing_ids, paper_ids[selected])
+    else:
+        keep = np.in1d(citing_ids, paper_ids)
+    citing_ids, reference_ids = citing_ids[keep], reference_ids[keep]
+    citing = order[np.searchsorted(paper_ids[order], citing_ids)]
+
+    distinct, inverse = np.unique(reference_ids, return_inverse=True)
+    work_index = np.zeros(len(distinct), dtype=np.int64)
+    for i, reference_id in enumerate(distinct):
+        key = keys.get(reference_id) or 'paper:%i' % reference_id
+        if key not in index:
+            index[key] = len(nodes)
+            nodes.append(key)
+            attributes.append({'type': 'work', 'label': key.split(':', 1)[1],
+                               'year': reference_years.get(reference_id)})
+        work_index[i] = index[key]
+    cited = work_index[inverse]
+
+    citing, cited = dedupe(citing, cited)
+    return nodes, attributes, citing, cited
+
+
+def direct_citation(corpus, years=None):
+    """
+    A directed edge from each paper to each work that it cites.
+    """
+    nodes, attributes, citing, cited = citations(corpus, years)
+    return Network('direct_citation', True, nodes, attributes, citing, cited,
+                   np.ones(len(citing), dtype=np.int64))
+
+
+def cocitation(corpus, years=None):
+    """
+    An edge between each two works that are cited together, weighted by the
+    number of papers that cite both.
+    """
+    nodes, attributes, citing, cited = citations(corpus, years)
+    first, second, counts = pair_counts(citing, cited)
+    return Network('cocitation', False, nodes, attributes, first, second,
+                   counts)
+
+
+def bibliographic_coupling(corpus, years=None):
+    """
+    An edge between each two papers that cite the same work, weighted by the
+    number of works that both cite.
+    """
+    nodes, attributes, citing, cited = citations(corpus, years)
+    first, second, counts = pair_counts(cited, citing)
+    return Network('bibliographic_coupling', False, nodes, attributes, first,
+                   second, counts)
+
+
+class NodeIndex(object):
+    """
+    Numbers nodes in the order in which their keys are first seen.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.attributes = []
+        self.index = {}
+
+    def add(self, key, node_type, label):
+        i = self.index.get(key)
+        if i is None:
+            i = self.index[key] = len(self.nodes)
+            self.nodes.append(key)
+            self.attributes.append({'type': node_type, 'label': label,
+                                    'year': None})
+        return i
+
+
+def author_node(last_name, first_name):
+    """
+    Key and label of the author node for an :class:`.AuthorInstance`\. As in
+    the citation keys of Web of Science, authors are identified by surname
+    and initials.
+    """
+    first_name = (first_name or '').strip()
+    initials = ''.join([part[0] for part
+                        in first_name.replace('.', ' ').replace('-', ' ').split()])
+    key = 'author:%s' % ('%s %s' % (last_name.strip(), initials)).strip().upper()
+    label = '%s, %s' % (last_name, first_name) if first_name else last_name
+    return key, label
+
+
+AUTHOR_INITIALS = r"""
+array_to_string(ARRAY(
+    SELECT left(part, 1)
+    FROM regexp_split_to_table(
+        translate(coalesce("tethneweb_authorinstance"."first_name", ''), '.-', '  '),
+        '\s+') AS part
+    WHERE part <> ''), '')
+"""
+
+AUTHOR_KEY = """
+'author:' || upper(btrim(btrim("tethneweb_authorinstance"."last_name")
+                         || ' ' || %s))
+""" % AUTHOR_INITIALS
+"""The key of :func:`author_node`\, in SQL."""
+
+AUTHOR_LABEL = """
+CASE WHEN btrim(coalesce("tethneweb_authorinstance"."first_name", '')) <> ''
+     THEN "tethneweb_authorinstance"."last_name" || ', '
+          || btrim("tethneweb_authorinstance"."first_name")
+     ELSE "tethneweb_authorinstance"."last_name" END
+"""
+"""The label of :func:`author_node`\, in SQL."""
+
+COAUTHOR_PAIRS = """
+WITH authors AS (
+    SELECT paper_id, node, MIN(label) AS label FROM (%s) AS author_rows
+    GROUP BY paper_id, node
+)
+SELECT COALESCE(SUM(n * (n - 1) / 2), 0)
+FROM (SELECT COUNT(*) AS n FROM authors GROUP BY paper_id) AS papers
+"""
+
+COAUTHOR_EDGES = """
+WITH authors AS (
+    SELECT paper_id, node, MIN(label) AS label FROM (%s) AS author_rows
+    GROUP BY paper_id, node
+)
+SELECT a.node, MIN(a.label), b.node, MIN(b.label), COUNT(*)
+FROM authors AS a
+JOIN authors AS b
+  ON a.paper_id = b.paper_id AND a.node < b.node
+GROUP BY a.node, b.node
+ORDER BY a.node, b.node
+"""
+
+
+def iter_rows(sql, params, chunk_size=CHUNK_SIZE):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+
+def institution_node(name, country):
+    """
+    Key and label of the institution node for an
+    :class:`.InstitutionInstance`\: its name and country.
+    """
+    label = ', '.join([part.strip() for part in (name, country) if part])
+    return 'institution:%s' % label.upper(), label
+
+
+def coauthorship(corpus, years=None):
+    """
+    An edge between each two authors of the same paper, weighted by the
+    number of papers that they wrote together.
+
+    Author rows are keyed (as :func:`author_node` does) and paired in the
+    database, and counted in groups, so that one row per edge is read.
+    """
+    authors = AuthorInstance.objects.filter(corpus=corpus, paper__concrete=True,
+                                            **year_filter(years, 'paper__'))
+    rows = authors.extra(select={'node': AUTHOR_KEY, 'label': AUTHOR_LABEL})\
+                  .values('paper_id', 'node', 'label').order_by()
+    sql, params = rows.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(COAUTHOR_PAIRS % sql, params)
+        total = cursor.fetchone()[0]
+    if total > MAX_PAIRS:
+        raise NetworkTooLarge('the network has more than %i pairs of'
+                              ' neighbours; select fewer years' % MAX_PAIRS)
+
+    nodes = NodeIndex()
+    first, second, counts = [], [], []
+    for key, label, other_key, other_label, count \
+            in iter_rows(COAUTHOR_EDGES % sql, params):
+        first.append(nodes.add(key, 'author', label))
+        second.append(nodes.add(other_key, 'author', other_label))
+        counts.append(count)
+    return Network('coauthorship', False, nodes.nodes, nodes.attributes,
+                   np.array(first, dtype=np.int64),
+                   np.array(second, dtype=np.int64),
+                   np.array(counts, dtype=np.int64))
+
+
+def author_institution(corpus, years=None):
+    """
+    An edge from each author to each institution that they are affiliated
+    with, weighted by the sum of the ``confidence`` of the affiliations (one
+    per paper, or a fraction of one if the paper doesn't say which of its
+    institutions the author belongs to).
+
+    Confidence is summed in the database, for each distinct author name and
+    institution name and country; the sums of names that are the same node
+    (see :func:`author_node` and :func:`institution_node`\) are added up
+    here.
+    """
+    nodes = NodeIndex()
+    fields = ['author__last_name', 'author__first_name', 'institution__name',
+              'institution__country']
+    affiliations = AffiliationInstance.objects\
+        .filter(corpus=corpus, paper__concrete=True,
+                **year_filter(years, 'paper__'))\
+        .values(*fields).annotate(weight=Sum('confidence')).order_by(*fields)
+    authors, institutions, confidence = [], [], []
+    for row in affiliations.iterator():
+        key, label = author_node(row['author__last_name'],
+                                 row['author__first_name'])
+        authors.append(nodes.add(key, 'author', label))
+        key, label = institution_node(row['institution__name'],
+                                      row['institution__country'])
+        institutions.append(nodes.add(key, 'institution', label))
+        confidence.append(row['weight'])
+
+    empty = np.zeros(0, dtype=np.int64)
+    if not authors:
+        return Network('author_institution', False, nodes.nodes,
+                       nodes.attributes, empty, empty, np.zeros(0))
+    n = len(nodes.nodes)
+    pairs, inverse = np.unique(np.array(authors, dtype=np.int64) * n
+                               + np.array(institutions, dtype=np.int64),
+                               return_inverse=True)
+    weights = np.bincount(inverse, weights=np.array(confidence, dtype=float))
+    return Network('author_institution', False, nodes.nodes, nodes.attributes,
+                   pairs // n, pairs % n, weights)
+
+
+NETWORKS = OrderedDict([
+    ('direct_citation', direct_citation),
+    ('cocitation', cocitation),
+    ('bibliographic_coupling', bibliographic_coupling),
+    ('coauthorship', coauthorship),
+    ('author_institution', author_institution),
+])
+"""Maps kinds of network onto the functions that build them."""
+
+
+def get_network(corpus, kind, years=None):
+    """
+    The network of ``kind`` for ``corpus``\, from the response cache if it
+    was built since the corpus last changed.
+    """
+    cache = get_cache()
+    key = 'network:%s' % hashlib.md5(repr((corpus.id, corpus.version, kind,
+                                           years))).hexdigest()
+    network = cache.get(key) if cache is not None else None
+    if network is None:
+        network = NETWORKS[kind](corpus, years)
+        if cache is not None:
+            cache.set(key, network)
+    return network
+
+
+def edge_rows(network, start=0, stop=None):
+    """
+    Yields a ``dict`` with the ``source``\, ``target`` and ``weight`` of each
+    edge (from ``start`` to ``stop``\).
+    """
+    nodes = network.nodes
+    edges = slice(start, stop)
+    for source, target, weight in zip(network.sources[edges],
+                                      network.targets[edges],
+                                      network.weights[edges]):
+        yield {'source': nodes[source], 'target': nodes[target],
+               'weight': weight.item()}
+
+
+def to_graphml(network, chunk_size=CHUNK_SIZE):
+    """
+    Yields the GraphML document of ``network``\, with the nodes that have
+    edges.
+    """
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+           '<key id="type" for="node" attr.name="type" attr.type="string"/>\n'
+           '<key id="label" for="node" attr.name="label" attr.type="string"/>\n'
+           '<key id="year" for="node" attr.name="year" attr.type="int"/>\n'
+           '<key id="weight" for="edge" attr.name="weight" attr.type="double"/>\n'
+           '<graph id=%s edgedefault="%s">\n' % \
+           (quoteattr(network.kind),
+            'directed' if network.directed else 'undirected'))
+
+    def node(i):
+        values = network.attributes[i]
+        data = ['<data key="type">%s</data>' % values['type']]
+        if values['label']:
+            data.append('<data key="label">%s</data>' % escape(values['label']))
+        if values['year'] is not None:
+            data.append('<data key="year">%i</data>' % values['year'])
+        return '<node id=%s>%s</node>\n' % (quoteattr(network.nodes[i]),
+                                           ''.join(data))
+
+    connected = network.connected_nodes()
+    for start in xrange(0, len(connected), chunk_size):
+        yield ''.join([node(i) for i in connected[start:start + chunk_size]])\
+                .encode('utf-8')
+
+    def edge(row):
+        return '<edge source=%s target=%s><data key="weight">%s</data></edge>\n' % \
+               (quoteattr(row['source']), quoteattr(row['target']), row['weight'])
+
+    for start in xrange(0, len(network), chunk_size):
+        yield ''.join([edge(row) for row
+                       in edge_rows(network, start, start + chunk_size)])\
+                .encode('utf-8')
+    yield '</graph>\n</graphml>\n'
@@ -0,0 +1,106 @@
+"""
+Pagination for the REST list endpoints.
+"""
+
+from rest_framework.pagination import LimitOffsetPagination, _positive_int
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from collections import OrderedDict
+
+from tethneweb import counts
+
+
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATE = 'estimate'
+COUNT_NONE = 'none'
+COUNT_MODES = (COUNT_EXACT, COUNT_ESTIMATE, COUNT_NONE)
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination, with an opt-in keyset mode for walking large
+    listings.
+
+    Passing ``?after=<id>`` (``?after=0`` for the first page) returns the
+    ``limit`` objects with the next highest primary keys, in primary key
+    order. Every page is a single indexed range scan, however deep it is, and
+    no ``COUNT`` is made; the response has only ``next`` and ``results``\.
+    Filters apply as usual, and because primary keys never change, a walk is
+    stable while rows are being added.
+
+    In limit/offset mode, ``?count=estimate`` replaces the ``COUNT`` with the
+    planner's estimate (see :func:`tethneweb.counts.estimate`\), and
+    ``?count=none`` leaves it out (``count`` is ``null``\). Either way, the
+    ``next`` link is based on whether there is another row, not on the count.
+    """
+    after_query_param = 'after'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.after_query_param not in request.query_params:
+            self.keyset = False
+            self.count_mode = self.get_count_mode(request)
+            if self.count_mode == COUNT_EXACT:
+                return super(KeysetPagination, self).paginate_queryset(queryset, request, view)
+            return self.paginate_without_count(queryset, request)
+
+        self.keyset = True
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.after = self.get_after(request)
+        page = list(queryset.filter(pk__gt=self.after).order_by('pk')[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        self.last = page[-1].pk if page else None
+        return page
+
+    def paginate_without_count(self, queryset, request):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        if self.count_mode == COUNT_ESTIMATE:
+            self.count = counts.estimate(queryset)
+        else:
+            self.count = None
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(page) > self.limit
+        return page[:self.limit]
+
+    def get_count_mode(self, request):
+        mode = request.query_params.get(self.count_query_param, COUNT_EXACT)
+        if mode not in COUNT_MODES:
+            raise ValidationError({self.count_query_param:
+                                   'Must be one of %s.' % ', '.join(COUNT_MODES)})
+        return mode
+
+    def get_after(self, request):
+        try:
+            return _positive_int(request.query_params[self.after_query_param])
+        except ValueError:
+            raise ValidationError({self.after_query_param: 'Must be a primary key.'})
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            response = super(KeysetPagination, self).get_paginated_response(data)
+            if self.count_mode == COUNT_ESTIMATE:
+                response.data['count_is_estimate'] = True
+            return response
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.keyset and self.count_mode == COUNT_EXACT:
+            return super(KeysetPagination, self).get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        if not self.keyset:
+            return replace_query_param(url, self.offset_query_param,
+                                       self.offset + self.limit)
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.after_query_param, self.last)
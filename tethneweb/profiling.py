@@ -0,0 +1,234 @@
+"""
+Per-request profiling of the web application.
+
+When ``PROFILE_REQUESTS`` is set, :class:`ProfilingMiddleware` records the SQL
+queries of every request (with the same debug cursor that Django uses when
+``DEBUG`` is on), and the time spent serializing and rendering the response
+(see :func:`timer`\, used by the serializers and renderers in
+:mod:`tethneweb.utils`\). It adds them to the response as a ``Server-Timing``
+header, for example::
+
+    Server-Timing: db;dur=12.5;desc="14 queries", serialize;dur=30.1,
+                   render;dur=8.0, total;dur=61.2
+
+Queries that differ only in their parameters have the same "shape" (see
+:func:`query_shape`\). A shape that repeats at least
+``PROFILE_REPEATED_QUERIES`` times in one request is most likely a query made
+once per object of a list (an N+1 pattern); such requests get an
+``X-Repeated-Queries`` header and a warning in the log. Queries made while a
+streaming response (such as an export) is sent are not counted.
+
+A sample of requests (``PROFILE_SAMPLE_RATE``\) is also aggregated per view,
+and served to staff users by :class:`tethneweb.views.ProfileStatsView`\. As
+with the local memory response cache, the aggregates are kept in memory, and
+so are for the current process only.
+"""
+
+from django.conf import settings
+from django.db import connection
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import logging
+import random
+import re
+import threading
+import time
+
+from tethneweb.instrumentation import Timer
+
+
+logger = logging.getLogger(__name__)
+
+REPEATED_QUERIES = getattr(settings, 'PROFILE_REPEATED_QUERIES', 5)
+SAMPLE_RATE = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.1)
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+
+
+def query_shape(sql):
+    """
+    ``sql`` with literal values (and lists of them) replaced by ``?``\.
+    """
+    shape = STRING.sub('?', sql)
+    shape = NUMBER.sub('?', shape)
+    return VALUE_LIST.sub('(?)', shape)
+
+
+class RequestProfile(Timer):
+    """
+    Timings of one request. Timers with the same name may be nested (a
+    serializer within a serializer); only the outermost one is counted.
+    """
+
+    def __init__(self):
+        super(RequestProfile, self).__init__()
+        self.started = time.time()
+        self.depth = Counter()
+        self.queries = []
+
+    @contextmanager
+    def stage(self, name):
+        self.depth[name] += 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.depth[name] -= 1
+            if not self.depth[name]:
+                self.add(name, time.time() - start)
+
+    def repeated_queries(self):
+        """
+        Shapes of queries made at least ``PROFILE_REPEATED_QUERIES`` times,
+        with their counts.
+        """
+        shapes = Counter([query_shape(query['sql']) for query in self.queries])
+        return [(shape, count) for shape, count in shapes.most_common()
+                if count >= REPEATED_QUERIES]
+
+    def summary(self):
+        return {
+            'total': time.time() - self.started,
+            'db': sum([float(query['time']) for query in self.queries]),
+            'queries': len(self.queries),
+            'serialize': self.seconds['serialize'],
+            'render': self.seconds['render'],
+            'browsable_context': self.seconds['browsable_context'],
+        }
+
+
+def get_profile(request):
+    # Also works for a DRF Request, which passes attributes through to the
+    # HttpRequest that it wraps.
+    return getattr(request, '_profile', None)
+
+
+@contextmanager
+def timer(request, name):
+    """
+    Times the body of the ``with`` block as stage ``name`` of the profile of
+    ``request``\, if it is being profiled.
+    """
+    profile = get_profile(request)
+    if profile is None:
+        yield
+    else:
+        with profile.stage(name):
+            yield
+
+
+class ViewStats(object):
+    """
+    Aggregated profiles of the sampled requests to each view.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.views = defaultdict(lambda: {
+                'requests': 0,
+                'repeated_queries': 0,
+                'max_total': 0.,
+                'seconds': Counter(),
+                'queries': 0,
+                'shapes': Counter(),
+            })
+
+    def add(self, view, summary, repeated):
+        with self.lock:
+            stats = self.views[view]
+            stats['requests'] += 1
+            stats['queries'] += summary['queries']
+            stats['max_total'] = max(stats['max_total'], summary['total'])
+            for name in ('total', 'db', 'serialize', 'render', 'browsable_context'):
+                stats['seconds'][name] += summary[name]
+            if repeated:
+                stats['repeated_queries'] += 1
+                for shape, count in repeated:
+                    stats['shapes'][shape] += count
+
+    def as_dict(self):
+        """
+        Mean timings (in milliseconds) and queries per request for each view,
+        slowest first, with the shapes most often repeated.
+        """
+        with self.lock:
+            views = []
+            for view, stats in self.views.iteritems():
+                n = stats['requests']
+                entry = {'view': view, 'requests': n,
+                         'mean_queries': float(stats['queries']) / n,
+                         'max_total_ms': 1000. * stats['max_total'],
+                         'requests_with_repeated_queries': stats['repeated_queries'],
+                         'repeated_queries': [{'shape': shape, 'count': count}
+                                              for shape, count
+                                              in stats['shapes'].most_common(5)]}
+                for name, seconds in stats['seconds'].iteritems():
+                    entry['mean_%s_ms' % name] = 1000. * seconds / n
+                views.append(entry)
+        views.sort(key=lambda entry: -entry['mean_total_ms'])
+        return {'sample_rate': SAMPLE_RATE, 'views': views}
+
+
+view_stats = ViewStats()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    name = (match.view_name or match._func_path) if match else request.path
+    return '%s %s' % (request.method, name)
+
+
+def server_timing(summary):
+    return ', '.join([
+        'db;dur=%.1f;desc="%i queries"' % (1000. * summary['db'], summary['queries']),
+        'serialize;dur=%.1f' % (1000. * summary['serialize']),
+        'render;dur=%.1f' % (1000. * summary['render']),
+        'total;dur=%.1f' % (1000. * summary['total']),
+    ])
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles each request (see the module documentation). Install it first
+    in ``MIDDLEWARE_CLASSES``\, so that the time of the other middleware is
+    included.
+    """
+
+    def process_request(self, request):
+        request._profile = RequestProfile()
+        request._profile_state = (connection.force_debug_cursor,
+                                  len(connection.queries_log))
+        connection.force_debug_cursor = True
+
+    def process_response(self, request, response):
+        profile = get_profile(request)
+        if profile is None:     # An earlier middleware answered the request.
+            return response
+        force_debug_cursor, start = request._profile_state
+        connection.force_debug_cursor = force_debug_cursor
+        # queries_log is bounded; if it overflowed, the oldest queries of this
+        # request are lost, and the counts are a lower bound.
+        profile.queries = list(connection.queries_log)[start:]
+        if not force_debug_cursor and not settings.DEBUG:
+            connection.queries_log.clear()
+
+        summary = profile.summary()
+        repeated = profile.repeated_queries()
+        response['Server-Timing'] = server_timing(summary)
+        if repeated:
+            response['X-Repeated-Queries'] = str(sum([count for shape, count
+                                                       in repeated]))
+            logger.warning('%s %s: repeated queries: %s', request.method,
+                           request.get_full_path(),
+                           '; '.join(['%ix %s' % (count, shape)
+                                      for shape, count in repeated]))
+        if random.random() < SAMPLE_RATE:
+            view_stats.add(view_name(request), summary, repeated)
+        return response
@@ -0,0 +1,73 @@
+"""
+Indexed search over papers and authors.
+
+Titles, abstracts, journal and author names are matched as substrings
+(case-insensitively), on trigram (``pg_trgm``\) GIN indexes, and ranked by
+trigram similarity (see :func:`substring`\). Titles and abstracts together
+can also be searched as full text, on a GIN index of their combined
+``tsvector``\, and ranked with ``ts_rank`` (see :func:`full_text`\). Ranks
+are computed for every match, and there are no stored vectors or trigrams, so
+a search that matches much of a corpus costs more than the index scan. The
+indexes are created by migrations ``0010_search``\, ``0013_search_trigrams``
+and ``0015_search_document``\; the expressions here must stay the same as the
+indexed ones, or the indexes won't be used.
+"""
+
+
+SEARCH_CONFIG = 'english'
+"""The text search configuration used for full-text indexes and queries."""
+
+RANK = 'search_rank'
+
+
+def tsvector(table, column):
+    return "to_tsvector('%s', coalesce(\"%s\".\"%s\", ''))" % \
+           (SEARCH_CONFIG, table, column)
+
+
+def tsquery():
+    return "plainto_tsquery('%s', %%s)" % SEARCH_CONFIG
+
+
+def _ranked(queryset, where, params, rank, rank_params):
+    return queryset.extra(where=[where], params=params,
+                          select={RANK: rank}, select_params=rank_params,
+                          order_by=['-' + RANK, 'pk'])
+
+
+def document(table, columns):
+    """
+    The ``tsvector`` of ``columns`` together, so that the words of a query
+    may be found in different columns.
+    """
+    return ' || '.join([tsvector(table, column) for column in columns])
+
+
+def full_text(queryset, columns, value):
+    """
+    Filter ``queryset`` to rows in which ``columns``\, together, contain the
+    words in ``value``\, best matches first.
+    """
+    if not value:
+        return queryset
+    vector = document(queryset.model._meta.db_table, columns)
+    return _ranked(queryset, '(%s) @@ %s' % (vector, tsquery()), [value],
+                   'ts_rank(%s, %s)' % (vector, tsquery()), [value])
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def substring(queryset, column, value):
+    """
+    Filter ``queryset`` to rows in which ``column`` contains ``value``
+    (ignoring case), most similar first.
+    """
+    if not value:
+        return queryset
+    table = queryset.model._meta.db_table
+    qualified = '"%s"."%s"' % (table, column)
+    return _ranked(queryset, '%s ILIKE %%s' % qualified,
+                   ['%' + escape_like(value) + '%'],
+                   'similarity(%s, %%s)' % qualified, [value])
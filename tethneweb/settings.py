@@ -31,6 +31,14 @@ MIDDLEWARE_CLASSES = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Query counts and timings of each request, as Server-Timing headers, and
+# sampled per-view aggregates (see tethneweb.profiling).
+PROFILE_REQUESTS = eval(os.environ.get('PROFILE_REQUESTS', 'False'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.1))
+PROFILE_REPEATED_QUERIES = int(os.environ.get('PROFILE_REPEATED_QUERIES', 5))
+if PROFILE_REQUESTS:
+    MIDDLEWARE_CLASSES.insert(0, 'tethneweb.profiling.ProfilingMiddleware')
+
 ROOT_URLCONF = 'tethneweb.urls'
 
 TEMPLATES = [
@@ -50,11 +58,37 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'tethneweb.wsgi.application'
+# PostgreSQL only. Search needs the pg_trgm extension, which on PostgreSQL
+# < 13 a superuser must install before migrating (see the README).
 DATABASES = {
     'default': dj_database_url.config()
 }
 DATABASES['default']['ENGINE'] = 'django.db.backends.postgresql_psycopg2'
 
+# Bulk uploads (see tethneweb.upload): the largest decompressed body, the
+# longest NDJSON line, and the largest JSON array body (which is buffered), in
+# bytes.
+BULK_UPLOAD_MAX_BYTES = int(os.environ.get('BULK_UPLOAD_MAX_BYTES', 2 ** 30))
+BULK_UPLOAD_MAX_LINE_BYTES = int(os.environ.get('BULK_UPLOAD_MAX_LINE_BYTES', 2 ** 23))
+BULK_UPLOAD_MAX_ARRAY_BYTES = int(os.environ.get('BULK_UPLOAD_MAX_ARRAY_BYTES', 2 ** 25))
+
+# List responses are cached (see tethneweb.caching) in local memory, or in
+# files shared by all processes if RESPONSE_CACHE_DIR is set.
+RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'
+                   if RESPONSE_CACHE_DIR else
+                   'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': RESPONSE_CACHE_DIR or 'tethneweb-responses',
+        'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 600)),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -96,10 +130,10 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'tethneweb.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'tethneweb.utils.ProfiledJSONRenderer',
         'tethneweb.utils.BrowsableAPIRendererWithoutForms',
     ),
 }
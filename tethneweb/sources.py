@@ -0,0 +1,344 @@
+"""
+Adapters that read data files from each :attr:`.Corpus.SOURCE_CHOICES` into
+tethne papers, for the ingest pipeline in :mod:`tethneweb.ingest`\.
+
+An adapter knows how to find its data files under a path, how to parse one
+file into :class:`tethne.Paper`\s (in a stable order, so that offsets can be
+used to resume), and which fields identify a record for deduplication.
+Everything downstream of parsing is shared by all sources.
+
+Records are yielded one by one as they are parsed, so that only the record
+being parsed is held, however large the file. Records that tethne fails to
+parse are marked with ``_ingest_error`` rather than aborting the whole file,
+so that they can be quarantined.
+"""
+
+from tethneweb.models import Corpus
+
+import os
+import re
+import csv
+import glob
+
+from tethne import Paper
+from tethne.readers import wos, dfr, zotero
+
+
+def describe_error(E):
+    return '%s: %s' % (type(E).__name__, E)
+
+
+class TolerantParserMixin(object):
+    """
+    Marks records that a tethne parser fails to handle (with
+    ``_ingest_error``\), rather than aborting the whole file.
+
+    :meth:`.iterparse` replaces tethne's ``parse()``\, which returns a list
+    of every record in the file: each parser's ``steps()`` runs the main loop
+    of its ``parse()``\, and records are yielded as soon as the next one is
+    started.
+    """
+
+    def iterparse(self):
+        """
+        Yields the records of the file, in order.
+        """
+        for _ in self.steps():
+            while len(self.data) > 1:
+                yield self.data.pop(0)
+        for entry in self.data:
+            # tethne drops the empty entry that the last one leaves behind.
+            if entry.__dict__:
+                yield entry
+        self.data = []
+
+    def steps(self):
+        raise NotImplementedError('Subclasses must implement steps()')
+
+    def handle(self, tag, data):
+        try:
+            super(TolerantParserMixin, self).handle(tag, data)
+        except Exception as E:
+            self._mark_failed(E)
+
+    def postprocess_entry(self):
+        try:
+            super(TolerantParserMixin, self).postprocess_entry()
+        except Exception as E:
+            self._mark_failed(E)
+
+    def _mark_failed(self, E):
+        if not self.data:
+            raise
+        if not hasattr(self.data[-1], '_ingest_error'):
+            self.data[-1]._ingest_error = describe_error(E)
+
+
+class TolerantWoSParser(TolerantParserMixin, wos.WoSParser):
+    def steps(self):
+        """As in :meth:`tethne.readers.base.IterParser.parse`\."""
+        while True:
+            tag, data = self.next()
+            if self.is_eof(tag):
+                self.postprocess_entry()
+                break
+            self.handle(tag, data)
+            self.last_tag = tag
+            yield
+
+
+class TolerantDfRParser(TolerantParserMixin, dfr.DfRParser):
+    def steps(self):
+        """As in :meth:`tethne.readers.base.XMLParser.parse`\."""
+        for event, element in self.iterator:
+            self.next(element)
+            if element.tag == self.entry_element:
+                element.clear()
+            yield
+
+
+class TolerantZoteroParser(TolerantParserMixin, zotero.ZoteroParser):
+    def steps(self):
+        """As in :meth:`tethne.readers.base.RDFParser.parse`\."""
+        meta_fields, meta_refs = zip(*self.meta_elements)
+        while True:
+            entry = self.next()
+            if entry is None:
+                break
+            self.new_entry()
+            for s, p, o in self.graph.triples((entry, None, None)):
+                if p in meta_refs:
+                    self.handle(meta_fields[meta_refs.index(p)], o)
+            self.postprocess_entry()
+            yield
+
+
+class Source(object):
+    """
+    Base class for source adapters.
+    """
+    name = None
+    corpus_source = None
+    """One of the :attr:`.Corpus.SOURCE_CHOICES`\."""
+
+    extensions = ()
+    """Data files are found by extension (lower case) in directories."""
+
+    checksum_fields = ['doi', 'title', 'date', 'journal', 'volume', 'issue',
+                       'pageStart', 'authors_full']
+    """
+    Fields that identify a record; values that can change between exports
+    (e.g. citation counts) are left out of the checksum.
+    """
+
+    def find_files(self, path):
+        """
+        Resolve ``path`` (a file, a directory, or a glob pattern) to a sorted
+        list of data files.
+        """
+        if os.path.isdir(path):
+            paths = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                paths += [os.path.join(dirpath, filename)
+                          for filename in filenames
+                          if self.is_data_file(filename)]
+        elif os.path.exists(path):
+            paths = [path]
+        else:
+            paths = glob.glob(path)
+        return sorted(paths)
+
+    def is_data_file(self, filename):
+        return filename.lower().endswith(self.extensions) \
+            and not filename.startswith('.')
+
+    def read(self, path):
+        """
+        Parse a single data file, yielding its records in order. The file is
+        opened (and errors opening it are raised) before anything is yielded.
+        """
+        raise NotImplementedError('Subclasses must implement read()')
+
+
+class WoSSource(Source):
+    """
+    Web of Science field-tagged files.
+    """
+    name = 'wos'
+    corpus_source = Corpus.WOS
+    extensions = ('txt',)
+    checksum_fields = ['wosid'] + Source.checksum_fields
+
+    def read(self, path):
+        return TolerantWoSParser(path).iterparse()
+
+
+class JSTORSource(Source):
+    """
+    JSTOR Data for Research datasets. Each dataset is a directory with a
+    ``citations.xml`` file; that file is the data file for the dataset.
+    N-grams are not loaded.
+    """
+    name = 'jstor'
+    corpus_source = Corpus.JSTOR
+
+    def is_data_file(self, filename):
+        return filename.lower() == 'citations.xml'
+
+    def find_files(self, path):
+        if os.path.isdir(path) and dfr._get_citation_filename(path):
+            return [os.path.join(path, dfr._get_citation_filename(path))]
+        return super(JSTORSource, self).find_files(path)
+
+    def read(self, path):
+        return TolerantDfRParser(path).iterparse()
+
+
+class ZoteroSource(Source):
+    """
+    Zotero RDF exports. Attached full-text is not loaded.
+    """
+    name = 'zotero'
+    corpus_source = Corpus.ZOTERO
+    extensions = ('rdf',)
+    checksum_fields = ['uri'] + Source.checksum_fields
+
+    def read(self, path):
+        return TolerantZoteroParser(path).iterparse()
+
+
+class ScopusSource(Source):
+    """
+    Scopus CSV exports.
+
+    tethne dropped its Scopus reader in 0.8 (in 0.8.1.dev5, the version
+    pinned in ``requirements.txt``\, ``tethne.readers.scopus`` is only a
+    docstring), so records are read here into tethne papers, with the same
+    fields as the other readers. Cited references are not parsed.
+
+    Authors are written either as ``Smith J.`` (separated by commas in older
+    exports) or as ``Smith, J.`` (separated by semicolons).
+    """
+    name = 'scopus'
+    corpus_source = Corpus.SCOPUS
+    extensions = ('csv',)
+    checksum_fields = ['eid'] + Source.checksum_fields
+
+    columns = {
+        'Title': 'title',
+        'Source title': 'journal',
+        'Volume': 'volume',
+        'Issue': 'issue',
+        'Page start': 'pageStart',
+        'Page end': 'pageEnd',
+        'DOI': 'doi',
+        'Abstract': 'abstract',
+        'ISSN': 'issn',
+        'ISBN': 'isbn',
+        'EID': 'eid',
+        'Link': 'uri',
+        'Author Keywords': 'authorKeywords',
+        'Document Type': 'documentType',
+        'Cited by': 'timesCited',
+    }
+
+    def read(self, path):
+        return self._read(open(path, 'rb'))
+
+    def _read(self, f):
+        with f:
+            # Exports start with a byte order mark.
+            if f.read(3) != '\xef\xbb\xbf':
+                f.seek(0)
+            for row in csv.DictReader(f):
+                paper = Paper()
+                try:
+                    self._handle_row(paper, row)
+                except Exception as E:
+                    paper._ingest_error = describe_error(E)
+                yield paper
+
+    def _handle_row(self, paper, row):
+        row = {key.strip(): value.decode('utf-8').strip()
+               for key, value in row.iteritems() if key and value}
+        for column, field in self.columns.iteritems():
+            if row.get(column):
+                setattr(paper, field, row[column])
+        if row.get('Year'):
+            paper.date = int(row['Year'])
+
+        authors = self._split_authors(row.get('Authors', ''))
+        if authors:
+            paper.authors_full = [self._handle_author(name) for name in authors]
+        addresses = self._handle_addresses(row.get('Authors with affiliations', ''))
+        if addresses:
+            paper.addresses = addresses
+
+    def _split_authors(self, value):
+        # Older exports separate authors with commas, e.g. "Smith J., Doe A.B."
+        if ';' in value:
+            return [name.strip() for name in value.split(';') if name.strip()]
+        return [name.strip() for name in re.split(r'(?<=\.),\s+', value)
+                if name.strip()]
+
+    def _handle_author(self, name):
+        if ',' in name:
+            parts = name.split(',', 1)
+        else:
+            parts = name.rsplit(' ', 1)
+        last = parts[0].strip().upper()
+        first = parts[1].replace('.', ' ').strip().upper() if len(parts) > 1 else u''
+        return last, ' '.join(first.split())
+
+    initials = re.compile(r'^(?:[^\W\d_]{1,2}\.\s*-?\s*)+$', re.UNICODE)
+    """The initials of ``Smith, J.-P.``\, after the comma."""
+
+    organization = re.compile(r'univ|inst|coll|acad|ctr|cent(?:er|re)|lab|'
+                              r'hosp|agency|council|museum|foundation|'
+                              r'company|corp|inc\b|ltd|gmbh',
+                              re.IGNORECASE)
+    """Words that (usually) name an organization, rather than a department."""
+
+    def _handle_addresses(self, value):
+        """
+        Parses ``Authors with affiliations`` into the ``addresses`` structure
+        used by the WoS reader, keyed on author name tuples.
+
+        Each entry is an author and a comma-separated address, which goes
+        from the department up to the institution, and ends with a city and
+        country. The institution is the last part that names an organization
+        (see :attr:`organization`\), or else the first part.
+        """
+        addresses = {}
+        for entry in value.split(';'):
+            parts = [part.strip() for part in entry.split(',') if part.strip()]
+            if len(parts) > 1 and self.initials.match(parts[1]):
+                parts = ['%s, %s' % tuple(parts[:2])] + parts[2:]
+            if len(parts) < 2:
+                continue
+            author = self._handle_author(parts[0])
+            address = parts[1:]
+            named = [part for part in address[:-1] if self.organization.search(part)]
+            institution = named[-1] if named else address[0]
+            addresses.setdefault(author, []).append((institution.upper(),
+                                                     address[-1].upper(),
+                                                     address))
+        return addresses
+
+
+SOURCES = {
+    WoSSource.name: WoSSource,
+    JSTORSource.name: JSTORSource,
+    ZoteroSource.name: ZoteroSource,
+    ScopusSource.name: ScopusSource,
+}
+
+
+def for_corpus(corpus):
+    """
+    The adapter for the :attr:`.Corpus.source` of ``corpus``\.
+    """
+    for source in SOURCES.values():
+        if source.corpus_source == corpus.source:
+            return source()
+    raise ValueError('No adapter for source %s' % corpus.source)
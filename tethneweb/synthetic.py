@@ -0,0 +1,231 @@
+"""
+Synthetic Web of Science data, for benchmarks.
+
+:class:`SyntheticWoS` writes field-tagged records in the format that
+:class:`tethne.readers.wos.WoSParser` reads, at any scale. Everything is
+derived from a seeded random number generator, so the same parameters always
+produce the same files, and records are written as they are generated, so
+memory use doesn't grow with the number of papers.
+
+The shape of the data follows real WoS exports:
+
+* The number of authors per paper is geometric (most papers have a few
+  authors; a few have dozens).
+* The number of cited references per paper is log-normal (a median of about
+  25).
+* Authors, institutions and cited references are drawn from pools with a
+  power-law skew, so that a few prolific authors, large institutions and
+  highly-cited works account for much of the data, as they do in practice.
+  The pools grow with the number of papers.
+* Most records have explicit author-address mappings (``C1 [Names]
+  Address``\), and most cited references have DOIs.
+"""
+
+import os
+import math
+import random
+
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ber', 'dan',
+             'gar', 'hol', 'kin', 'mar', 'nor', 'pet', 'ros', 'son', 'tur',
+             'wel', 'an', 'el', 'in', 'or', 'us']
+
+WORDS = ['analysis', 'assessment', 'biomarker', 'coastal', 'community',
+         'dynamics', 'ecosystem', 'effects', 'environmental', 'evidence',
+         'experimental', 'gene', 'growth', 'habitat', 'health', 'impact',
+         'marine', 'model', 'network', 'pollution', 'population', 'protein',
+         'recovery', 'regulation', 'response', 'sediment', 'signal',
+         'species', 'stress', 'structure', 'system', 'temperature', 'tissue',
+         'toxicity', 'variation', 'water']
+
+JOURNALS = ['ECOTOXICOLOGY', 'MARINE POLLUTION BULLETIN', 'NUCLEIC ACIDS RES',
+            'J BIOL CHEM', 'PLOS ONE', 'SCIENCE', 'NATURE', 'ECOLOGY',
+            'P NATL ACAD SCI USA', 'ENVIRON SCI TECHNOL', 'RNA', 'CELL',
+            'AQUAT TOXICOL', 'J EXP BIOL', 'MOL ECOL', 'GENETICS']
+
+COUNTRIES = ['USA', 'Spain', 'Germany', 'Peoples R China', 'England',
+             'France', 'Japan', 'Canada', 'Italy', 'Australia', 'Brazil',
+             'India', 'Netherlands', 'Sweden']
+
+UNITS = ['Univ', 'Inst', 'Ctr', 'Coll', 'Lab']
+
+DEPARTMENTS = ['Dept Biol', 'Dept Chem', 'Sch Med', 'Dept Marine Sci',
+               'Dept Ecol', 'Dept Mol Biol', 'Fac Sci']
+
+
+class SyntheticWoS(object):
+    """
+    Generates WoS field-tagged records.
+
+    Parameters
+    ----------
+    papers : int
+        Number of records.
+    seed : int
+    mean_authors : float
+        Mean number of authors per paper.
+    median_references : float
+        Median number of cited references per paper.
+    skew : float
+        Exponent of the power law with which authors, institutions and
+        references are drawn from their pools; 1 is uniform, higher is more
+        skewed.
+    """
+
+    def __init__(self, papers, seed=0, mean_authors=4.5, median_references=25,
+                 skew=3.0):
+        self.papers = papers
+        self.seed = seed
+        self.mean_authors = mean_authors
+        self.median_references = median_references
+        self.skew = skew
+        self.author_pool = max(100, int(papers * 0.6))
+        self.institution_pool = max(20, papers / 20)
+        self.reference_pool = max(1000, papers * 3)
+        self.random = random.Random(seed)
+
+    def _draw(self, pool):
+        return int(pool * self.random.random() ** self.skew)
+
+    def _word(self, n, syllables=3):
+        # A pronounceable word that is always the same for the same n.
+        parts = []
+        for i in range(syllables):
+            n, r = divmod(n, len(SYLLABLES))
+            parts.append(SYLLABLES[r])
+        return ''.join(parts)
+
+    def author(self, n):
+        """
+        Returns ``(surname, forename)`` of author ``n`` of the pool.
+        """
+        surname = self._word(n).capitalize()
+        forename = self._word(n / 7 + 11, 2).capitalize()
+        if n % 3 == 0:
+            forename += ' %s.' % chr(ord('A') + n % 26)
+        return surname, forename
+
+    def institution(self, n):
+        country = COUNTRIES[n % len(COUNTRIES)]
+        city = self._word(n + 101, 2).capitalize()
+        address = '%s %s, %s, %s' % (UNITS[n % len(UNITS)],
+                                     self._word(n + 7, 2).capitalize(),
+                                     DEPARTMENTS[n % len(DEPARTMENTS)], city)
+        if country == 'USA':
+            return '%s, %s %05i USA.' % (address, 'CA', n % 100000)
+        return '%s %i, %s.' % (address, n % 10000, country)
+
+    def reference(self, n):
+        surname, forename = self.author(n % self.author_pool)
+        year = 1950 + n % 67
+        text = '%s %s, %i, %s, V%i, P%i' % \
+               (surname.upper(), initials(forename), year,
+                JOURNALS[n % len(JOURNALS)], 1 + n % 300, 1 + n % 2000)
+        if n % 10 < 7:
+            text += ', DOI 10.5555/ref.%i' % n
+        return text
+
+    def _sentence(self, words):
+        return ' '.join([WORDS[self.random.randrange(len(WORDS))]
+                         for i in range(words)])
+
+    def record(self, index):
+        """
+        Returns the text of record ``index``\.
+        """
+        r = self.random
+        n_authors = 1 + min(49, int(math.log(1 - r.random()) /
+                                    math.log(1 - 1. / self.mean_authors)))
+        authors = []
+        seen = set()
+        while len(authors) < n_authors:
+            n = self._draw(self.author_pool)
+            if n not in seen:
+                seen.add(n)
+                authors.append(self.author(n))
+        n_references = min(500, int(r.lognormvariate(
+            math.log(self.median_references), 0.8)))
+        references = set([self._draw(self.reference_pool)
+                          for i in range(n_references)])
+        year = 1980 + r.randrange(38)
+
+        lines = ['PT J']
+        lines += tagged('AU', ['%s, %s' % (surname, initials(forename))
+                               for surname, forename in authors])
+        lines += tagged('AF', ['%s, %s' % author for author in authors])
+        lines.append('TI %s' % \
+                     self._sentence(8 + r.randrange(10)).capitalize())
+        journal = JOURNALS[r.randrange(len(JOURNALS))]
+        lines.append('SO %s' % journal)
+        lines.append('LA English')
+        lines.append('DT Article')
+        lines.append('DE %s' % \
+                     '; '.join([self._sentence(2) for i in range(4)]))
+        lines.append('AB %s.' % \
+                     self._sentence(120 + r.randrange(130)).capitalize())
+
+        # Most records map authors onto addresses explicitly.
+        groups = []
+        remaining = list(authors)
+        while remaining:
+            size = 1 + r.randrange(len(remaining))
+            groups.append(remaining[:size])
+            remaining = remaining[size:]
+        addresses = []
+        for group in groups:
+            institution = self.institution(self._draw(self.institution_pool))
+            if r.random() < 0.85:
+                names = '; '.join(['%s, %s' % author for author in group])
+                addresses.append('[%s] %s' % (names, institution))
+            else:
+                addresses.append(institution)
+        lines += tagged('C1', addresses)
+        lines += tagged('CR', [self.reference(n) for n in sorted(references)])
+        lines.append('NR %i' % len(references))
+        lines.append('J9 %s' % journal)
+        lines.append('PY %i' % year)
+        lines.append('VL %i' % (1 + r.randrange(300)))
+        lines.append('IS %i' % (1 + r.randrange(12)))
+        start = 1 + r.randrange(2000)
+        lines.append('BP %i' % start)
+        lines.append('EP %i' % (start + r.randrange(30)))
+        lines.append('DI 10.5555/syn.%i.%i' % (self.seed, index))
+        lines.append('UT WOS:%015i' % (self.seed * 10 ** 10 + index))
+        lines.append('ER')
+        return '\n'.join(lines) + '\n\n'
+
+    def write(self, directory, files=1):
+        """
+        Write the records to ``files`` files in ``directory``\.
+
+        Returns
+        -------
+        list
+            Paths of the files written.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        per_file = max(1, int(math.ceil(float(self.papers) / max(files, 1))))
+        paths = []
+        for start in xrange(0, self.papers, per_file):
+            path = os.path.join(directory, 'synthetic-%05i.txt' % len(paths))
+            with open(path, 'w') as f:
+                f.write('FN Thomson Reuters Web of Science\nVR 1.0\n')
+                for index in xrange(start, min(start + per_file, self.papers)):
+                    f.write(self.record(index))
+                f.write('EF\n')
+            paths.append(path)
+        return paths
+
+
+def initials(forename):
+    return ''.join([part[0] for part in forename.split()])
+
+
+def tagged(tag, values):
+    """
+    Lines for a multi-valued field: the tag on the first, and continuation
+    lines indented by three spaces.
+    """
+    return ['%s %s' % (tag if i == 0 else '  ', value)
+            for i, value in enumerate(values)]
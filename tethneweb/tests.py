@@ -0,0 +1,980 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from unittest import skipUnless
+import os
+import json
+import shutil
+import tempfile
+import types
+import zlib
+
+from tethneweb.models import AffiliationInstance, AuthorInstance, Corpus, \
+                              InstanceCitation, PaperInstance
+from tethneweb import caching, counts, metadata, networks, profiling
+from tethneweb.synthetic import SyntheticWoS
+
+
+TEST_DATA = os.path.join(settings.BASE_DIR, 'test_data')
+
+NO_CACHE = dict(settings.CACHES, responses={
+    'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+})
+
+
+class LoadedCorpusTestCase(APITestCase):
+    """
+    Loads ``test_data/wos.txt`` into a corpus owned by the (only) user.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(id=1, username='tethne')
+        with open(os.devnull, 'w') as devnull:
+            call_command('load_wos', os.path.join(TEST_DATA, 'wos.txt'),
+                         'test', '50', stdout=devnull)
+        cls.corpus = Corpus.objects.get()
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+
+    def get(self, path, **params):
+        params.setdefault('format', 'json')
+        return self.client.get(path, params, secure=True)
+
+
+# The addresses of "Evaluation of organic contamination..." in wos.txt, with
+# the authors that they belong to.
+ATTRIBUTED_ADDRESSES = """C1 [Han, D. M.; Tong, X. X.] Chinese Acad Sci, Key Lab Water Cycle & Related Land Surface Proc, Inst Geog Sci & Nat Resources Res, Beijing 100101, Peoples R China.
+   [Jin, M. G.] China Univ Geosci, Sch Water Resources & Environm, Beijing 100083, Peoples R China.
+   [Jin, M. G.] China Univ Geosci, Sch Environm Studies, Wuhan 430074, Peoples R China.
+   [Hepburn, Emily] Univ Melbourne, Sch Earth Sci, Parkville, Vic 3010, Australia."""
+
+
+class AuthorAddressTest(LoadedCorpusTestCase):
+    """
+    Authors are affiliated with the addresses that name them, or, if none
+    do, with every address of the paper.
+    """
+    title = 'Evaluation Of Organic Contamination'
+    """As tethne loads it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super(AuthorAddressTest, cls).setUpTestData()
+        with open(os.path.join(TEST_DATA, 'wos.txt')) as f:
+            text = f.read()
+        header = text[:text.index('PT J')]
+        record = [record for record in text.split('\n\n')
+                  if '\nTI %s' % cls.title.lower().capitalize() in record][0]
+        record = record[:record.index('\nC1 ') + 1] + ATTRIBUTED_ADDRESSES \
+                 + record[record.index('\nRP '):]
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'attributed.txt')
+            with open(path, 'w') as f:
+                f.write(header + record + '\n\nEF\n')
+            with open(os.devnull, 'w') as devnull:
+                call_command('load_wos', path, 'attributed', '50', stdout=devnull)
+        finally:
+            shutil.rmtree(directory)
+        cls.attributed = Corpus.objects.get(label='attributed')
+
+    def confidences(self, corpus):
+        """
+        The confidence of each affiliation of each author of the paper, by
+        name.
+        """
+        paper = PaperInstance.objects.get(corpus=corpus, concrete=True,
+                                          title__startswith=self.title)
+        found = {}
+        for affiliation in AffiliationInstance.objects.filter(paper=paper)\
+                                                      .select_related('author'):
+            author = affiliation.author
+            found.setdefault('%s, %s' % (author.last_name, author.first_name), [])\
+                 .append(affiliation.confidence)
+        return {name: sorted(values) for name, values in found.items()}
+
+    def test_unattributed_addresses(self):
+        # wos.txt doesn't say whose addresses they are.
+        self.assertEqual(self.confidences(self.corpus), {
+            name: [0.25] * 4 for name in ['HAN, D M', 'TONG, X X', 'JIN, M G',
+                                          'HEPBURN, EMILY', 'TONG, C S',
+                                          'SONG, X F']
+        })
+
+    def test_attributed_addresses(self):
+        # Before addresses were looked up by name, none of these matched.
+        self.assertEqual(self.confidences(self.attributed), {
+            'HAN, D M': [1.0],
+            'TONG, X X': [1.0],
+            'JIN, M G': [0.5, 0.5],
+            'HEPBURN, EMILY': [1.0],
+        })
+
+
+class ScopusSourceTest(TestCase):
+    """
+    scopus.csv has a record in each of the author formats Scopus has exported
+    (``Surname I.,`` and ``Surname, I.;``\).
+    """
+    @classmethod
+    def setUpClass(cls):
+        super(ScopusSourceTest, cls).setUpClass()
+        from tethneweb.sources import SOURCES
+        path = os.path.join(TEST_DATA, 'scopus.csv')
+        cls.papers = list(SOURCES['scopus']().read(path))
+
+    def affiliations(self, paper):
+        return {author: [(institution, country)
+                         for institution, country, _ in addresses]
+                for author, addresses in paper.addresses.items()}
+
+    def test_comma_separated_authors(self):
+        paper = self.papers[0]
+        self.assertEqual(paper.authors_full[0], (u'MARIG\xd3MEZ', u'I'))
+        self.assertEqual(paper.authors_full[-1], (u'CAJARAVILLE', u'M P'))
+        self.assertEqual(len(paper.authors_full), 6)
+
+    def test_semicolon_separated_authors(self):
+        paper = self.papers[1]
+        self.assertEqual(paper.authors_full, [
+            (u'HAN', u'D M'), (u'TONG', u'X X'), (u'JIN', u'M G'),
+            (u'HEPBURN', u'E'), (u'TONG', u'C S'), (u'SONG', u'X F'),
+        ])
+
+    def test_institution_after_department(self):
+        # A research centre of the university, and a station with no
+        # organization in its name.
+        affiliations = self.affiliations(self.papers[0])
+        self.assertEqual(affiliations[(u'GARMENDIA', u'L')], [
+            (u'UNIVERSITY OF THE BASQUE COUNTRY UPV/EHU', u'SPAIN'),
+        ])
+        self.assertEqual(affiliations[(u'IZAGIRRE', u'U')], [
+            (u'PLENTZIA MARINE STATION', u'SPAIN'),
+        ])
+
+    def test_institution_is_not_positional(self):
+        # The lab, the institute and the academy are all organizations.
+        self.assertEqual(self.affiliations(self.papers[1]), {
+            (u'HAN', u'D M'): [(u'CHINESE ACADEMY OF SCIENCES', u'CHINA')],
+            (u'TONG', u'X X'): [(u'CHINA UNIVERSITY OF GEOSCIENCES', u'CHINA')],
+            (u'HEPBURN', u'E'): [(u'UNIVERSITY OF MELBOURNE', u'AUSTRALIA')],
+        })
+
+
+class TransformFileTest(TestCase):
+    """
+    Records are read from a file as its chunks are consumed, and counted
+    along the way.
+    """
+
+    def transform(self, offset, chunk_size, path='wos.txt', source='wos',
+                  stream=True):
+        from tethneweb.ingest import transform_file
+        args = (1, os.path.join(TEST_DATA, path), offset, source,
+                {'corpus_id': 1}, chunk_size)
+        return transform_file(args, stream=stream)
+
+    def test_streamed(self):
+        _, _, chunks, error, _ = self.transform(0, 3)
+        self.assertIsNone(error)
+        self.assertIsInstance(chunks, types.GeneratorType)
+        offsets = [offset for offset, rows, quarantined in chunks]
+        self.assertEqual(offsets, [3, 6, 9, 10])
+
+    def test_offset(self):
+        _, _, chunks, error, _ = self.transform(4, 3)
+        offsets = [offset for offset, rows, quarantined in chunks]
+        self.assertEqual(offsets, [7, 10])
+
+    def test_offset_at_end(self):
+        _, _, chunks, error, _ = self.transform(10, 3)
+        self.assertEqual(list(chunks), [])
+
+    def test_missing_file(self):
+        _, _, chunks, error, _ = self.transform(0, 3, path='missing.txt')
+        self.assertEqual(list(chunks), [])
+        self.assertIsNotNone(error)
+
+    def test_read_error(self):
+        # The records before a failure are kept.
+        article = ('<article><doi>10.2307/%i</doi><title>T</title>'
+                   '<author>Smith, J</author></article>')
+        with tempfile.NamedTemporaryFile(suffix='.xml') as f:
+            f.write('<articles>%s%s<article><doi>' % (article % 1, article % 2))
+            f.flush()
+            _, _, chunks, error, _ = self.transform(0, 5, path=f.name,
+                                                    source='jstor',
+                                                    stream=False)
+        self.assertEqual([offset for offset, _, _ in chunks], [2])
+        self.assertIn('after record 2', error)
+
+
+class MetadataEncodingTest(TestCase):
+    """
+    Metadata survive :func:`tethneweb.metadata.encode` and a trip through
+    JSON unchanged.
+    """
+
+    def assertRoundTrip(self, value):
+        encoded = json.loads(json.dumps(metadata.encode(value)))
+        self.assertEqual(metadata.decode(encoded), value)
+
+    def test_tuple_keys(self):
+        self.assertRoundTrip({('SMITH', 'J'): [(u'UNIV', u'USA', [u'Univ'])]})
+
+    def test_non_utf8_keys(self):
+        value = {'\xe9cole': 1, u'plain': 2}
+        self.assertEqual(metadata.encode(value).keys(), [metadata.DICT])
+        self.assertRoundTrip(value)
+
+
+class CheckUniqueTest(LoadedCorpusTestCase):
+    """
+    Anyone may check a corpus, but only its creator gets paper IDs back.
+    """
+
+    def check(self, user=None):
+        client = APIClient()
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            client.credentials(HTTP_AUTHORIZATION='Token %s' % token.key)
+        paper = PaperInstance.objects.filter(corpus=self.corpus, concrete=True)\
+                                     .exclude(checksum=None).first()
+        body = json.dumps({'corpus': self.corpus.id,
+                           'checksums': [paper.checksum, 'missing']})
+        response = client.post('/check_unique/', body,
+                               content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        return paper, json.loads(response.content)
+
+    def test_anonymous(self):
+        paper, data = self.check()
+        self.assertEqual(data, {'unique': [False, True]})
+
+    def test_owner(self):
+        paper, data = self.check(self.user)
+        self.assertEqual(data, {'unique': [False, True], 'ids': [paper.id, None]})
+
+    def test_other_user(self):
+        other = User.objects.create(id=2, username='other')
+        paper, data = self.check(other)
+        self.assertEqual(data, {'unique': [False, True]})
+
+
+@override_settings(CACHES=NO_CACHE)
+class ListQueryCountTest(LoadedCorpusTestCase):
+    """
+    The number of queries made by a list endpoint must not depend on the
+    number of objects on the page.
+    """
+
+    def assertConstantQueries(self, path, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(path, limit=2, **params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+        with self.assertNumQueries(len(queries)):
+            response = self.get(path, limit=20, **params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_paper_instance_list(self):
+        self.assertConstantQueries('/rest/paper_instance/',
+                                   corpus=self.corpus.id)
+
+    def test_corpus_list(self):
+        for i in range(20):
+            Corpus.objects.create(id=self.corpus.id + 1 + i,
+                                  source=self.corpus.source,
+                                  label='test %i' % i, created_by=self.user)
+        self.assertConstantQueries('/rest/corpus/')
+
+    def test_author_instance_list(self):
+        self.assertConstantQueries('/rest/author_instance/',
+                                   corpus=self.corpus.id)
+
+
+@override_settings(CACHES=NO_CACHE)
+class PaginationTest(LoadedCorpusTestCase):
+    """
+    Keyset pages (``?after=``\) and limit/offset pages without an exact
+    count (``?count=``\).
+    """
+
+    path = '/rest/paper_instance/'
+
+    def test_keyset_walk(self):
+        expected = list(PaperInstance.objects.filter(corpus=self.corpus)
+                                             .order_by('id')
+                                             .values_list('id', flat=True))
+        seen = []
+        response = self.get(self.path, corpus=self.corpus.id, after=0, limit=7)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data.keys(), ['next', 'results'])
+            seen += [paper['id'] for paper in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'], secure=True)
+        self.assertEqual(seen, expected)
+
+    def test_invalid_after(self):
+        response = self.get(self.path, after='abc')
+        self.assertEqual(response.status_code, 400)
+
+    def test_count_none(self):
+        response = self.get(self.path, corpus=self.corpus.id, count='none',
+                            limit=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIn('offset=5', response.data['next'])
+
+    def test_count_estimate(self):
+        response = self.get(self.path, corpus=self.corpus.id,
+                            count='estimate')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['count_is_estimate'])
+        self.assertIsInstance(response.data['count'], (int, long))
+
+    def test_invalid_count(self):
+        response = self.get(self.path, count='roughly')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=NO_CACHE)
+class DynamicFieldsTest(LoadedCorpusTestCase):
+    """
+    ``?fields=``\, ``?omit=`` and ``?expand=`` shape the objects of a list.
+    """
+
+    path = '/rest/paper_instance/'
+
+    def setUp(self):
+        super(DynamicFieldsTest, self).setUp()
+        self.paper = PaperInstance.objects.filter(corpus=self.corpus,
+                                                  concrete=True).first()
+
+    def get_paper(self, **params):
+        response = self.get(self.path, id=self.paper.id, **params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0]
+
+    def test_fields(self):
+        paper = self.get_paper(fields='id,title')
+        self.assertEqual(paper.keys(), ['id', 'title'])
+        self.assertEqual(paper['title'], self.paper.title)
+
+    def test_omit(self):
+        paper = self.get_paper(omit='abstract,identifiers')
+        self.assertNotIn('abstract', paper)
+        self.assertNotIn('identifiers', paper)
+        self.assertEqual(paper['title'], self.paper.title)
+
+    def test_expand(self):
+        paper = self.get_paper(expand='authors,metadata', fields='id,authors')
+        self.assertEqual(paper.keys(), ['id', 'authors'])
+        authors = self.paper.author_instances.order_by('id')
+        self.assertTrue(authors)
+        self.assertEqual(sorted([(author['id'], author['last_name'])
+                                 for author in paper['authors']]),
+                         [(author.id, author.last_name) for author in authors])
+        # ?fields= also drops expanded fields.
+        self.assertNotIn('metadata', paper)
+
+    def test_unknown_expansion(self):
+        response = self.get(self.path, expand='journal')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('expand', response.data)
+
+
+class BulkUploadTest(LoadedCorpusTestCase):
+    """
+    Records that the database would reject are a ``400``\, not a ``500``\.
+    """
+
+    def upload(self, *records):
+        body = '\n'.join([json.dumps(record) for record in records])
+        return self.client.post('/rest/bulk/?corpus=%i' % self.corpus.id, body,
+                                content_type='application/x-ndjson', secure=True)
+
+    def test_upload(self):
+        response = self.upload(
+            {'type': 'paper', 'id': 'p1', 'title': 'On things'},
+            {'type': 'metadata_document', 'paper': 'p1', 'document': {}})
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_reference(self):
+        response = self.upload({'type': 'author', 'last_name': 'SMITH'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['line'], 1)
+
+    def test_two_metadata_documents(self):
+        response = self.upload(
+            {'type': 'paper', 'id': 'p1', 'title': 'On things'},
+            {'type': 'metadata_document', 'paper': 'p1', 'document': {}},
+            {'type': 'metadata_document', 'paper': 'p1', 'document': {}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['line'], 3)
+
+    @override_settings(BULK_UPLOAD_MAX_BYTES=2 ** 16)
+    def test_gzip_bomb(self):
+        # 32 MB of blank lines, in about 32 KB.
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress('\n' * 2 ** 25) + compressor.flush()
+        response = self.client.post('/rest/bulk/?corpus=%i' % self.corpus.id, body,
+                                    content_type='application/x-ndjson',
+                                    HTTP_CONTENT_ENCODING='gzip', secure=True)
+        self.assertEqual(response.status_code, 413)
+
+    @override_settings(BULK_UPLOAD_MAX_LINE_BYTES=1024)
+    def test_long_line(self):
+        response = self.upload({'type': 'paper', 'id': 'p1', 'title': 'x' * 2048})
+        self.assertEqual(response.status_code, 413)
+
+    @override_settings(BULK_UPLOAD_MAX_ARRAY_BYTES=1024)
+    def test_large_array(self):
+        # The same records are fine as NDJSON.
+        records = [{'type': 'paper', 'id': 'p%i' % i, 'title': 'On things'}
+                   for i in range(50)]
+        response = self.client.post('/rest/bulk/?corpus=%i' % self.corpus.id,
+                                    json.dumps(records),
+                                    content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.upload(*records).status_code, 200)
+
+
+class ExportTest(LoadedCorpusTestCase):
+    """
+    ``/rest/export/`` streams every row of a kind in a corpus, in primary key
+    order.
+    """
+
+    def export(self, **params):
+        params.setdefault('corpus', self.corpus.id)
+        response = self.client.get('/rest/export/', params, secure=True)
+        if response.status_code != 200:
+            return response, None
+        return response, ''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        response, content = self.export(concrete='true', include='authors')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        papers = PaperInstance.objects.filter(corpus=self.corpus, concrete=True)\
+                                      .order_by('id')
+        self.assertEqual([row['id'] for row in rows],
+                         [paper.id for paper in papers])
+        for row in rows:
+            self.assertTrue(row['concrete'])
+            self.assertEqual(
+                [author['id'] for author in row['authors']],
+                list(AuthorInstance.objects.filter(paper_id=row['id'])
+                                           .order_by('id')
+                                           .values_list('id', flat=True)))
+
+    def test_csv(self):
+        response, content = self.export(type='author', output='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'id,paper_id,first_name,last_name')
+        authors = AuthorInstance.objects.filter(corpus=self.corpus)
+        self.assertEqual(len(lines) - 1, authors.count())
+        first = authors.order_by('id').first()
+        self.assertEqual(lines[1], '%i,%i,%s,%s' % (first.id, first.paper_id,
+                                                    first.first_name,
+                                                    first.last_name))
+
+    def test_invalid(self):
+        self.assertEqual(self.export(type='journal')[0].status_code, 400)
+        self.assertEqual(self.export(output='xml')[0].status_code, 400)
+        self.assertEqual(self.export(type='author',
+                                     include='authors')[0].status_code, 400)
+
+    def test_other_users_corpus(self):
+        other = User.objects.create(id=2, username='other')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.export()[0].status_code, 404)
+
+
+class CounterTest(LoadedCorpusTestCase):
+    """
+    The REST views keep the row counters of a corpus in step with its rows.
+    """
+
+    def counters(self, corpus):
+        return counts.corpus_counts(corpus)
+
+    def test_create(self):
+        before = self.counters(self.corpus)
+        paper = PaperInstance.objects.filter(corpus=self.corpus).first()
+        data = [{'id': 'a%i' % i, 'paper_id': paper.id, 'corpus_id': self.corpus.id,
+                 'last_name': 'SMITH'} for i in range(3)]
+        response = self.client.post('/rest/author_instance/',
+                                    {'data': json.dumps(data)}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counters(self.corpus)['authors'],
+                         before['authors'] + 3)
+
+    def test_destroy(self):
+        # The paper goes, with the citations that it cites, and their authors.
+        before = self.counters(self.corpus)
+        paper = PaperInstance.objects.filter(corpus=self.corpus, concrete=True)\
+                                     .annotate(n=Count('cited_references'))\
+                                     .filter(n__gt=0).first()
+        authors = AuthorInstance.objects.filter(Q(paper=paper) |
+                                                Q(paper__cited_by=paper)).count()
+        citations = paper.cited_references.count()
+        response = self.client.delete('/rest/paper_instance/%i/' % paper.id,
+                                      secure=True)
+        self.assertEqual(response.status_code, 204)
+        after = self.counters(self.corpus)
+        self.assertEqual(after['papers'], before['papers'] - 1)
+        self.assertEqual(after['citations'], before['citations'] - citations)
+        self.assertEqual(after['authors'], before['authors'] - authors)
+
+    def test_update_concrete(self):
+        before = self.counters(self.corpus)
+        paper = PaperInstance.objects.filter(corpus=self.corpus, concrete=True).first()
+        response = self.client.patch('/rest/paper_instance/%i/' % paper.id,
+                                     {'concrete': False}, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        after = self.counters(self.corpus)
+        self.assertEqual(after['papers'], before['papers'] - 1)
+        self.assertEqual(after['citations'], before['citations'] + 1)
+
+    def test_update_corpus(self):
+        other = Corpus.objects.create(id=self.corpus.id + 1, label='other',
+                                      source=self.corpus.source,
+                                      created_by=self.user)
+        before = self.counters(self.corpus)
+        author = self.corpus.authorinstance_set.first()
+        url = self.get('/rest/corpus/%i/' % other.id).data['url']
+        response = self.client.patch('/rest/author_instance/%i/' % author.id,
+                                     {'corpus': url}, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counters(self.corpus)['authors'],
+                         before['authors'] - 1)
+        self.assertEqual(self.counters(other)['authors'], 1)
+
+
+@override_settings(CACHES=NO_CACHE)
+class SearchTest(LoadedCorpusTestCase):
+    """
+    ``?search=`` matches the words of a query in titles and abstracts
+    together.
+    """
+
+    def ids(self, **params):
+        response = self.get('/rest/paper_instance/', corpus=self.corpus.id, **params)
+        self.assertEqual(response.status_code, 200)
+        return [paper['id'] for paper in response.data['results']]
+
+    def test_words_in_title_and_abstract(self):
+        # "municipal" is only in the title, "phenanthrene" only in the abstract.
+        paper = PaperInstance.objects.get(corpus=self.corpus, concrete=True,
+                                          title__startswith=AuthorAddressTest.title)
+        self.assertEqual(self.ids(search='municipal phenanthrene'), [paper.id])
+
+    def test_no_match(self):
+        self.assertEqual(self.ids(search='municipal xylophone'), [])
+
+
+class CitationFilterTest(LoadedCorpusTestCase):
+    """
+    ``?cited_by=`` and ``?citations=`` follow both references created for
+    one paper and interned references linked by :class:`.InstanceCitation`\.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super(CitationFilterTest, cls).setUpTestData()
+        papers = PaperInstance.objects.filter(corpus=cls.corpus, concrete=True)\
+                                      .annotate(n=Count('cited_references'))\
+                                      .filter(n__gt=0).order_by('pk')
+        cls.paper, cls.other = papers[:2]
+        # Link the other paper to one of the paper's references, as if it
+        # had been interned.
+        cls.reference = cls.paper.cited_references.order_by('pk').first()
+        InstanceCitation.objects.create(id=1, citing=cls.other, cited=cls.reference)
+
+    def ids(self, **params):
+        response = self.get('/rest/paper_instance/', limit=1000, **params)
+        self.assertEqual(response.status_code, 200)
+        return sorted([paper['id'] for paper in response.data['results']])
+
+    def test_cited_by(self):
+        expected = list(self.other.cited_references.values_list('id', flat=True))
+        self.assertEqual(self.ids(cited_by=self.other.id),
+                         sorted(expected + [self.reference.id]))
+
+    def test_citations(self):
+        self.assertEqual(self.ids(citations=self.reference.id),
+                         sorted([self.paper.id, self.other.id]))
+
+
+@override_settings(CACHES=NO_CACHE)
+class ConditionalGetTest(LoadedCorpusTestCase):
+    """
+    A client that sends the ``ETag`` of an unchanged corpus back gets a
+    ``304``\; any write to the corpus changes the tag.
+    """
+
+    def etag(self):
+        response = self.get('/rest/paper_instance/', corpus=self.corpus.id)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def version(self, corpus):
+        return Corpus.objects.get(pk=corpus.pk).version
+
+    def test_not_modified(self):
+        etag = self.etag()
+        response = self.client.get('/rest/paper_instance/',
+                                   {'corpus': self.corpus.id, 'format': 'json'},
+                                   HTTP_IF_NONE_MATCH=etag, secure=True)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_modified(self):
+        etag = self.etag()
+        paper = PaperInstance.objects.filter(corpus=self.corpus).first()
+        response = self.client.patch('/rest/paper_instance/%i/' % paper.id,
+                                     {'title': 'Changed'}, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_update_corpus(self):
+        # Both the corpus that the author leaves and the one it joins change.
+        other = Corpus.objects.create(id=self.corpus.id + 1, label='other',
+                                      source=self.corpus.source,
+                                      created_by=self.user)
+        versions = self.version(self.corpus), self.version(other)
+        author = self.corpus.authorinstance_set.first()
+        url = self.get('/rest/corpus/%i/' % other.id).data['url']
+        response = self.client.patch('/rest/author_instance/%i/' % author.id,
+                                     {'corpus': url}, format='json', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.version(self.corpus), self.version(other)),
+                         (versions[0] + 1, versions[1] + 1))
+
+
+@override_settings(CACHES=NO_CACHE)
+class NetworkTest(LoadedCorpusTestCase):
+    """
+    ``/rest/network/`` builds networks that agree with the rows of the
+    corpus.
+    """
+
+    def network(self, kind, output='ndjson', **params):
+        params.update(corpus=self.corpus.id, type=kind, output=output)
+        response = self.client.get('/rest/network/', params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return ''.join(response.streaming_content)
+
+    def edges(self, kind, **params):
+        """
+        Edges as ``{(source, target): weight}``\; undirected edges are keyed
+        by their sorted ends.
+        """
+        edges = {}
+        for line in self.network(kind, **params).splitlines():
+            row = json.loads(line)
+            ends = (row['source'], row['target'])
+            if kind != 'direct_citation':
+                ends = tuple(sorted(ends))
+            self.assertNotIn(ends, edges)
+            edges[ends] = row['weight']
+        return edges
+
+    def shared(self, groups):
+        """
+        For each pair of members of ``groups`` (a ``dict`` of ``set``\s), the
+        number of groups that both belong to.
+        """
+        counts = {}
+        for members in groups.values():
+            for first in members:
+                for second in members:
+                    if first < second:
+                        counts[first, second] = counts.get((first, second), 0) + 1
+        return counts
+
+    def test_direct_citation(self):
+        # References to the same work (by DOI or ayjid) are one node, and a
+        # reference to a paper of the corpus is that paper's node.
+        keys = networks.reference_keys(self.corpus)
+        papers = PaperInstance.objects.filter(corpus=self.corpus, concrete=True)
+        nodes = dict([(keys.get(paper.id), 'paper:%i' % paper.id)
+                      for paper in papers])
+        expected = set()
+        for paper in papers:
+            for reference in paper.cited_references.all():
+                key = keys.get(reference.id) or 'paper:%i' % reference.id
+                expected.add(('paper:%i' % paper.id, nodes.get(key, key)))
+        edges = self.edges('direct_citation')
+        self.assertEqual(set(edges), expected)
+        self.assertEqual(set(edges.values()), set([1]))
+
+    def test_cocitation_and_coupling(self):
+        references, citing = {}, {}
+        for source, target in self.edges('direct_citation'):
+            references.setdefault(source, set()).add(target)
+            citing.setdefault(target, set()).add(source)
+        self.assertEqual(self.edges('cocitation'), self.shared(references))
+        coupling = self.edges('bibliographic_coupling')
+        self.assertTrue(coupling)
+        self.assertEqual(coupling, self.shared(citing))
+
+    def test_years(self):
+        year = PaperInstance.objects.filter(corpus=self.corpus, concrete=True)\
+                                    .values_list('publication_date', flat=True)\
+                                    .first()
+        edges = self.edges('direct_citation', start=year, end=year)
+        self.assertTrue(edges)
+        for source, target in edges:
+            paper = PaperInstance.objects.get(pk=int(source.split(':')[1]))
+            self.assertEqual(paper.publication_date, year)
+        self.assertEqual(self.edges('direct_citation', end=0), {})
+
+    def test_min_weight(self):
+        edges = self.edges('cocitation', min_weight=2)
+        self.assertTrue(edges)
+        self.assertEqual(edges, dict([(ends, weight) for ends, weight
+                                      in self.edges('cocitation').items()
+                                      if weight >= 2]))
+
+    def test_graphml(self):
+        from xml.etree import ElementTree as ET
+        namespace = '{http://graphml.graphdrawing.org/xmlns}'
+        graph = ET.fromstring(self.network('direct_citation', 'graphml'))\
+                  .find(namespace + 'graph')
+        self.assertEqual(graph.get('edgedefault'), 'directed')
+        edges = graph.findall(namespace + 'edge')
+        self.assertEqual(set([(edge.get('source'), edge.get('target'))
+                              for edge in edges]),
+                         set(self.edges('direct_citation')))
+        nodes = set([node.get('id') for node in graph.findall(namespace + 'node')])
+        self.assertEqual(nodes, set([edge.get('source') for edge in edges]) |
+                                set([edge.get('target') for edge in edges]))
+
+    def test_coauthorship(self):
+        # Authors are identified by surname and initials.
+        authors = {}
+        for author in AuthorInstance.objects.filter(corpus=self.corpus,
+                                                    paper__concrete=True):
+            key, label = networks.author_node(author.last_name,
+                                              author.first_name)
+            authors.setdefault(author.paper_id, set()).add(key)
+        expected = self.shared(authors)
+        self.assertTrue(expected)
+        self.assertEqual(self.edges('coauthorship'), expected)
+
+    def test_too_large(self):
+        max_pairs, networks.MAX_PAIRS = networks.MAX_PAIRS, 1
+        try:
+            response = self.client.get('/rest/network/',
+                                       {'corpus': self.corpus.id,
+                                        'type': 'coauthorship'}, secure=True)
+        finally:
+            networks.MAX_PAIRS = max_pairs
+        self.assertEqual(response.status_code, 400)
+
+    def test_author_institution(self):
+        expected = {}
+        for affiliation in AffiliationInstance.objects\
+                .filter(corpus=self.corpus, paper__concrete=True)\
+                .select_related('author', 'institution'):
+            author, _ = networks.author_node(affiliation.author.last_name,
+                                             affiliation.author.first_name)
+            institution, _ = networks.institution_node(
+                affiliation.institution.name, affiliation.institution.country)
+            ends = tuple(sorted([author, institution]))
+            expected[ends] = expected.get(ends, 0) + affiliation.confidence
+        edges = self.edges('author_institution')
+        self.assertTrue(edges)
+        self.assertEqual(set(edges), set(expected))
+        for ends, weight in edges.items():
+            self.assertAlmostEqual(weight, expected[ends])
+
+    def test_invalid(self):
+        for params in [{'type': 'friendship'}, {'output': 'gexf'},
+                       {'start': 'last year'}, {'min_weight': 'heavy'}]:
+            params.setdefault('corpus', self.corpus.id)
+            response = self.client.get('/rest/network/', params, secure=True)
+            self.assertEqual(response.status_code, 400, params)
+
+
+@override_settings(CACHES=dict(settings.CACHES, responses={
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'tethneweb-tests',
+}))
+class ResponseCacheTest(LoadedCorpusTestCase):
+    """
+    List responses are cached until the data they were made from changes.
+    """
+
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        caching.get_cache().clear()
+
+    def assertCache(self, status, path, **params):
+        response = self.get(path, **params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], status)
+        return response
+
+    def test_corpus_version(self):
+        path = '/rest/paper_instance/'
+        paper = PaperInstance.objects.filter(corpus=self.corpus).first()
+        self.assertCache('MISS', path, id=paper.id, corpus=self.corpus.id)
+        self.assertCache('HIT', path, id=paper.id, corpus=self.corpus.id)
+        response = self.client.patch('/rest/paper_instance/%i/' % paper.id,
+                                     {'title': 'Changed'}, format='json',
+                                     secure=True)
+        self.assertEqual(response.status_code, 200)
+        response = self.assertCache('MISS', path, id=paper.id,
+                                    corpus=self.corpus.id)
+        self.assertEqual(response.data['results'][0]['title'], 'Changed')
+
+    def test_user_version(self):
+        self.assertCache('MISS', '/rest/corpus/')
+        self.assertCache('HIT', '/rest/corpus/')
+        Corpus.objects.create(id=self.corpus.id + 1, label='other',
+                              source=self.corpus.source, created_by=self.user)
+        response = self.assertCache('MISS', '/rest/corpus/')
+        self.assertEqual(response.data['count'], 2)
+
+    def test_per_user(self):
+        self.assertCache('MISS', '/rest/corpus/')
+        self.client.force_authenticate(user=User.objects.create(id=2,
+                                                                username='other'))
+        response = self.assertCache('MISS', '/rest/corpus/')
+        self.assertEqual(response.data['count'], 0)
+
+
+@override_settings(CACHES=NO_CACHE, PROFILE_REQUESTS=True,
+                   MIDDLEWARE_CLASSES=['tethneweb.profiling.ProfilingMiddleware'] +
+                                      list(settings.MIDDLEWARE_CLASSES))
+class ProfilingTest(LoadedCorpusTestCase):
+    """
+    Profiled requests report their timings in a ``Server-Timing`` header, and
+    queries that repeat are flagged.
+    """
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get('/rest/paper_instance/', corpus=self.corpus.id)
+        self.assertEqual(response.status_code, 200)
+        metrics = [metric.strip().split(';')
+                   for metric in response['Server-Timing'].split(',')]
+        self.assertEqual([metric[0] for metric in metrics],
+                         ['db', 'serialize', 'render', 'total'])
+        self.assertEqual(metrics[0][2], 'desc="%i queries"' % len(queries))
+        for metric in metrics:
+            self.assertRegexpMatches(metric[1], r'^dur=\d+\.\d$')
+
+    def test_query_shape(self):
+        sql = "SELECT * FROM t WHERE id = 12 AND name = 'O''Brien' AND x IN (1, 2.5, 3)"
+        self.assertEqual(profiling.query_shape(sql),
+                         'SELECT * FROM t WHERE id = ? AND name = ? AND x IN (?)')
+
+    def test_repeated_queries(self):
+        profile = profiling.RequestProfile()
+        profile.queries = [{'sql': 'SELECT * FROM t WHERE id = %i' % i,
+                            'time': '0.001'}
+                           for i in range(profiling.REPEATED_QUERIES)]
+        profile.queries.append({'sql': 'SELECT 1', 'time': '0.001'})
+        self.assertEqual(profile.repeated_queries(),
+                         [('SELECT * FROM t WHERE id = ?',
+                           profiling.REPEATED_QUERIES)])
+
+    def test_stats_for_staff_only(self):
+        response = self.get('/rest/profile_stats/')
+        self.assertEqual(response.status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.get('/rest/profile_stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['enabled'])
+
+
+class SyntheticWoSTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_files(self):
+        paths = SyntheticWoS(5).write(self.directory, files=2)
+        self.assertEqual(len(paths), 2)
+
+    def test_no_papers(self):
+        self.assertEqual(SyntheticWoS(0).write(self.directory), [])
+        with self.assertRaises(CommandError):
+            call_command('generate_wos', self.directory, papers=0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans need PostgreSQL.')
+class QueryPlanTest(TestCase):
+    """
+    None of the canonical list queries (see the ``check_query_plans``
+    command) may scan a large table sequentially. The fixture is far smaller
+    than a real corpus, so tables count as large from ``min_rows`` rows.
+
+    The queries are checked in two small corpora, one with interned citations,
+    next to a larger one: in a table that holds only one corpus, scanning it
+    is the best way to find that corpus's rows.
+    """
+
+    papers = 1000
+    sample_papers = 20
+    min_rows = 500
+
+    @classmethod
+    def load(cls, papers, label, **options):
+        directory = tempfile.mkdtemp()
+        try:
+            SyntheticWoS(papers).write(directory)
+            with open(os.devnull, 'w') as devnull:
+                call_command('load_wos', directory, label, '500',
+                             stdout=devnull, **options)
+        finally:
+            shutil.rmtree(directory)
+        return Corpus.objects.get(label=label)
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(id=1, username='tethne')
+        cls.load(cls.papers, 'synthetic')
+        cls.samples = [cls.load(cls.sample_papers, 'sample'),
+                       cls.load(cls.sample_papers, 'interned',
+                                intern_citations=True)]
+        with connection.cursor() as cursor:
+            # Sample every row, so that the plans don't depend on which rows
+            # ANALYZE happens to pick.
+            cursor.execute('SET default_statistics_target = 1000')
+            cursor.execute('ANALYZE')
+            cursor.execute('RESET default_statistics_target')
+
+    def test_no_large_seq_scans(self):
+        with open(os.devnull, 'w') as devnull:
+            for corpus in self.samples:
+                try:
+                    call_command('check_query_plans', corpus=corpus.id,
+                                 min_rows=self.min_rows, stdout=devnull)
+                except CommandError as e:
+                    self.fail('%s: %s' % (corpus.label, e))
@@ -0,0 +1,314 @@
+"""
+Bulk upload of a graph of records across the instance models, in one request.
+
+Each record is a JSON object with a ``type`` (see :data:`RECORD_TYPES`\), a
+temporary ``id`` chosen by the client (optional if nothing refers to the
+record), and the fields of its model. Fields
+that refer to other records (e.g. an author's ``paper``\) hold the temporary
+IDs of records earlier in the same upload:
+
+.. code-block:: javascript
+
+   {"type": "paper", "id": "p1", "title": "On things", "publication_date": 1999}
+   {"type": "paper", "id": "r1", "title": "Cited", "concrete": false, "cited_by": "p1"}
+   {"type": "author", "id": "a1", "paper": "p1", "last_name": "SMITH", "first_name": "J"}
+   {"type": "citation", "id": "c1", "citing": "p1", "cited": "r1"}
+
+The body is either newline-delimited JSON (``application/x-ndjson``\), which
+is parsed line by line as it is read, or a JSON array of records. Either may
+be gzip-compressed (``Content-Encoding: gzip``\). Rows are written in batches
+as the body is read, all in one transaction, so an invalid record rolls back
+the whole upload.
+
+The (decompressed) body and each line of it are limited in size (see
+:func:`iter_records`\). A JSON array can only be parsed once all of it has
+been read, so it has a much lower limit: large uploads should be NDJSON.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+import json
+import zlib
+from collections import defaultdict
+
+from tethneweb.models import *
+from tethneweb.bulk import BulkCreateWriter
+from tethneweb.ids import allocator
+from tethneweb import counts, versions
+
+
+RECORD_TYPES = {
+    'paper': (PaperInstance, {'cited_by': 'paper'}),
+    'citation': (InstanceCitation, {'citing': 'paper', 'cited': 'paper'}),
+    'identifier': (InstanceIdentifier, {'paper': 'paper'}),
+    'metadatum': (InstanceMetadatum, {'paper': 'paper'}),
+    'metadata_document': (InstanceMetadataDocument, {'paper': 'paper'}),
+    'author': (AuthorInstance, {'paper': 'paper'}),
+    'institution': (InstitutionInstance, {'paper': 'paper'}),
+    'affiliation': (AffiliationInstance, {'paper': 'paper', 'author': 'author',
+                                          'institution': 'institution'}),
+}
+"""Maps record types onto models, and their reference fields onto types."""
+
+PROTECTED_FIELDS = set(['id', 'corpus', 'created_by'])
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(ValueError):
+    """
+    A record in an upload is invalid; ``line`` is its position (from 1).
+    """
+    def __init__(self, line, message):
+        super(UploadError, self).__init__('Record %i: %s' % (line, message))
+        self.line = line
+
+
+class UploadTooLarge(ValueError):
+    """
+    An upload body, or a line of it, is larger than allowed.
+    """
+    pass
+
+
+def _inflate(decompressor, data):
+    """
+    Decompress ``data`` at most :data:`CHUNK_SIZE` bytes at a time, so that
+    a small body that inflates to a huge one is never held in memory.
+    """
+    while True:
+        chunk = decompressor.decompress(data, CHUNK_SIZE)
+        data = decompressor.unconsumed_tail
+        if chunk:
+            yield chunk
+        if not data and len(chunk) < CHUNK_SIZE:
+            break
+
+
+def iter_chunks(stream, gzipped=False, max_size=None):
+    """
+    Read ``stream`` in chunks, decompressing gzip on the fly if required.
+    Raises :class:`UploadTooLarge` once more than ``max_size`` (decompressed)
+    bytes have been read.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    size = 0
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        chunks = [data] if decompressor is None else _inflate(decompressor, data)
+        for chunk in chunks:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise UploadTooLarge('body is larger than %i bytes' % max_size)
+            yield chunk
+    if decompressor is not None:
+        tail = decompressor.flush()
+        if max_size is not None and size + len(tail) > max_size:
+            raise UploadTooLarge('body is larger than %i bytes' % max_size)
+        if tail:
+            yield tail
+
+
+def iter_lines(chunks, max_line=None):
+    """
+    Split ``chunks`` into lines. Raises :class:`UploadTooLarge` as soon as a
+    line is longer than ``max_line`` bytes, rather than buffering the rest of
+    it.
+    """
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        lines = buf.split('\n')
+        buf = lines.pop()
+        for line in lines + [buf]:
+            if max_line is not None and len(line) > max_line:
+                raise UploadTooLarge('a line is longer than %i bytes' % max_line)
+        for line in lines:
+            yield line
+    if buf:
+        yield buf
+
+
+def iter_records(stream, ndjson=True, gzipped=False, max_size=None,
+                 max_line=None):
+    """
+    Yields ``(line, record)`` from an upload body.
+
+    Parameters
+    ----------
+    stream : file-like
+    ndjson : bool
+        If ``False``\, the body is a JSON array, which is read into memory
+        before it is parsed.
+    gzipped : bool
+    max_size : int
+        The largest (decompressed) body allowed, in bytes.
+    max_line : int
+        The longest NDJSON line allowed, in bytes.
+
+    Raises
+    ------
+    :class:`UploadError`
+        If a record is not valid JSON.
+    :class:`UploadTooLarge`
+        As soon as the body or a line is too large.
+    """
+    chunks = iter_chunks(stream, gzipped=gzipped, max_size=max_size)
+    if ndjson:
+        position = 0
+        for line in iter_lines(chunks, max_line=max_line):
+            if not line.strip():
+                continue
+            position += 1
+            try:
+                yield position, json.loads(line)
+            except ValueError as E:
+                raise UploadError(position, 'invalid JSON (%s)' % E)
+    else:
+        body = ''.join(chunks)
+        try:
+            records = json.loads(body)
+        except ValueError as E:
+            raise UploadError(0, 'invalid JSON (%s)' % E)
+        if type(records) is not list:
+            raise UploadError(0, 'expected an array of records')
+        for position, record in enumerate(records):
+            yield position + 1, record
+
+
+class GraphUploader(object):
+    """
+    Resolves temporary IDs and writes the records of an upload to ``corpus``\.
+
+    Parameters
+    ----------
+    corpus : :class:`.Corpus`
+    user : :class:`django.contrib.auth.models.User`
+    batch_size : int
+        Rows of each model are written once this many have accumulated.
+    """
+
+    def __init__(self, corpus, user, batch_size=1000):
+        self.corpus = corpus
+        self.user = user
+        self.batch_size = batch_size
+        self.writer = BulkCreateWriter()
+        self.id_map = defaultdict(dict)
+        self.hoppers = defaultdict(list)
+        self.counts = defaultdict(int)
+        self._fields = {}
+        self._unique = defaultdict(set)
+
+    def upload(self, records):
+        """
+        Write ``records`` (``(line, record)`` pairs) in one transaction.
+
+        Returns
+        -------
+        dict
+            Maps record types onto ``{temporary id: id}``\.
+        """
+        with transaction.atomic():
+            for line, record in records:
+                self.add(line, record)
+            for record_type in self.hoppers.keys():
+                self._flush(record_type)
+            versions.bump([self.corpus.id])
+        return {record_type: ids for record_type, ids
+                in self.id_map.iteritems() if ids}
+
+    def _get_fields(self, model):
+        if model not in self._fields:
+            self._fields[model] = {field.name: field for field
+                                   in model._meta.concrete_fields
+                                   if field.name not in PROTECTED_FIELDS}
+        return self._fields[model]
+
+    def _is_optional(self, field):
+        """
+        Whether ``field`` may be left out of a record without a database
+        error: it has a default (strings default to ``''``\), or is set on
+        save.
+        """
+        return field.get_default() is not None \
+               or getattr(field, 'auto_now', False) \
+               or getattr(field, 'auto_now_add', False)
+
+    def add(self, line, record):
+        if type(record) is not dict:
+            raise UploadError(line, 'expected an object')
+        record = dict(record)
+        record_type = record.pop('type', None)
+        if record_type not in RECORD_TYPES:
+            raise UploadError(line, 'unknown type %r' % record_type)
+        model, references = RECORD_TYPES[record_type]
+        # Records that nothing refers to (e.g. identifiers) may omit their id.
+        temp_ident = record.pop('id', None)
+        if not isinstance(temp_ident, (basestring, int, long, type(None))):
+            raise UploadError(line, 'invalid id %r' % (temp_ident,))
+        if temp_ident in self.id_map[record_type]:
+            raise UploadError(line, 'duplicate %s id %r' % (record_type, temp_ident))
+
+        fields = self._get_fields(model)
+        row = {}
+        for name, value in record.iteritems():
+            field = fields.get(name)
+            if field is None:
+                raise UploadError(line, 'unknown field %r for %s' % (name, record_type))
+            if name in references:
+                if value is None:
+                    row[field.attname] = None
+                    continue
+                target = None
+                if isinstance(value, (basestring, int, long)):
+                    target = self.id_map[references[name]].get(value)
+                if target is None:
+                    raise UploadError(line, '%s refers to unknown %s %r' % \
+                                      (name, references[name], value))
+                row[field.attname] = target
+                continue
+            try:
+                value = field.to_python(value)
+            except ValidationError as E:
+                raise UploadError(line, 'invalid %s (%s)' % (name, ' '.join(E.messages)))
+            max_length = getattr(field, 'max_length', None)
+            if max_length and isinstance(value, basestring) and len(value) > max_length:
+                raise UploadError(line, '%s is longer than %i characters' % \
+                                  (name, max_length))
+            row[field.attname] = value
+
+        for name, field in fields.iteritems():
+            if field.null or field.attname not in row and self._is_optional(field):
+                continue
+            if row.get(field.attname) is None:
+                raise UploadError(line, 'missing %s' % name)
+        for name, field in fields.iteritems():
+            if not field.unique or row.get(field.attname) is None:
+                continue
+            # E.g. a paper's metadata document (one-to-one).
+            seen = self._unique[(record_type, name)]
+            if row[field.attname] in seen:
+                raise UploadError(line, 'more than one %s for %s %r' % \
+                                  (record_type, name, record[name]))
+            seen.add(row[field.attname])
+
+        new_id = allocator.next_id(model)
+        if temp_ident is not None:
+            self.id_map[record_type][temp_ident] = new_id
+        row.update({'id': new_id})
+        if 'corpus' in [field.name for field in model._meta.concrete_fields]:
+            row.update({'corpus_id': self.corpus.id,
+                        'created_by_id': self.user.id})
+        self.hoppers[record_type].append(row)
+        if len(self.hoppers[record_type]) >= self.batch_size:
+            self._flush(record_type)
+
+    def _flush(self, record_type):
+        model, references = RECORD_TYPES[record_type]
+        rows = self.hoppers[record_type]
+        self.counts[record_type] += self.writer.write(model, rows)
+        counts.record(model, rows)
+        self.hoppers[record_type] = []
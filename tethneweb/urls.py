@@ -12,11 +12,17 @@ router.register(r'author_instance', views.AuthorInstanceViewSet)
 router.register(r'institution_instance', views.InstitutionInstanceViewSet)
 router.register(r'affiliation_instance', views.AffiliationInstanceViewSet)
 router.register(r'instance_metadatum', views.InstanceMetadatumViewSet)
+router.register(r'instance_metadata_document', views.InstanceMetadataDocumentViewSet)
 router.register(r'instance_identifier', views.InstanceIdentifierViewSet)
 
 
 urlpatterns = [
     url('', include('social_django.urls', namespace='social')),
+    url(r'^rest/bulk/$', views.BulkUploadView.as_view(), name='bulk-upload'),
+    url(r'^rest/export/$', views.ExportView.as_view(), name='export'),
+    url(r'^rest/network/$', views.NetworkView.as_view(), name='network'),
+    url(r'^rest/cache_stats/$', views.CacheStatsView.as_view(), name='cache-stats'),
+    url(r'^rest/profile_stats/$', views.ProfileStatsView.as_view(), name='profile-stats'),
     url(r'^rest/', include(router.urls)),
     url(r'^admin/', admin.site.urls),
     url(r'^api-token-auth/', auth_views.obtain_auth_token),
@@ -1,16 +1,44 @@
-from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework import VERSION, exceptions, serializers, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.settings import api_settings
+from rest_framework.reverse import reverse
 from django.conf import settings
+from django.utils import six
+from django.utils.http import urlquote
 
 from collections import OrderedDict
 
+from tethneweb import profiling
 
-class BrowsableAPIRendererWithoutForms(BrowsableAPIRenderer):
+
+class ProfiledRendererMixin(object):
+    """
+    Times rendering, for requests that are being profiled (see
+    :mod:`tethneweb.profiling`\).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        request = (renderer_context or {}).get('request')
+        with profiling.timer(request, 'render'):
+            return super(ProfiledRendererMixin, self).render(
+                data, accepted_media_type, renderer_context)
+
+
+class ProfiledJSONRenderer(ProfiledRendererMixin, JSONRenderer):
+    pass
+
+
+class BrowsableAPIRendererWithoutForms(ProfiledRendererMixin,
+                                       BrowsableAPIRenderer):
     def get_context(self, data, accepted_media_type, renderer_context):
         """
         Returns the context used to render.
         """
+        with profiling.timer(renderer_context['request'], 'browsable_context'):
+            return self._get_context(data, accepted_media_type, renderer_context)
+
+    def _get_context(self, data, accepted_media_type, renderer_context):
         view = renderer_context['view']
         request = renderer_context['request']
         response = renderer_context['response']
@@ -61,3 +89,131 @@ class BrowsableAPIRendererWithoutForms(BrowsableAPIRenderer):
             'csrf_cookie_name': settings.CSRF_COOKIE_NAME,
         }
         return context
+
+
+URL_MARKER = '0tethnewebmarker0'
+"""Stands in for the lookup value when a URL template is reversed."""
+
+
+def url_template(view_name, request, format=None, lookup_url_kwarg='pk'):
+    """
+    Reverses ``view_name`` once per request, with :data:`URL_MARKER` in place
+    of the lookup value, so that hyperlinks to many objects can be built by
+    substitution rather than a full ``reverse`` each.
+    """
+    cache = getattr(request, '_url_templates', None)
+    if cache is None:
+        cache = {}
+        if request is not None:
+            request._url_templates = cache
+    key = (view_name, format, lookup_url_kwarg)
+    if key not in cache:
+        cache[key] = reverse(view_name, kwargs={lookup_url_kwarg: URL_MARKER},
+                             request=request, format=format)
+    return cache[key]
+
+
+class TemplatedURLMixin(object):
+    def get_url(self, obj, view_name, request, format):
+        # Unsaved objects will not yet have a valid URL.
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        lookup_value = getattr(obj, self.lookup_field)
+        template = url_template(view_name, request, format, self.lookup_url_kwarg)
+        return template.replace(URL_MARKER, urlquote(six.text_type(lookup_value)))
+
+
+class TemplatedHyperlinkedRelatedField(TemplatedURLMixin,
+                                       serializers.HyperlinkedRelatedField):
+    pass
+
+
+class TemplatedHyperlinkedIdentityField(TemplatedURLMixin,
+                                        serializers.HyperlinkedIdentityField):
+    pass
+
+
+def query_list(request, name):
+    """
+    The comma-separated values of the query parameter ``name``\.
+    """
+    if request is None:
+        return []
+    return [value.strip() for value
+            in request.query_params.get(name, '').split(',') if value.strip()]
+
+
+class DynamicFieldsMixin(object):
+    """
+    Lets clients shape the objects of a response with query parameters:
+    ``?fields=`` keeps only the named fields, ``?omit=`` drops the named
+    fields, and ``?expand=`` embeds related objects in place of links to them
+    (see :attr:`.expandable`\). Only top-level objects are shaped, not
+    embedded ones.
+    """
+    expandable = {}
+    """
+    Maps field names onto ``(related name, serializer class)`` for relations
+    that can be expanded.
+    """
+    expand_prefetches = {}
+    """
+    Other relations that an expanded field reads, by field name; they are
+    prefetched along with the related name.
+    """
+
+    @classmethod
+    def get_expansions(cls, request):
+        names = query_list(request, 'expand')
+        unknown = sorted(set(names) - set(cls.expandable))
+        if unknown:
+            raise ValidationError({'expand': 'Cannot expand %s; expandable'
+                                             ' fields are: %s.' % \
+                                   (', '.join(unknown),
+                                    ', '.join(sorted(cls.expandable)) or 'none')})
+        return names
+
+    @classmethod
+    def get_dropped_fields(cls, request):
+        """
+        Names of the fields in ``Meta.fields`` that are left out of the
+        response to ``request``\.
+        """
+        keep = query_list(request, 'fields')
+        dropped = set(query_list(request, 'omit'))
+        if keep:
+            dropped |= set(cls.Meta.fields) - set(keep)
+        return dropped
+
+    def _is_top_level(self):
+        return self.parent is None or \
+               (self.parent is self.root and isinstance(self.parent, serializers.ListSerializer))
+
+    def get_fields(self):
+        fields = super(DynamicFieldsMixin, self).get_fields()
+        request = self.context.get('request')
+        if request is None or not self._is_top_level():
+            return fields
+        for name in self.get_expansions(request):
+            source, serializer_class = self.expandable[name]
+            kwargs = {'source': source} if source != name else {}
+            fields[name] = serializer_class(many=True, read_only=True, **kwargs)
+        for name in self.get_dropped_fields(request):
+            fields.pop(name, None)
+        return fields
+
+
+class TemplatedHyperlinkedModelSerializer(DynamicFieldsMixin,
+                                          serializers.HyperlinkedModelSerializer):
+    """
+    Builds hyperlinks from per-request URL templates (see
+    :func:`url_template`\), and can be shaped by the request (see
+    :class:`.DynamicFieldsMixin`\).
+    """
+    serializer_related_field = TemplatedHyperlinkedRelatedField
+    serializer_url_field = TemplatedHyperlinkedIdentityField
+
+    def to_representation(self, instance):
+        with profiling.timer(self.context.get('request'), 'serialize'):
+            return super(TemplatedHyperlinkedModelSerializer, self)\
+                .to_representation(instance)
@@ -0,0 +1,125 @@
+"""
+Per-corpus version tokens, for conditional GETs.
+
+Every :class:`.Corpus` has a ``version`` that is incremented (and a
+``last_modified`` that is set) by :func:`bump` whenever rows in the corpus
+change: by the loader for each batch it commits, by the bulk upload endpoint,
+by the ``create()`` views, and by the update and destroy views (see
+:class:`VersionedWritesMixin`\). There are no per-row signal receivers, which
+would stop Django from deleting cascaded rows in bulk; rows changed in other
+ways (e.g. in the admin) don't change the version. The REST views derive
+``ETag`` and ``Last-Modified`` from them (see :class:`ConditionalGetMixin`\),
+so that a client polling an unchanged corpus gets a ``304`` for the price of
+one primary key lookup.
+"""
+
+from django.db.models import F
+from django.http import HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags, quote_etag
+
+import hashlib
+import calendar
+
+from tethneweb.models import *
+
+
+def bump(corpus_ids):
+    """
+    Increment the version of each of ``corpus_ids``\, in one query.
+    """
+    corpus_ids = set(corpus_ids) - set([None])
+    if not corpus_ids:
+        return
+    Corpus.objects.filter(id__in=corpus_ids)\
+                  .update(version=F('version') + 1, last_modified=timezone.now())
+
+
+def get_state(queryset, lookup=''):
+    """
+    The ``(corpus id, version, last_modified)`` of the corpus of the first
+    object in ``queryset``\, or ``None``\. ``lookup`` is the path from the
+    model of ``queryset`` to :class:`.Corpus` (e.g. ``'corpus__'``\).
+    """
+    fields = [lookup + field for field in ('id', 'version', 'last_modified')]
+    rows = list(queryset.prefetch_related(None).values_list(*fields)[:1])
+    return rows[0] if rows else None
+
+
+class ConditionalGetMixin(object):
+    """
+    Adds ``ETag`` and ``Last-Modified`` to corpus-scoped list (``?corpus=``\)
+    and detail responses, and answers ``If-None-Match`` with ``304 Not
+    Modified`` before the objects are queried or serialized.
+    ``If-Modified-Since`` is not answered: HTTP dates have whole seconds, so
+    a write in the same second as the response would go unnoticed.
+
+    The tag depends on the version of the corpus, the user, and the full URL
+    and ``Accept`` header of the request. Only the user's own corpora (and
+    their objects) are looked up, as in :class:`.CreatorOnlyMixin`\.
+    """
+    corpus_lookup = 'corpus__'
+    """Path from the model of the view to :class:`.Corpus`\."""
+
+    def list(self, request, *args, **kwargs):
+        corpus_id = request.query_params.get('corpus')
+        state = None
+        if corpus_id and corpus_id.isdigit():
+            state = get_state(Corpus.objects.filter(pk=corpus_id,
+                                                    created_by=request.user.id))
+        return self.conditional(request, state, super(ConditionalGetMixin, self).list,
+                                *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        queryset = self.get_queryset().filter(**{self.lookup_field: lookup})
+        state = get_state(queryset, '' if queryset.model is Corpus else self.corpus_lookup)
+        return self.conditional(request, state, super(ConditionalGetMixin, self).retrieve,
+                                *args, **kwargs)
+
+    def get_etag(self, request, state):
+        corpus_id, version, last_modified = state
+        key = '|'.join(map(unicode, [corpus_id, version, request.user.pk,
+                                     request.build_absolute_uri(),
+                                     request.META.get('HTTP_ACCEPT', '')]))
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def conditional(self, request, state, handler, *args, **kwargs):
+        self.corpus_state = state
+        if state is None:
+            return handler(request, *args, **kwargs)
+
+        etag = self.get_etag(request, state)
+        last_modified = calendar.timegm(state[2].utctimetuple())
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None and \
+                (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            response = HttpResponseNotModified()
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = quote_etag(etag)
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class VersionedWritesMixin(object):
+    """
+    Bumps the version of the corpus once for each ``update()`` or
+    ``destroy()``\, however many rows it changes. An ``update()`` that moves
+    an object to another corpus bumps both.
+    """
+    def get_corpus_id(self, instance):
+        return instance.id if isinstance(instance, Corpus) else instance.corpus_id
+
+    def perform_update(self, serializer):
+        corpus_id = self.get_corpus_id(serializer.instance)
+        super(VersionedWritesMixin, self).perform_update(serializer)
+        bump([corpus_id, self.get_corpus_id(serializer.instance)])
+
+    def perform_destroy(self, instance):
+        corpus_id = self.get_corpus_id(instance)
+        super(VersionedWritesMixin, self).perform_destroy(instance)
+        if not isinstance(instance, Corpus):
+            bump([corpus_id])
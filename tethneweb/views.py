@@ -1,49 +1,114 @@
-from django.db.models import Max
 from django.contrib.auth.models import User
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework import serializers, viewsets
 from django.core.paginator import Paginator
 from rest_framework.response import Response
 from rest_framework.reverse import reverse_lazy
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 
 from django.shortcuts import render, get_object_or_404
 from django.template import RequestContext
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import JsonResponse
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import JsonResponse, StreamingHttpResponse
 from django.db.models.query_utils import Q
 from django.db.models import Count
+from django.db import transaction
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 
 from urlparse import urlparse, parse_qs, SplitResult
 from urllib import urlencode
 
 from tethneweb.models import *
 from tethneweb.filters import *
+from tethneweb.ids import allocator
+from tethneweb import counts, versions
+from tethneweb.versions import ConditionalGetMixin, VersionedWritesMixin
+from tethneweb.caching import CachedListMixin
+from tethneweb import caching, profiling
+from tethneweb.utils import TemplatedHyperlinkedModelSerializer, DynamicFieldsMixin
+from tethneweb.upload import GraphUploader, UploadError, UploadTooLarge, iter_records, \
+                             iter_chunks, iter_lines
+from tethneweb.checksums import existing_papers
+from tethneweb.export import EXPORTS, INCLUDES, export_rows, to_csv, to_ndjson
+from tethneweb.networks import NETWORKS, NetworkTooLarge, get_network, edge_rows, to_graphml
 
 import json
+import zlib
 
 
 def link_for(url_name, request, params):
-    url = reverse_lazy(url_name, request=request)
-    o = urlparse(url)
-    params.update({k: v[0] for k, v in parse_qs(o.query).iteritems()})
-    new = SplitResult(o.scheme, o.netloc, o.path, urlencode(params), '')
-    return new.geturl().lower()
-
-
-class AcceptsRequestSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Link to the list endpoint ``url_name``\, filtered by ``params``\. The
+    endpoint URL is only reversed and parsed once per request.
+    """
+    cache = getattr(request, '_link_prefixes', None)
+    if cache is None:
+        cache = {}
+        if request is not None:
+            request._link_prefixes = cache
+    if url_name not in cache:
+        o = urlparse(reverse_lazy(url_name, request=request))
+        cache[url_name] = (
+            SplitResult(o.scheme, o.netloc, o.path, '', '').geturl(),
+            {k: v[0] for k, v in parse_qs(o.query).iteritems()},
+        )
+    prefix, query = cache[url_name]
+    params.update(query)
+    return (prefix + '?' + urlencode(params)).lower()
+
+
+def metadata_list(corpus_counts):
+    """
+    The list endpoint for the metadata of a corpus with ``corpus_counts``\:
+    documents if the corpus was loaded with the document layout, otherwise
+    rows.
+    """
+    if corpus_counts.get('metadata_documents') and not corpus_counts.get('metadata'):
+        return 'instancemetadatadocument-list'
+    return 'instancemetadatum-list'
+
+
+def corpus_metadata_list(request, corpus_id):
+    """
+    :func:`metadata_list` for corpus ``corpus_id``\, looked up once per
+    request.
+    """
+    cache = getattr(request, '_metadata_lists', None)
+    if cache is None:
+        cache = {}
+        if request is not None:
+            request._metadata_lists = cache
+    if corpus_id not in cache:
+        cache[corpus_id] = metadata_list(dict(
+            CorpusCounter.objects.filter(corpus_id=corpus_id)
+                                 .values_list('name', 'value')))
+    return cache[corpus_id]
+
+
+class AcceptsRequestSerializer(TemplatedHyperlinkedModelSerializer):
     def __init__(self, *args, **kwargs):
-        self.request = kwargs.pop('request', None)
+        self._request = kwargs.pop('request', None)
         super(AcceptsRequestSerializer, self).__init__(*args, **kwargs)
 
+    @property
+    def request(self):
+        # Embedded serializers (see ``?expand=``) get the request from the
+        # serializer that they are embedded in.
+        return self._request or self.context.get('request')
+
 
-class InstanceIdentifierSerializer(serializers.HyperlinkedModelSerializer):
+class InstanceIdentifierSerializer(TemplatedHyperlinkedModelSerializer):
     class Meta:
         model = InstanceIdentifier
         fields = ('url', 'id', 'paper', 'name', 'value', 'corpus')
 
 
-class InstanceMetadatumSerializer(serializers.HyperlinkedModelSerializer):
+class InstanceMetadatumSerializer(TemplatedHyperlinkedModelSerializer):
     value = serializers.SerializerMethodField('unpickle_value')
 
     class Meta:
@@ -57,7 +122,42 @@ class InstanceMetadatumSerializer(serializers.HyperlinkedModelSerializer):
         return obj.value #str(pickle.loads(str(obj.value)))
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class PaperMetadataListSerializer(serializers.ListSerializer):
+    """
+    Expands the metadata of a paper in either layout. Metadata stored as a
+    document are given as one ``name``\/``value`` entry per key, with the
+    value encoded as in the document (see :mod:`tethneweb.metadata`\).
+    """
+    def get_attribute(self, paper):
+        return paper
+
+    def to_representation(self, paper):
+        entries = super(PaperMetadataListSerializer, self)\
+            .to_representation(paper.metadata.all())
+        try:
+            document = paper.metadata_document.document
+        except ObjectDoesNotExist:
+            return entries
+        return entries + [{'name': name, 'value': value}
+                          for name, value in sorted(document.iteritems())]
+
+
+class PaperMetadataSerializer(InstanceMetadatumSerializer):
+    class Meta(InstanceMetadatumSerializer.Meta):
+        list_serializer_class = PaperMetadataListSerializer
+
+
+class InstanceMetadataDocumentSerializer(TemplatedHyperlinkedModelSerializer):
+    """
+    Serves metadata stored in the document layout: one row per paper, with
+    values already encoded as JSON (see :mod:`tethneweb.metadata`\).
+    """
+    class Meta:
+        model = InstanceMetadataDocument
+        fields = ('url', 'id', 'paper', 'document', 'corpus',)
+
+
+class UserSerializer(TemplatedHyperlinkedModelSerializer):
     class Meta:
         model = User
         fields = ('url', 'id', 'username', 'email')
@@ -76,14 +176,14 @@ class AuthorInstanceSerializer(AcceptsRequestSerializer):
         return link_for('affiliationinstance-list', self.request, params)
 
 
-class InstitutionInstanceSerializer(serializers.HyperlinkedModelSerializer):
+class InstitutionInstanceSerializer(TemplatedHyperlinkedModelSerializer):
     class Meta:
         model = InstitutionInstance
         fields = ('url', 'id', 'paper', 'name', 'paper', 'department',
                   'address', 'state', 'city', 'zip', 'country', 'corpus',)
 
 
-class AffiliationInstanceSerializer(serializers.HyperlinkedModelSerializer):
+class AffiliationInstanceSerializer(TemplatedHyperlinkedModelSerializer):
     class Meta:
         model = AffiliationInstance
         fields = ('url', 'id', 'paper', 'author', 'institution', 'confidence',
@@ -99,6 +199,15 @@ class PaperInstanceSerializer(AcceptsRequestSerializer):
 
     identifiers = InstanceIdentifierSerializer(many=True)
 
+    expandable = {
+        'authors': ('author_instances', AuthorInstanceSerializer),
+        'institutions': ('institutions', InstitutionInstanceSerializer),
+        'affiliations': ('affiliations', AffiliationInstanceSerializer),
+        'metadata': ('metadata', PaperMetadataSerializer),
+        'identifiers': ('identifiers', InstanceIdentifierSerializer),
+    }
+    expand_prefetches = {'metadata': ['metadata_document']}
+
     class Meta:
         model = PaperInstance
         fields = ('url', 'id', 'corpus', 'publication_date', 'title', 'volume',
@@ -124,7 +233,8 @@ class PaperInstanceSerializer(AcceptsRequestSerializer):
 
     def metadatum_link(self, obj):
         params = {'paper': obj.id}
-        return link_for('instancemetadatum-list', self.request, params)
+        return link_for(corpus_metadata_list(self.request, obj.corpus_id),
+                        self.request, params)
 
 
 class CorpusSerializer(AcceptsRequestSerializer):
@@ -134,12 +244,16 @@ class CorpusSerializer(AcceptsRequestSerializer):
     institutions = serializers.SerializerMethodField('institution_instances_link')
     affiliations = serializers.SerializerMethodField('affiliation_instances_link')
     metadata = serializers.SerializerMethodField('metadatum_link')
+    counts = serializers.SerializerMethodField('corpus_counts')
 
     class Meta:
         model = Corpus
         fields = ('url', 'id', 'source', 'label', 'date_created', 'created_by',
                   'papers', 'citations', 'affiliations', 'authors',
-                  'institutions', 'metadata',)
+                  'institutions', 'metadata', 'counts',)
+
+    def corpus_counts(self, obj):
+        return counts.corpus_counts(obj)
 
     def papers_link(self, obj):
         params = {'corpus': obj.id, 'concrete': True}
@@ -163,7 +277,8 @@ class CorpusSerializer(AcceptsRequestSerializer):
 
     def metadatum_link(self, obj):
         params = {'corpus': obj.id}
-        return link_for('instancemetadatum-list', self.request, params)
+        return link_for(metadata_list(counts.corpus_counts(obj)),
+                        self.request, params)
 
 
 class PassRequestToSerializerMixin(object):
@@ -184,6 +299,50 @@ class PassRequestToSerializerMixin(object):
         return Response(serializer.data)
 
 
+class DynamicFieldsViewMixin(object):
+    """
+    Prefetches the relations that are expanded with ``?expand=``\, and
+    defers the columns that are left out with ``?fields=`` or ``?omit=`` (see
+    :class:`tethneweb.utils.DynamicFieldsMixin`\).
+    """
+    def get_queryset(self):
+        queryset = super(DynamicFieldsViewMixin, self).get_queryset()
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, DynamicFieldsMixin):
+            return queryset
+        for name in serializer_class.get_expansions(self.request):
+            queryset = queryset.prefetch_related(
+                serializer_class.expandable[name][0],
+                *serializer_class.expand_prefetches.get(name, []))
+        dropped = serializer_class.get_dropped_fields(self.request)
+        deferred = [field.name for field in queryset.model._meta.concrete_fields
+                    if field.name in dropped and not field.is_relation
+                    and not field.primary_key]
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        return queryset
+
+
+class CountedWritesMixin(object):
+    """
+    Updates the row counters of the corpus (see :mod:`tethneweb.counts`\)
+    when an ``update()`` moves an object to another corpus or counter (e.g.
+    sets ``concrete``\), and once for everything that a ``destroy()``
+    deletes.
+    """
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        with transaction.atomic():
+            before = counts.tally(type(instance), [instance])
+            super(CountedWritesMixin, self).perform_update(serializer)
+            counts.record_update(type(instance), before, [instance])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            deleted, rows = instance.delete()
+            counts.record_delete(instance, rows)
+
+
 class CreatorOnlyMixin(viewsets.ModelViewSet):
     def get_queryset(self):
         qs = super(CreatorOnlyMixin, self).get_queryset()
@@ -195,127 +354,133 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
 
 
-class CorpusViewSet(PassRequestToSerializerMixin, CreatorOnlyMixin, viewsets.ModelViewSet):
-    queryset = Corpus.objects.all()
+class CorpusViewSet(ConditionalGetMixin, CachedListMixin,
+                    DynamicFieldsViewMixin, PassRequestToSerializerMixin,
+                    VersionedWritesMixin, CountedWritesMixin,
+                    CreatorOnlyMixin, viewsets.ModelViewSet):
+    queryset = Corpus.objects.prefetch_related('counters')
     serializer_class = CorpusSerializer
 
     def create(self, request):
-        max_id = Corpus.objects.aggregate(Max('id'))['id__max']
-        if max_id:
-            max_id += 1
-        else:
-            max_id = 1
         corpus = Corpus.objects.create(**{
             'created_by': request.user,
             'source': request.POST.get('source'),
-            'id': max_id,
+            'id': allocator.next_id(Corpus),
             'label': request.POST.get('label'),
         })
         serializer = self.get_serializer(corpus, request=request)
         return Response(serializer.data)
 
 
-class AuthorInstanceViewSet(PassRequestToSerializerMixin, CreatorOnlyMixin, viewsets.ModelViewSet):
+class AuthorInstanceViewSet(ConditionalGetMixin, CachedListMixin,
+                            DynamicFieldsViewMixin,
+                            PassRequestToSerializerMixin,
+                            VersionedWritesMixin, CountedWritesMixin,
+                            CreatorOnlyMixin, viewsets.ModelViewSet):
     queryset = AuthorInstance.objects.all()
     serializer_class = AuthorInstanceSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = AuthorInstanceFilter
 
     def create(self, request):
-        max_id = AuthorInstance.objects.aggregate(Max('id'))['id__max']
-        if max_id:
-            max_id += 1
-        else:
-            max_id = 1
         data = json.loads(request.POST.get('data'))
         id_map = {}
         if type(data) is list and len(data) > 0:
+            new_ids = iter(allocator.reserve(AuthorInstance, len(data)))
             instances = []
             for datum in data:
                 for field in ['first_name', 'last_name']:
                     if len(datum.get(field, '')) > 255:
                         datum[field] = datum.get(field, '')[:255]
+                new_id = next(new_ids)
                 temp_ident = datum.pop('id')
-                id_map[temp_ident] = max_id
-                datum.update({'id': max_id, 'created_by': request.user})
-                max_id += 1
+                id_map[temp_ident] = new_id
+                datum.update({'id': new_id, 'created_by': request.user})
                 instances.append(AuthorInstance(**datum))
-            AuthorInstance.objects.bulk_create(instances)
+            with transaction.atomic():
+                AuthorInstance.objects.bulk_create(instances)
+                counts.record(AuthorInstance, instances)
+                versions.bump([instance.corpus_id for instance in instances])
         return Response({'id_map': id_map})
 
 
-class InstitutionInstanceViewSet(CreatorOnlyMixin, viewsets.ModelViewSet):
+class InstitutionInstanceViewSet(ConditionalGetMixin, CachedListMixin,
+                                 DynamicFieldsViewMixin,
+                                 VersionedWritesMixin, CountedWritesMixin,
+                                 CreatorOnlyMixin, viewsets.ModelViewSet):
     queryset = InstitutionInstance.objects.all()
     serializer_class = InstitutionInstanceSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = InstitutionInstanceFilter
 
     def create(self, request):
-        max_id = InstitutionInstance.objects.aggregate(Max('id'))['id__max']
-        if max_id:
-            max_id += 1
-        else:
-            max_id = 1
         data = json.loads(request.POST.get('data'))
         id_map = {}
         if type(data) is list and len(data) > 0:
+            new_ids = iter(allocator.reserve(InstitutionInstance, len(data)))
             instances = []
             for datum in data:
+                new_id = next(new_ids)
                 temp_ident = datum.pop('id')
-                id_map[temp_ident] = max_id
-                datum.update({'id': max_id, 'created_by': request.user})
-                max_id += 1
+                id_map[temp_ident] = new_id
+                datum.update({'id': new_id, 'created_by': request.user})
                 instances.append(InstitutionInstance(**datum))
-            InstitutionInstance.objects.bulk_create(instances)
+            with transaction.atomic():
+                InstitutionInstance.objects.bulk_create(instances)
+                counts.record(InstitutionInstance, instances)
+                versions.bump([instance.corpus_id for instance in instances])
         return Response({'id_map': id_map})
 
 
-class AffiliationInstanceViewSet(CreatorOnlyMixin, viewsets.ModelViewSet):
+class AffiliationInstanceViewSet(ConditionalGetMixin, CachedListMixin,
+                                 DynamicFieldsViewMixin,
+                                 VersionedWritesMixin, CountedWritesMixin,
+                                 CreatorOnlyMixin, viewsets.ModelViewSet):
     queryset = AffiliationInstance.objects.all()
     serializer_class = AffiliationInstanceSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = AffiliationInstanceFilter
 
     def create(self, request):
-        max_id = AffiliationInstance.objects.aggregate(Max('id'))['id__max']
-        if max_id:
-            max_id += 1
-        else:
-            max_id = 1
         data = json.loads(request.POST.get('data'))
         id_map = {}
         if type(data) is list and len(data) > 0:
+            new_ids = iter(allocator.reserve(AffiliationInstance, len(data)))
             instances = []
             for datum in data:
+                new_id = next(new_ids)
                 temp_ident = datum.pop('id')
-                id_map[temp_ident] = max_id
-                datum.update({'id': max_id, 'created_by': request.user})
-                max_id += 1
+                id_map[temp_ident] = new_id
+                datum.update({'id': new_id, 'created_by': request.user})
                 instances.append(AffiliationInstance(**datum))
-            AffiliationInstance.objects.bulk_create(instances)
+            with transaction.atomic():
+                AffiliationInstance.objects.bulk_create(instances)
+                counts.record(AffiliationInstance, instances)
+                versions.bump([instance.corpus_id for instance in instances])
         return Response({'id_map': id_map})
 
 
-class PaperInstanceViewSet(PassRequestToSerializerMixin, CreatorOnlyMixin, viewsets.ModelViewSet):
-    queryset = PaperInstance.objects.all()
+class PaperInstanceViewSet(ConditionalGetMixin, CachedListMixin,
+                           DynamicFieldsViewMixin,
+                           PassRequestToSerializerMixin,
+                           VersionedWritesMixin, CountedWritesMixin,
+                           CreatorOnlyMixin, viewsets.ModelViewSet):
+    queryset = PaperInstance.objects.prefetch_related('identifiers')
     serializer_class = PaperInstanceSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = PaperInstanceFilter
 
     def create(self, request):
-        max_id = PaperInstance.objects.aggregate(Max('id'))['id__max']
-        if max_id:
-            max_id += 1
-        else:
-            max_id = 1
         data = json.loads(request.POST.get('data'))
         id_map = {}
         if type(data) is list and len(data) > 0:
+            new_ids = iter(allocator.reserve(PaperInstance, len(data)))
             instances = []
             for datum in data:
+                new_id = next(new_ids)
                 temp_ident = datum.pop('id')
-                id_map[temp_ident] = max_id
-                datum.update({'id': max_id, 'created_by': request.user})
+                id_map[temp_ident] = new_id
+                datum.update({'id': new_id, 'created_by': request.user})
                 for field in ['title', 'journal']:
                     if len(datum.get(field, '')) > 255:
                         datum[field] = datum.get(field, '')[:255]
@@ -327,96 +492,382 @@ class PaperInstanceViewSet(PassRequestToSerializerMixin, CreatorOnlyMixin, views
                 if 'cited_by_id' in datum:
                     ident = datum['cited_by_id']
                     datum['cited_by_id'] = id_map.get(ident, ident)
-                max_id += 1
                 instances.append(PaperInstance(**datum))
-            PaperInstance.objects.bulk_create(instances)
+            with transaction.atomic():
+                PaperInstance.objects.bulk_create(instances)
+                counts.record(PaperInstance, instances)
+                versions.bump([instance.corpus_id for instance in instances])
         return Response({'id_map': id_map})
 
 
-class InstanceMetadatumViewSet(CreatorOnlyMixin, viewsets.ModelViewSet):
+class InstanceMetadatumViewSet(ConditionalGetMixin, CachedListMixin,
+                               DynamicFieldsViewMixin,
+                               VersionedWritesMixin, CountedWritesMixin,
+                               CreatorOnlyMixin, viewsets.ModelViewSet):
     queryset = InstanceMetadatum.objects.all()
     serializer_class = InstanceMetadatumSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = InstanceMetadatumFilter
 
     def create(self, request):
-        max_id = InstanceMetadatum.objects.aggregate(Max('id'))['id__max']
-        if max_id:
-            max_id += 1
-        else:
-            max_id = 1
         data = json.loads(request.POST.get('data'))
         id_map = {}
         if type(data) is list and len(data) > 0:
+            new_ids = iter(allocator.reserve(InstanceMetadatum, len(data)))
             instances = []
             for datum in data:
                 for field in ['name']:
                     if len(datum.get(field, '')) > 255:
                         datum[field] = datum.get(field, '')[:255]
+                new_id = next(new_ids)
                 temp_ident = datum.pop('id')
-                id_map[temp_ident] = max_id
-                datum.update({'id': max_id, 'created_by': request.user})
-                max_id += 1
+                id_map[temp_ident] = new_id
+                datum.update({'id': new_id, 'created_by': request.user})
                 instances.append(InstanceMetadatum(**datum))
-            InstanceMetadatum.objects.bulk_create(instances)
+            with transaction.atomic():
+                InstanceMetadatum.objects.bulk_create(instances)
+                counts.record(InstanceMetadatum, instances)
+                versions.bump([instance.corpus_id for instance in instances])
         return Response({'id_map': id_map})
 
 
-class InstanceIdentifierViewSet(CreatorOnlyMixin, viewsets.ModelViewSet):
+class InstanceMetadataDocumentViewSet(ConditionalGetMixin, CachedListMixin,
+                                      DynamicFieldsViewMixin, CreatorOnlyMixin,
+                                      viewsets.ReadOnlyModelViewSet):
+    queryset = InstanceMetadataDocument.objects.all()
+    serializer_class = InstanceMetadataDocumentSerializer
+    filter_backends = (filters.DjangoFilterBackend,)
+    filter_class = InstanceMetadataDocumentFilter
+
+
+class InstanceIdentifierViewSet(ConditionalGetMixin, CachedListMixin,
+                                DynamicFieldsViewMixin,
+                                VersionedWritesMixin, CountedWritesMixin,
+                                CreatorOnlyMixin, viewsets.ModelViewSet):
     queryset = InstanceIdentifier.objects.all()
     serializer_class = InstanceIdentifierSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = InstanceIdentifierFilter
 
     def create(self, request):
-        max_id = InstanceIdentifier.objects.aggregate(Max('id'))['id__max']
-        if max_id:
-            max_id += 1
-        else:
-            max_id = 1
         data = json.loads(request.POST.get('data'))
         id_map = {}
         if type(data) is list and len(data) > 0:
+            new_ids = iter(allocator.reserve(InstanceIdentifier, len(data)))
             instances = []
             for datum in data:
                 for field in ['name', 'value']:
                     if len(datum.get(field, '')) > 255:
                         datum[field] = datum.get(field, '')[:255]
+                new_id = next(new_ids)
                 temp_ident = datum.pop('id')
-                id_map[temp_ident] = max_id
-                datum.update({'id': max_id, 'created_by': request.user})
-                max_id += 1
+                id_map[temp_ident] = new_id
+                datum.update({'id': new_id, 'created_by': request.user})
                 instances.append(InstanceIdentifier(**datum))
 
-            InstanceIdentifier.objects.bulk_create(instances)
+            with transaction.atomic():
+                InstanceIdentifier.objects.bulk_create(instances)
+                counts.record(InstanceIdentifier, instances)
+                versions.bump([instance.corpus_id for instance in instances])
 
         return Response({'id_map': id_map})
 
 
 
+def requested_corpus(request):
+    """
+    The corpus given by ``?corpus=``\, if the user created it. A missing or
+    non-numeric ID is a ``400``\, and someone else's corpus a ``404``\.
+    """
+    try:
+        corpus_id = int(request.query_params.get('corpus'))
+    except (TypeError, ValueError):
+        raise ValidationError({'corpus': 'Must be the ID of a corpus.'})
+    return get_object_or_404(Corpus, pk=corpus_id, created_by=request.user)
+
+
+class BulkUploadView(APIView):
+    """
+    Creates papers, citations, authors, institutions, affiliations,
+    identifiers and metadata in the corpus given by ``?corpus=``\, from one
+    JSON or NDJSON body (optionally gzip-compressed) in which records refer to
+    each other by temporary IDs. See :mod:`tethneweb.upload`\.
+
+    A body or NDJSON line larger than the ``BULK_UPLOAD_MAX_*`` settings is a
+    ``413``\.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        corpus = requested_corpus(request)
+        content_type = request.META.get('CONTENT_TYPE', '').split(';')[0].strip()
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if request.stream is None:
+            return Response({'error': 'empty body'}, status=400)
+        ndjson = content_type != 'application/json'
+        records = iter_records(request.stream, ndjson=ndjson,
+                               gzipped=encoding == 'gzip',
+                               max_size=settings.BULK_UPLOAD_MAX_BYTES if ndjson
+                                        else settings.BULK_UPLOAD_MAX_ARRAY_BYTES,
+                               max_line=settings.BULK_UPLOAD_MAX_LINE_BYTES)
+
+        uploader = GraphUploader(corpus, request.user)
+        try:
+            id_map = uploader.upload(records)
+        except UploadTooLarge as E:
+            return Response({'error': str(E)}, status=413)
+        except UploadError as E:
+            return Response({'error': str(E), 'line': E.line}, status=400)
+        except zlib.error as E:
+            return Response({'error': 'invalid gzip body (%s)' % E}, status=400)
+        return Response({'id_map': id_map, 'counts': uploader.counts})
+
+
+class ExportView(APIView):
+    """
+    Streams every row of one ``?type=`` (``paper`` by default; see
+    :data:`tethneweb.export.EXPORTS`\) in the corpus given by ``?corpus=``\,
+    as NDJSON (``?output=ndjson``\, the default) or CSV (``?output=csv``\).
+    Papers can be limited with ``?concrete=true|false``\, and can embed their
+    ``?include=authors,identifiers,affiliations``\. See
+    :mod:`tethneweb.export`\.
+    """
+    permission_classes = (IsAuthenticated,)
+    outputs = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    def get(self, request):
+        corpus = requested_corpus(request)
+        kind = request.query_params.get('type', 'paper')
+        if kind not in EXPORTS:
+            return Response({'error': 'type must be one of %s' % ', '.join(EXPORTS)},
+                            status=400)
+        output = request.query_params.get('output', 'ndjson')
+        if output not in self.outputs:
+            return Response({'error': 'output must be one of %s' % ', '.join(self.outputs)},
+                            status=400)
+        include = [name for name
+                   in request.query_params.get('include', '').split(',') if name]
+        if include and kind != 'paper':
+            return Response({'error': 'include is only allowed for papers'},
+                            status=400)
+        unknown = set(include) - set(INCLUDES)
+        if unknown:
+            return Response({'error': 'cannot include %s' % ', '.join(sorted(unknown))},
+                            status=400)
+
+        filters = {}
+        concrete = request.query_params.get('concrete')
+        if kind == 'paper' and concrete in ('true', 'false'):
+            filters['concrete'] = concrete == 'true'
+
+        rows = export_rows(corpus, kind, include=include, filters=filters)
+        if output == 'csv':
+            lines = to_csv(rows, EXPORTS[kind][1] + include)
+        else:
+            lines = to_ndjson(rows)
+        response = StreamingHttpResponse(lines, content_type=self.outputs[output])
+        response['Content-Disposition'] = 'attachment; filename="corpus-%i-%s.%s"' % \
+                                          (corpus.id, kind, output)
+        return response
+
+
+class NetworkView(APIView):
+    """
+    Builds a network of one ``?type=`` (see
+    :data:`tethneweb.networks.NETWORKS`\) from the corpus given by
+    ``?corpus=``\, and streams it as GraphML (``?output=graphml``\, the
+    default), or as edges in CSV or NDJSON (``?output=csv|ndjson``\). Only
+    papers published from ``?start=`` to ``?end=`` (years, inclusive; either
+    may be left out) are used, and edges lighter than ``?min_weight=`` are
+    left out. See :mod:`tethneweb.networks`\.
+    """
+    permission_classes = (IsAuthenticated,)
+    outputs = {
+        'graphml': 'application/graphml+xml',
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def get(self, request):
+        corpus = requested_corpus(request)
+        kind = request.query_params.get('type', 'direct_citation')
+        if kind not in NETWORKS:
+            return Response({'error': 'type must be one of %s' % ', '.join(NETWORKS)},
+                            status=400)
+        output = request.query_params.get('output', 'graphml')
+        if output not in self.outputs:
+            return Response({'error': 'output must be one of %s' % ', '.join(self.outputs)},
+                            status=400)
+        try:
+            years = tuple([int(request.query_params[name])
+                           if request.query_params.get(name) else None
+                           for name in ('start', 'end')])
+            min_weight = float(request.query_params.get('min_weight', 0))
+        except ValueError:
+            return Response({'error': 'start and end must be integers, and'
+                                      ' min_weight a number'},
+                            status=400)
+
+        try:
+            network = get_network(corpus, kind,
+                                  None if years == (None, None) else years)
+        except NetworkTooLarge as E:
+            return Response({'error': str(E)}, status=400)
+        if min_weight:
+            network = network.threshold(min_weight)
+
+        if output == 'graphml':
+            lines = to_graphml(network)
+        elif output == 'csv':
+            lines = to_csv(edge_rows(network), ['source', 'target', 'weight'])
+        else:
+            lines = to_ndjson(edge_rows(network))
+        response = StreamingHttpResponse(lines, content_type=self.outputs[output])
+        response['Content-Disposition'] = 'attachment; filename="corpus-%i-%s.%s"' % \
+                                          (corpus.id, kind, output)
+        return response
+
+
+class CacheStatsView(APIView):
+    """
+    Hits and misses of the list response cache (see :mod:`tethneweb.caching`\),
+    for the requests of every user. With the default local-memory cache, they
+    are counted separately in each process, and only those of the process
+    that answers are returned.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(caching.stats())
+
+
+class ProfileStatsView(APIView):
+    """
+    Mean query counts and timings of a sample of requests to each view, in
+    this process (see :mod:`tethneweb.profiling`\). DELETE starts over.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        if not settings.PROFILE_REQUESTS:
+            return Response({'enabled': False})
+        stats = profiling.view_stats.as_dict()
+        stats['enabled'] = True
+        return Response(stats)
+
+    def delete(self, request):
+        profiling.view_stats.reset()
+        return Response(status=204)
+
+
 def home(request):
     template = "tethneweb/home.html"
+    totals = counts.totals()
     context = RequestContext(request, {
-        'paper_count': PaperInstance.objects.filter(concrete=True).count(),
-        'citation_count': PaperInstance.objects.filter(concrete=False).count(),
-        'author_count': AuthorInstance.objects.count()
+        'paper_count': totals.get('papers', 0),
+        'citation_count': totals.get('citations', 0),
+        'author_count': totals.get('authors', 0),
     })
 
     return render(request, template, context)
 
 
+def _read_checksums(request):
+    """
+    The checksums in the body of a ``check_unique`` POST, and the corpus ID
+    (from the body or the query string). All of the checksums are held in
+    memory, so the body is limited as a JSON array upload is.
+    """
+    content_type = request.META.get('CONTENT_TYPE', '').split(';')[0].strip()
+    if content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        return request.POST.getlist('checksum'), request.POST.get('corpus')
+
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+    chunks = iter_chunks(request, gzipped=encoding == 'gzip',
+                         max_size=settings.BULK_UPLOAD_MAX_ARRAY_BYTES)
+    corpus_id = request.GET.get('corpus')
+    if content_type == 'application/json':
+        data = json.loads(''.join(chunks))
+        if type(data) is dict:
+            corpus_id = data.get('corpus', corpus_id)
+            data = data.get('checksums')
+        if type(data) is not list:
+            raise ValueError('expected a list of checksums')
+        if not all([isinstance(checksum, basestring) for checksum in data]):
+            raise ValueError('checksums must be strings')
+        return data, corpus_id
+    # Anything else is one checksum per line, read as it arrives.
+    lines = iter_lines(chunks, max_line=settings.BULK_UPLOAD_MAX_LINE_BYTES)
+    return [line.strip() for line in lines if line.strip()], corpus_id
+
+
+def _authenticated_user(request):
+    """
+    The user of a request to a plain Django view, logged in with a session
+    or (as with the REST views) authenticated by a token; or None.
+    """
+    if request.user.is_authenticated():
+        return request.user
+    try:
+        authenticated = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return authenticated[0] if authenticated else None
+
+
 @csrf_exempt
 def check_unique(request):
+    """
+    Checks whether papers with given checksums are already in a corpus.
+
+    A GET takes one ``?checksum=`` and ``?corpus=``\, and returns ``unique``
+    (and, to the creator of the corpus, the ``id`` of the existing paper, or
+    ``null``\).
+
+    A POST takes any number of checksums, as form fields (``checksum``\,
+    repeated, and ``corpus``\), a JSON body (``{"corpus": 1, "checksums":
+    [...]}``\, or a list with ``?corpus=``\), or one checksum per line with
+    ``?corpus=``\. JSON and line bodies may be gzip-compressed
+    (``Content-Encoding: gzip``\). It returns ``unique`` (and ``ids``\, to
+    the creator of the corpus), in the order of the checksums. All of the
+    checksums are looked up together (see
+    :func:`tethneweb.checksums.existing_papers`\).
+
+    Anyone may check any corpus, as before, but the IDs of existing papers
+    are only returned to its creator, logged in with a session or a REST API
+    token.
+    """
+    user = _authenticated_user(request)
+    try:
+        if request.method == 'GET':
+            checksums = [request.GET.get('checksum')]
+            corpus_id = request.GET.get('corpus')
+        elif request.method == 'POST':
+            checksums, corpus_id = _read_checksums(request)
+        else:
+            return JsonResponse({'error': 'GET or POST only'}, status=405)
+        corpus_id = int(corpus_id)
+    except UploadTooLarge as E:
+        return JsonResponse({'error': str(E)}, status=413)
+    except (ValueError, TypeError, zlib.error) as E:
+        return JsonResponse({'error': str(E)}, status=400)
+    creator = Corpus.objects.filter(pk=corpus_id)\
+                            .values_list('created_by_id', flat=True).first()
+    if creator is None:
+        return JsonResponse({'error': 'No such corpus'}, status=404)
+    owner = user is not None and user.id == creator
+
+    existing = existing_papers(corpus_id, checksums)
+    ids = [existing.get(checksum) for checksum in checksums]
     if request.method == 'GET':
-        checksum = request.GET.get('checksum')
-        corpus_id = request.GET.get('corpus')
-        unique = PaperInstance.objects.filter(checksum=checksum, corpus=corpus_id).count() == 0
-        return JsonResponse({'unique': unique})
-    elif request.method == 'POST':
-        checksums = request.POST.getlist('checksum')
-        corpus_id = request.POST.get('corpus')
-        return JsonResponse({
-            'unique': [
-                PaperInstance.objects.filter(checksum=checksum, corpus=corpus_id).count() == 0
-                for checksum in checksums
-            ]})
+        data = {'unique': ids[0] is None}
+        if owner:
+            data['id'] = ids[0]
+        return JsonResponse(data)
+    data = {'unique': [paper_id is None for paper_id in ids]}
+    if owner:
+        data['ids'] = ids
+    return JsonResponse(data)